@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# Run BlenderFDS voxelization benchmarks <http://blenderfds.org/>.
+# Copyright (C) 2016 Emanuele Gissi
+# Released under the terms of the GNU GPL version 3 or any later version.
+
+# Benchmark
+# - voxelize parametric meshes (spheres, stairs, perforated slabs, building shells)
+#   at several resolutions, with each voxel merging strategy
+# - when run inside Blender, also voxelize the VOXELS objects of the open file:
+#   blender examples/plume/plume.blend --background --python dev/bench_voxels.py -- -o bench.json
+# - record time per stage, box count and peak memory, in JSON
+# - compare with a baseline JSON, exit with 1 on regressions
+
+"""Voxelization benchmarks."""
+
+import os, sys, json, argparse, tracemalloc
+from time import perf_counter
+
+import numpy as np
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+# The kernels do not depend on Blender, import them as a standalone package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "zzz_blenderfds", "geometry"))
+from kernels.voxelize import get_box_tris, get_surface_runs
+from kernels.tiles import voxelize_tiled
+from kernels.sparse import SparseGrid
+
+strategies = "SWEEP", "GREEDY"
+stages = "tris", "voxelize", "grid", "boxes"
+
+# Parametric meshes, in m
+
+def _boxes_to_tris(boxes) -> "tris":
+    """Get the triangles of non overlapping boxes [(x0, x1, y0, y1, z0, z1), ...]."""
+    return np.concatenate([get_box_tris(b[0::2], b[1::2]) for b in boxes])
+
+def get_sphere(r=1., n=64) -> "tris":
+    """Get a UV sphere of radius r, with n rings."""
+    th, ph = np.linspace(0., np.pi, n), np.linspace(0., 2. * np.pi, 2 * n)
+    def points(t, p):
+        return np.stack(np.broadcast_arrays(np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)), -1)
+    a, b = points(th[:-1, None], ph[None, :-1]), points(th[1:, None], ph[None, :-1])
+    c, d = points(th[1:, None], ph[None, 1:]), points(th[:-1, None], ph[None, 1:])
+    return np.concatenate((
+        np.stack((a, b, c), -2).reshape(-1, 3, 3), np.stack((a, c, d), -2).reshape(-1, 3, 3),
+    )) * r
+
+def get_stairs(steps=20, run=.3, rise=.18, width=1.2) -> "tris":
+    """Get a straight flight of stairs, one column box for each step."""
+    return _boxes_to_tris([
+        (i * run, (i + 1) * run, 0., width, 0., (i + 1) * rise) for i in range(steps)
+    ])
+
+def get_perforated_slab(cells=20, cell=.5, thickness=.2) -> "tris":
+    """Get a square slab with a hole in every other cell."""
+    return _boxes_to_tris([
+        (i * cell, (i + 1) * cell, j * cell, (j + 1) * cell, 0., thickness)
+        for i in range(cells) for j in range(cells) if (i % 2 or j % 2)
+    ])
+
+def get_building_shell(storeys=4, size=(12., 8.), height=3., wall=.3, windows=4) -> "tris":
+    """Get the walls with window openings and the slabs of a building."""
+    sx, sy = size
+    boxes = list()
+    for s in range(storeys):
+        z0 = s * height
+        # Slab, inside the walls
+        boxes.append((wall, sx - wall, wall, sy - wall, z0, z0 + wall))
+        # Walls along x, full length, and along y, between them, split in piers by windows
+        for y0 in (0., sy - wall):
+            boxes.extend(_get_piers(0., sx, windows, lambda a, b: (a, b, y0, y0 + wall, z0, z0 + height)))
+        for x0 in (0., sx - wall):
+            boxes.extend(_get_piers(wall, sy - wall, windows, lambda a, b: (x0, x0 + wall, a, b, z0, z0 + height)))
+    return _boxes_to_tris(boxes)
+
+def _get_piers(start, end, windows, to_box) -> "boxes":
+    """Split a wall from start to end in piers, leaving windows openings."""
+    step = (end - start) / (2 * windows + 1)
+    return [to_box(start + 2 * i * step, start + (2 * i + 1) * step) for i in range(windows + 1)]
+
+cases = (
+    # name, tris, voxel sizes
+    ("sphere", lambda: get_sphere(1., 64), (.1, .05, .025)),
+    ("sphere_fine", lambda: get_sphere(1., 256), (.05, .02)),
+    ("stairs", lambda: get_stairs(), (.1, .05, .02)),
+    ("perforated_slab", lambda: get_perforated_slab(), (.1, .05, .025)),
+    ("building_shell", lambda: get_building_shell(), (.2, .1, .05)),
+)
+
+# Run
+
+def _measure(fn) -> "result, peak memory in bytes":
+    """Run fn for its result and timing, then again tracing its peak memory, as tracing slows it down."""
+    result = fn()
+    tracemalloc.start()
+    try:
+        fn()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_tris(name, get_tris, voxel_size, strategy, processes=None) -> "record":
+    """Benchmark the voxelization of a parametric mesh."""
+    def run():
+        t0 = perf_counter()
+        tris = get_tris()
+        t1 = perf_counter()
+        runs = np.concatenate((
+            voxelize_tiled(tris, voxel_size, processes=processes),
+            get_surface_runs(tris, voxel_size),
+        ))
+        t2 = perf_counter()
+        grid = SparseGrid.from_runs(runs)
+        t3 = perf_counter()
+        boxes = grid.boxes(greedy=strategy == "GREEDY")
+        t4 = perf_counter()
+        return len(tris), grid.count(), len(boxes), (t1-t0, t2-t1, t3-t2, t4-t3)
+    (tris_count, voxels, boxes, timing), peak = _measure(run)
+    return _get_record(name, voxel_size, strategy, tris_count, voxels, boxes, timing, peak)
+
+def bench_object(context, ob, strategy) -> "record":
+    """Benchmark the voxelization of a Blender object, with the addon get_voxels."""
+    from zzz_blenderfds.geometry import calc_voxels
+    saved_strategy = context.scene.bf_config_voxel_strategy
+    context.scene.bf_config_voxel_strategy = strategy
+    try:
+        (boxes, origin, voxel_size, timing), peak = _measure(lambda: calc_voxels.get_voxels(context, ob))
+    finally:
+        context.scene.bf_config_voxel_strategy = saved_strategy
+    voxels = int((np.prod(boxes[:, 1::2] - boxes[:, 0::2], axis=1)).sum())
+    return _get_record("blend:" + ob.name, voxel_size, strategy, None, voxels, len(boxes), timing, peak)
+
+def _get_record(name, voxel_size, strategy, tris_count, voxels, boxes, timing, peak) -> "record":
+    return {
+        "case": name,
+        "voxel_size": float(voxel_size),
+        "strategy": strategy,
+        "tris": tris_count,
+        "voxels": int(voxels),
+        "boxes": int(boxes),
+        "times": dict(zip(stages, timing)),
+        "total_time": sum(timing),
+        "peak_mb": peak / 1E6,
+    }
+
+def run_all(quick=False, repeat=1, processes=None) -> "records":
+    """Run all benchmarks, keep the fastest of repeat runs."""
+    jobs = list()
+    for name, get_tris, voxel_sizes in cases:
+        for voxel_size in (quick and voxel_sizes[:1] or voxel_sizes):
+            for strategy in strategies:
+                jobs.append(lambda n=name, g=get_tris, v=voxel_size, s=strategy: bench_tris(n, g, v, s, processes))
+    if bpy:
+        context = bpy.context
+        for ob in context.scene.objects:
+            if ob.type == "MESH" and ob.bf_xb == "VOXELS":
+                for strategy in strategies:
+                    jobs.append(lambda ob=ob, s=strategy: bench_object(context, ob, s))
+    records = list()
+    for job in jobs:
+        record = min((job() for _ in range(repeat)), key=lambda r: r["total_time"])
+        print("{case:>20} {voxel_size:6.3f} {strategy:>6}: {boxes:7d} boxes, {total_time:7.3f} s, {peak_mb:7.1f} MB".format(**record))
+        records.append(record)
+    return records
+
+def compare(records, baseline, tolerance=.2) -> "regressions":
+    """Compare records with baseline records, return regression messages."""
+    baseline = {(r["case"], r["voxel_size"], r["strategy"]): r for r in baseline}
+    regressions = list()
+    for record in records:
+        key = record["case"], record["voxel_size"], record["strategy"]
+        ref = baseline.get(key)
+        if not ref:
+            continue
+        msg = "{0[0]} {0[1]:.3f} {0[2]}".format(key)
+        if record["voxels"] != ref["voxels"]:
+            regressions.append("{}: voxels {} != {}".format(msg, record["voxels"], ref["voxels"]))
+        if record["boxes"] > ref["boxes"]:
+            regressions.append("{}: boxes {} > {}".format(msg, record["boxes"], ref["boxes"]))
+        for label in ("total_time", "peak_mb"):
+            if record[label] > ref[label] * (1. + tolerance):
+                regressions.append("{}: {} {:.3f} > {:.3f}".format(msg, label, record[label], ref[label]))
+    return regressions
+
+def main():
+    argv = "--" in sys.argv and sys.argv[sys.argv.index("--") + 1:] or sys.argv[1:]  # Blender passes args after --
+    parser = argparse.ArgumentParser(description="BlenderFDS voxelization benchmarks")
+    parser.add_argument("-o", "--output", help="write records to this JSON file")
+    parser.add_argument("-b", "--baseline", help="compare records with this baseline JSON file")
+    parser.add_argument("-t", "--tolerance", type=float, default=.2, help="allowed relative time and memory increase")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="keep the fastest of repeated runs")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="voxelization processes")
+    parser.add_argument("-q", "--quick", action="store_true", help="only the coarsest resolution")
+    args = parser.parse_args(argv)
+    records = run_all(quick=args.quick, repeat=args.repeat, processes=args.processes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(records, f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(records, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        print("\nbench_voxels.py: {} regressions.".format(len(regressions)))
+        if regressions:
+            sys.exit(1)
+    print("\nbench_voxels.py: Done.")
+
+
+if __name__ == "__main__":
+    main()
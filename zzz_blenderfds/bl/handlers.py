@@ -3,6 +3,7 @@
 import bpy
 
 from .. import fds
+from .. import geometry
 from .. import config
 
 DEBUG = False
@@ -101,8 +102,21 @@ def _scene_update_post(context):
         for ob in bpy.data.objects:
             # is_updated -> object, is_updated_data -> its mesh
             if ob.is_updated: # or ob.is_updated_data: less actions, no check on mesh update...
-                ob["ob_to_xbs_cache"] = False
+                # Voxels are checked at next use, as they can be translated if only moved
+                if ob.get("ob_to_xbs_cache") and ob.bf_xb in ("VOXELS", "PIXELS"):
+                    ob["ob_to_xbs_cache_moved"] = True
+                else:
+                    ob["ob_to_xbs_cache"] = False
                 ob["ob_to_xyzs_cache"] = False
                 ob["ob_to_pbs_cache"] = False
+                geometry.to_fds.del_xbs_estimate_cache(ob)
+                geometry.to_fds.del_geom_cache(ob)
                 DEBUG and print("BFDS: _scene_update_post: deleted all cached geometry:", ob.name)
+                # Objects voxelized or decimated at MESH resolution depend on MESH objects
+                if ob.bf_namelist_cls == "ON_MESH":
+                    geometry.to_fds.del_xbs_estimate_cache()
+                    geometry.to_fds.del_geom_cache()  # decimated GEOMs
+                    for ob_voxel in bpy.data.objects:
+                        if ob_voxel.bf_xb == "VOXELS" and ob_voxel.bf_xb_mesh_voxel:
+                            ob_voxel["ob_to_xbs_cache"] = False
 
@@ -11,7 +11,7 @@ from ..exceptions import BFException
 from .. import fds
 from .. import geometry
 from ..utils import is_writable, write_to_file
-from ..geometry.calc_trisurfaces import check_intersections
+from ..geometry.calc_trisurfaces import check_intersections, check_scene_intersections
 
 
 DEBUG = False
@@ -181,6 +181,22 @@ class SCENE_OT_bf_check_intersections(Operator):  # TODO test
         self.report({"INFO"}, "No intersection")
         return {'FINISHED'}
 
+class SCENE_OT_bf_check_scene_intersections(Operator):
+    bl_label = "Get scene intersections"
+    bl_idname = "scene.bf_check_scene_intersections"
+    bl_description = "Get intersections between all exported GEOM objects"
+
+    def execute(self, context):
+        obs = [ob for ob in context.scene.objects
+            if ob.type == "MESH" and ob.bf_export and ob.bf_namelist_cls == "ON_GEOM"]
+        try:
+            check_scene_intersections(context, obs)
+        except BFException as err:
+            self.report({"ERROR"}, str(err))
+            return{'CANCELLED'}
+        self.report({"INFO"}, "No intersection in {} GEOM objects".format(len(obs)))
+        return {'FINISHED'}
+
 #-- DEVC PROP_ID
 
 def _get_prop_items(self, context):
@@ -335,12 +351,28 @@ class OBJECT_OT_bf_new_related_surf(Operator):
 
 class _COMMON_bf_show_fds_code():
 
+    page_lines = 30  # Lines shown in each page of the dialog
+
+    bf_page = IntProperty(
+        name="Page",
+        description="Shown page of FDS code",
+        min=1, default=1,
+    )
+
     def draw(self, context):
         layout = self.layout
-        bf_fds_code = self.bf_fds_code or 'No FDS code is exported'
-        for line in bf_fds_code.split("\n"):
+        lines = self.bf_fds_lines or ('No FDS code is exported',)
+        # Only draw the visible page
+        n_pages = (len(lines) - 1) // self.page_lines + 1
+        page = min(self.bf_page, n_pages)
+        start = (page - 1) * self.page_lines
+        for line in lines[start:start+self.page_lines]:
             row = layout.row()
             row.label(text=line)
+        if n_pages > 1:
+            row = layout.row()
+            row.prop(self, "bf_page")
+            row.label(text="of {}".format(n_pages))
 
     def execute(self, context):
         self.report({"INFO"}, "FDS Code Shown")
@@ -360,6 +392,10 @@ class _COMMON_bf_show_fds_code():
             w.cursor_modal_restore()
             self.report({"ERROR"}, str(err))
             return{'CANCELLED'}
+        # Split once, pages are drawn from lines
+        self.bf_fds_lines = (self.bf_fds_code or "").splitlines()
+        self.bf_page = 1
+        w.cursor_modal_restore()
         # Call dialog
         wm = context.window_manager
         return wm.invoke_props_dialog(self, width=600)
@@ -369,9 +405,11 @@ class OBJECT_OT_bf_show_fds_code(_COMMON_bf_show_fds_code, Operator):
     bl_idname = "object.bf_show_fds_code"
     bl_description = "Show FDS code exported from Blender Object"
 
+    max_lines = 1000  # Object code is truncated, it can be very long
+
     def _get_fds_code(self, context):
         ob = context.active_object
-        self.bf_fds_code = ob.to_fds(context, max_lines=10)
+        self.bf_fds_code = ob.to_fds(context, max_lines=self.max_lines)
 
 class MATERIAL_OT_bf_show_fds_code(_COMMON_bf_show_fds_code, Operator):
     bl_label = "Show FDS Code From Blender Material"
@@ -512,7 +550,17 @@ class OBJECT_OT_bf_show_fds_geometry(Operator):
         err_msgs = list()
         # Start
         fds_faces, xbs, xyzs, pbs = None, None, None, None
-        if ob.bf_namelist_cls == 'ON_GEOM':
+        if ob.bf_namelist_cls == 'ON_GEOM' and ob.bf_geom_terrain:
+            # Manage GEOM terrain: get heights, show them in a tmp object, prepare msg
+            try:
+                fds_surfid, ijk, xb, zvals, msg = geometry.to_fds.ob_to_geom_terrain(context, ob)
+            except BFException as err:
+                w.cursor_modal_restore()
+                self.report({"ERROR"}, str(err))
+                return{'CANCELLED'}
+            msgs.append(msg)
+            geometry.from_fds.terrain_to_ob(fds_surfid, ijk, xb, zvals, context, name="Tmp Object {} GEOM".format(ob.name)).set_tmp(context, ob)
+        elif ob.bf_namelist_cls == 'ON_GEOM':
             # Manage GEOM: get coordinates, show them in a tmp object, prepare msg
             msg = None
             try:
@@ -524,7 +572,7 @@ class OBJECT_OT_bf_show_fds_geometry(Operator):
                 return{'CANCELLED'}
             if msg:
                 msgs.append(msg)
-            if fds_faces:
+            if len(fds_faces):
                 geometry.from_fds.geom_to_ob(fds_surfids, fds_verts, fds_faces, context, name="Tmp Object {} GEOM".format(ob.name)).set_tmp(context, ob)
         else:
             # Manage XB: get coordinates, show them in a tmp object, prepare msg
@@ -536,7 +584,10 @@ class OBJECT_OT_bf_show_fds_geometry(Operator):
                 return{'CANCELLED'}
             if msg:
                 msgs.append(msg)
-            if xbs:
+            if xbs and ob.bf_xb == "VOXELS":
+                # Show the surface of the voxel grid only, from the cache set by ob_to_xbs
+                geometry.from_fds.voxels_to_ob(ob["ob_to_xbs_cache"], context, name="Tmp Object {} XBs".format(ob.name)).set_tmp(context, ob)
+            elif xbs:
                 geometry.from_fds.xbs_to_ob(xbs, context, bf_xb=ob.bf_xb, name="Tmp Object {} XBs".format(ob.name)).set_tmp(context, ob)
             # Manage XYZ: get coordinates, show them in a tmp object, prepare msg
             msg = None
@@ -564,7 +615,7 @@ class OBJECT_OT_bf_show_fds_geometry(Operator):
         if msgs:
             report = {"INFO"}, "; ".join(msgs)
             ob.show_tmp_obs(context)
-        elif xbs or xyzs or pbs or fds_faces:
+        elif xbs or xyzs or pbs or (fds_faces is not None and len(fds_faces)):
             report = {"INFO"}, "FDS geometry shown"
             ob.show_tmp_obs(context)
         else:
@@ -819,6 +870,8 @@ def bl_scene_from_fds_case(operator, context, to_current_scene=False, filepath="
         sc = bpy.data.scenes.new("imported_case")
         bpy.context.screen.scene = sc
         sc.set_default_appearance(context)
+    # Set case directory, for referenced files
+    if not sc.bf_head_directory: sc.bf_head_directory = os.path.dirname(filepath)
     # Import to Scene
     try: sc.from_fds(context=context, value=imported_value)
     except BFException as err:
@@ -874,7 +927,7 @@ class export_OT_fds_case(Operator, ExportHelper):
             self.report({"ERROR"}, "FDS file not writable, cannot export")
             return {'CANCELLED'}
         # Prepare FDS file
-        try: fds_file = sc.to_fds(context=context, with_children=True)
+        try: fds_file = sc.to_fds(context=context, with_children=True, filepath=filepath)
         except BFException as err:
             w.cursor_modal_restore()
             self.report({"ERROR"}, str(err))
@@ -895,14 +948,13 @@ class export_OT_fds_case(Operator, ExportHelper):
                 w.cursor_modal_restore()
                 self.report({"ERROR"}, "GE1 file not writable, cannot export")
                 return {'CANCELLED'}
-            # Prepare GE1 file
-            try: ge1_file = sc.to_ge1(context=context)
+            # Prepare and stream GE1 file
+            try: sc.to_ge1(context=context, filepath=filepath)
             except BFException as err:
                 w.cursor_modal_restore()
                 self.report({"ERROR"}, str(err))
                 return{'CANCELLED'}
-            # Write GE1 file
-            if not write_to_file(filepath, ge1_file):
+            except IOError:
                 w.cursor_modal_restore()
                 self.report({"ERROR"}, "GE1 file not writable, cannot export")
                 return {'CANCELLED'}
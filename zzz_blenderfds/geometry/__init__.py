@@ -1,4 +1,4 @@
 """BlenderFDS, geometry library."""
 
-from . import from_fds, to_fds, to_ge1, utils, tmp_objects
+from . import from_fds, to_fds, to_ge1, utils, tmp_objects, consolidate, holes
 # Not voxelize, used internally
@@ -1,19 +1,22 @@
 """BlenderFDS, algorithms for triangulated surfaces."""
 
 import bpy, bmesh, mathutils
+import numpy as np
 from time import time
-from math import floor, ceil
+from math import floor, ceil, radians, sqrt
 
 from ..exceptions import BFException
-from . import utils
+from . import utils, calc_voxels
+from .kernels import broadphase, mesh_quality, terrain, weld
 
 DEBUG = False
 
 
 # Get triangulated surface
 
-def get_trisurface(context, ob, check=True) -> "mas, verts, faces":
-    """Get triangulated surface from object ready for FDS GEOM format."""
+def get_trisurface(context, ob, check=True, decimate=False) -> "mas, verts, faces, msg":
+    """Get triangulated surface from object ready for FDS GEOM format, as numpy arrays.
+    If decimate, decimate it toward the smallest intersecting MESH cell size."""
     # Check and init
     DEBUG and print("BFDS: get_triangles")
     assert(ob.type == 'MESH')
@@ -22,8 +25,12 @@ def get_trisurface(context, ob, check=True) -> "mas, verts, faces":
     # Check original mesh quality
     if check:
         check_mesh_quality(context, ob)
+    # Get ob materials from slots
+    mas = _get_mas(ob)
     # Create new object global copy
     ob_tmp = utils.object_get_global_copy(context, ob, suffix='_tri_tmp')
+    # Decimate
+    msg = decimate and _decimate(context, ob_tmp) or ""
     # Create triangulate modifier
     mo = ob_tmp.modifiers.new('triangulate_tmp','TRIANGULATE')
     mo.quad_method, mo.ngon_method = 'BEAUTY', 'BEAUTY'
@@ -36,125 +43,244 @@ def get_trisurface(context, ob, check=True) -> "mas, verts, faces":
         calc_undeformed=False,
     )
     ob_tmp.modifiers.remove(mo)
-    # Get ob materials from slots
+    # Get ob verts and faces, weld close vertices
+    co, _, loop_verts, _, _, _, _ = _get_mesh_arrays(ob_tmp.data)
+    materials = np.empty(len(ob_tmp.data.polygons), dtype=np.int32)
+    ob_tmp.data.polygons.foreach_get("material_index", materials)
+    verts, tris, kept = weld.weld(co, loop_verts, context.scene.bf_config_min_edge_length)
+    if len(verts) < len(co):
+        msg = ", ".join(m for m in (msg, "{} vertices welded".format(len(co) - len(verts))) if m)
+    faces = np.column_stack((tris + 1, materials[kept] + 1))  # FDS index start from 1, not 0
+    # Clean up
+    bpy.data.objects.remove(ob_tmp, True)
+    return mas, verts, faces, msg
+
+def _get_mas(ob) -> "mas":
+    """Get ob material names from slots, referenced as SURF_ID."""
     mas = list()
     material_slots = ob.material_slots
     if len(material_slots) == 0:
-        bpy.data.objects.remove(ob_tmp, True)
         raise BFException(ob,
             "No referenced SURF, add at least one Material")
     for material_slot in material_slots:
         ma = material_slot.material
         if not ma:
-            bpy.data.objects.remove(ob_tmp, True)
             raise BFException(ob,
                 "No referenced SURF, fill empty slot with Material")
         if not ma.bf_export:
-            bpy.data.objects.remove(ob_tmp, True)
             raise BFException(ob,
                 "Referenced SURF ID='{}' is not exported".format(ma.name))
         mas.append(ma.name)
-    # Get ob verts and faces
+    return mas
+
+# Get terrain heightfield
+# The object shall be a heightfield, its surface single valued over XY.
+# It is sampled by downward ray casts on a regular XY grid of its bounding box,
+# with the smallest cell size of the intersecting MESH objects.
+
+def get_terrain(context, ob) -> "ma, ijk, xb, zvals, msg":
+    """Get terrain heightfield from object ready for FDS GEOM format, as numpy arrays."""
+    DEBUG and print("BFDS: get_terrain")
+    assert(ob.type == 'MESH')
+    if not ob.data.vertices:
+        raise BFException(ob, "Empty object!")
+    mas = _get_mas(ob)
+    # Create new object global copy, check heightfield
+    ob_tmp = utils.object_get_global_copy(context, ob, suffix='_ter_tmp')
+    me = ob_tmp.data
+    normals = np.empty(len(me.polygons) * 3, dtype=np.float32)
+    me.polygons.foreach_get("normal", normals)
+    areas = np.empty(len(me.polygons), dtype=np.float32)
+    me.polygons.foreach_get("area", areas)
+    if not terrain.is_heightfield(normals, areas):
+        bpy.data.objects.remove(ob_tmp, True)
+        raise BFException(ob, "Not a terrain, overlapping faces along z")
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3)
+    co_min, co_max = co.min(axis=0), co.max(axis=0)
+    bbox = co_min[0], co_max[0], co_min[1], co_max[1], co_min[2], co_max[2]
+    # Get grid
+    meshes = calc_voxels.get_intersecting_meshes(context, co_min, co_max)
+    if meshes:
+        cell_size = min(((b[1::2] - b[0::2]) / ijk)[:2].min() for b, ijk in meshes)
+    else:
+        cell_size = context.scene.bf_default_voxel_size
+    ijk, xb = terrain.get_grid(bbox, cell_size)
+    # Sample heights
     bm = bmesh.new()
-    bm.from_mesh(ob_tmp.data)
-    verts = [(v.co.x, v.co.y, v.co.z) for v in bm.verts]
-    faces = [(
-            f.verts[0].index+1, # FDS index start from 1, not 0
-            f.verts[1].index+1,
-            f.verts[2].index+1,
-            f.material_index+1,
-    ) for f in bm.faces]
-    # Clean up
+    bm.from_mesh(me)
+    tree = mathutils.bvhtree.BVHTree.FromBMesh(bm)
     bm.free()
     bpy.data.objects.remove(ob_tmp, True)
-    return mas, verts, faces
+    z_top, down = xb[5] + 1., mathutils.Vector((0., 0., -1.))
+    zvals = list()
+    for x, y in terrain.get_points(ijk, xb).tolist():
+        location = tree.ray_cast(mathutils.Vector((x, y, z_top)), down)[0]
+        zvals.append(location[2] if location is not None else np.nan)
+    zvals, missing = terrain.fill_missing(zvals)
+    msg = "{}x{} terrain points, cell {:.3f} m".format(
+        ijk[0], ijk[1], cell_size * context.scene.unit_settings.scale_length,
+    )
+    if missing:
+        msg += ", {} points outside filled".format(missing)
+    if len(mas) > 1:
+        msg += ", only first SURF_ID used"
+    return mas[0], ijk, xb, zvals, msg
+
+# Decimate triangulated surface
+# Planar faces are dissolved first, without crossing material boundaries,
+# then edges are collapsed toward the triangle count of the target edge length,
+# the smallest cell size of the intersecting MESH objects.
+# Material boundary vertices are protected by an inverted vertex group.
+# If the result would not pass the quality checks, the original mesh is kept.
+
+def _decimate(context, ob_tmp) -> "msg":
+    """Decimate global ob_tmp toward the smallest intersecting MESH cell size."""
+    DEBUG and print("BFDS: _decimate:", ob_tmp.name)
+    me_orig = ob_tmp.data
+    co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals, areas = _get_mesh_arrays(me_orig)
+    if not len(co):
+        return ""
+    meshes = calc_voxels.get_intersecting_meshes(context, co.min(axis=0), co.max(axis=0))
+    if not meshes:
+        return "not decimated, no intersecting MESH"
+    edge_length = min(((bbox[1::2] - bbox[0::2]) / ijk).min() for bbox, ijk in meshes)
+    tris_count = int((loop_totals - 2).sum())
+    # Dissolve planar faces
+    mo = ob_tmp.modifiers.new('dissolve_tmp', 'DECIMATE')
+    mo.decimate_type, mo.angle_limit, mo.delimit = 'DISSOLVE', radians(.1), {'MATERIAL'}
+    mo.use_dissolve_boundaries = False
+    _apply_modifiers(context, ob_tmp, me_keep=me_orig)
+    # Collapse edges, protecting material boundaries
+    co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals, areas = _get_mesh_arrays(ob_tmp.data)
+    ratio = 4. / sqrt(3.) * areas.sum() / edge_length ** 2 / max(int((loop_totals - 2).sum()), 1)
+    if ratio < 1.:
+        materials = np.empty(len(loop_starts), dtype=np.int32)
+        ob_tmp.data.polygons.foreach_get("material_index", materials)
+        verts = mesh_quality.get_material_boundary_verts(loop_verts, loop_edges, loop_starts, loop_totals, materials)
+        vg = ob_tmp.vertex_groups.new('boundary_tmp')
+        vg.add(verts.tolist(), 1., 'REPLACE')
+        mo = ob_tmp.modifiers.new('collapse_tmp', 'DECIMATE')
+        mo.decimate_type, mo.ratio, mo.use_collapse_triangulate = 'COLLAPSE', ratio, True
+        mo.vertex_group, mo.invert_vertex_group, mo.vertex_group_factor = vg.name, True, 1000.
+        _apply_modifiers(context, ob_tmp, me_keep=me_orig)
+        ob_tmp.vertex_groups.remove(vg)
+    # Check the result, or revert
+    co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals, areas = _get_mesh_arrays(ob_tmp.data)
+    report = mesh_quality.get_welded_report(
+        co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals,
+        min_edge_length=context.scene.bf_config_min_edge_length,
+        min_face_area=context.scene.bf_config_min_face_area,
+        areas=areas,
+    )
+    if any(len(bad) for bad in report.values()):
+        me = ob_tmp.data
+        ob_tmp.data = me_orig
+        if me != me_orig:
+            bpy.data.meshes.remove(me, do_unlink=True)
+        return "not decimated, bad geometry quality"
+    if ob_tmp.data != me_orig:
+        bpy.data.meshes.remove(me_orig, do_unlink=True)
+    return "decimated from {} to {} triangles, edge {:.3f} m".format(
+        tris_count, int((loop_totals - 2).sum()), edge_length * context.scene.unit_settings.scale_length,
+    )
+
+def _apply_modifiers(context, ob, me_keep=None) -> "None":
+    """Apply and remove all modifiers of ob, free the replaced mesh unless me_keep."""
+    me = ob.data
+    ob.data = ob.to_mesh(scene=context.scene, apply_modifiers=True, settings="RENDER")
+    for mo in list(ob.modifiers):
+        ob.modifiers.remove(mo)
+    if me != me_keep:
+        bpy.data.meshes.remove(me, do_unlink=True)
 
 
 # Check mesh quality
 
 def check_mesh_quality(context, ob):
     """Check that Object is a closed orientable manifold,
-    with no degenerate geometry."""
+    with no degenerate geometry. All checks are run at once."""
     # Init
     DEBUG and print("BFDS: check_mesh_quality")
     bpy.ops.object.mode_set(mode='OBJECT')
-    bm = bmesh.new()
-    bm.from_mesh(ob.data)
-    bm.faces.ensure_lookup_table()  # update bmesh index
-    bm.verts.ensure_lookup_table()  # update bmesh index
-    bm.edges.ensure_lookup_table()  # update bmesh index
-    epsilon_len = context.scene.bf_config_min_edge_length
-    epsilon_area = context.scene.bf_config_min_face_area
-    bad_verts, bad_edges, bad_faces= list(), list(), list()
-    # Check manifold edges, each edge should join two faces, no more no less
-    for edge in bm.edges:
-        if not edge.is_manifold:
-            bad_edges.append(edge)
-    if bad_edges:
-        msg = "Non manifold or open geometry detected, bad edges selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_edges=bad_edges)
-    # Check manifold vertices
-    for vert in bm.verts:
-        if not vert.is_manifold:
-            bad_verts.append(vert)
-    if bad_verts:
-        msg = "Non manifold vertices detected, bad vertices selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_verts=bad_verts)
-    # Check contiguous normals, adjoining faces should have normals
-    # in the same directions
-    for edge in bm.edges:
-        if not edge.is_contiguous:
-            bad_edges.append(edge)
-    if bad_edges:
-        msg = "Inconsistent face normals detected, bad edges selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_edges=bad_edges)
-    # Check no degenerate edges, zero lenght edges
-    for edge in bm.edges:
-        if edge.calc_length() <= epsilon_len:
-            bad_edges.append(edge)
-    if bad_edges:
-        msg = "Too short edges detected, bad edges selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_edges=bad_edges)
-    # Check degenerate faces, zero area faces
-    for face in bm.faces:
-        if face.calc_area() <= epsilon_area:
-            bad_faces.append(face)
-    if bad_faces:
-        msg = "Too small area faces detected, bad faces selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_faces=bad_faces)
-    # Check loose vertices, vertices that have no connectivity
-    for vert in bm.verts:
-        if not bool(vert.link_edges):
-            bad_verts.append(vert)
-    if bad_verts:
-        msg = "Loose vertices detected, bad vertices selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_verts=bad_verts)
-    # Check duplicate vertices
-    _check_duplicate_vertices(context, ob, bm, epsilon_len)
-    # Set overall normals
-    bmesh.ops.recalc_face_normals(bm, faces=bm.faces)
-    bm.to_mesh(ob.data)
-    # Close
-    bm.free()
+    arrays = _get_mesh_arrays(ob.data)
+    co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals, areas = arrays
+    # Close vertices are welded when exporting, weld them once for all checks
+    remap, _ = weld.get_remap(co, context.scene.bf_config_min_edge_length)
+    report = mesh_quality.get_welded_report(
+        co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals,
+        min_edge_length=context.scene.bf_config_min_edge_length,
+        min_face_area=context.scene.bf_config_min_face_area,
+        areas=areas, remap=remap,
+    )
+    if any(len(bad) for bad in report.values()):
+        _raise_bad_report(context, ob, arrays, report)
+    # Set overall normals outward, writing the mesh only if any shell is inverted
+    inverted = mesh_quality.get_inverted_faces(co, edge_verts, loop_verts, loop_starts, loop_totals, remap=remap)
+    if len(inverted):
+        DEBUG and print("BFDS: check_mesh_quality: flipped faces:", len(inverted))
+        bm = bmesh.new()
+        bm.from_mesh(ob.data)
+        bm.faces.ensure_lookup_table()  # update bmesh index
+        bmesh.ops.reverse_faces(bm, faces=[bm.faces[i] for i in inverted])
+        bm.to_mesh(ob.data)
+        bm.free()
 
-def _check_duplicate_vertices(context, ob, bm, epsilon_len):
-    """Check duplicate vertices."""
-    bad_verts = list()
-    size = len(bm.verts)
-    kd = mathutils.kdtree.KDTree(size)  # create a kd-tree from a mesh
-    for i, vert in enumerate(bm.verts):
-        kd.insert(vert.co, i)
-    kd.balance()
-    for vert in bm.verts:
-        vert_group = list()
-        for (co, i, dist) in kd.find_range(vert.co, epsilon_len):
-            vert_group.append(i)
-        if len(vert_group) > 1:
-            for i in vert_group:
-                bad_verts.append(bm.verts[i])
-    if bad_verts:
-        msg = "Duplicate vertices detected, bad vertices selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_verts=bad_verts)
+def _get_mesh_arrays(me) -> "co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals, areas":
+    """Get mesh arrays for quality analysis with foreach_get."""
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    edge_verts = np.empty(len(me.edges) * 2, dtype=np.int32)
+    me.edges.foreach_get("vertices", edge_verts)
+    loop_verts, loop_edges = np.empty(len(me.loops), dtype=np.int32), np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get("vertex_index", loop_verts)
+    me.loops.foreach_get("edge_index", loop_edges)
+    loop_starts, loop_totals = np.empty(len(me.polygons), dtype=np.int32), np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_start", loop_starts)
+    me.polygons.foreach_get("loop_total", loop_totals)
+    areas = np.empty(len(me.polygons), dtype=np.float32)
+    me.polygons.foreach_get("area", areas)
+    return co.reshape(-1, 3), edge_verts.reshape(-1, 2), loop_verts, loop_edges, loop_starts, loop_totals, areas
+
+def _raise_bad_report(context, ob, arrays, report):
+    """Select all bad elements in report, show them, raise BFException."""
+    co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals, areas = arrays
+    verts_sel = np.zeros(len(co), dtype=bool)
+    edges_sel = np.zeros(len(edge_verts), dtype=bool)
+    faces_sel = np.zeros(len(loop_starts), dtype=bool)
+    msgs, select_types = list(), set()
+    for name, element, msg in mesh_quality.checks:
+        bad = report[name]
+        if not len(bad):
+            continue
+        msgs.append("{} ({} {})".format(msg, len(bad), element.lower() + "s"))
+        select_types.add(element)
+        if element == "VERT":
+            verts_sel[bad] = True
+        elif element == "EDGE":
+            edges_sel[bad] = True
+            verts_sel[edge_verts[bad].ravel()] = True
+        else:
+            faces_sel[bad] = True
+            is_bad_loop = np.repeat(faces_sel, loop_totals)
+            verts_sel[loop_verts[is_bad_loop]] = True
+            edges_sel[loop_edges[is_bad_loop]] = True
+    # Select bad elements
+    me = ob.data
+    me.vertices.foreach_set("select", verts_sel)
+    me.edges.foreach_set("select", edges_sel)
+    me.polygons.foreach_set("select", faces_sel)
+    # Select object and go to edit mode
+    bpy.ops.object.select_all(action='DESELECT')
+    ob.select = True
+    context.scene.objects.active = ob
+    bpy.ops.object.mode_set(mode='EDIT')
+    for select_type in ("VERT", "EDGE", "FACE"):
+        if select_type in select_types:
+            bpy.ops.mesh.select_mode(use_extend=False, use_expand=False, type=select_type)
+            break
+    raise BFException(ob, "Bad geometry detected, bad elements selected: {}.".format("; ".join(msgs)))
 
 
 # Check intersections
@@ -187,17 +313,98 @@ def check_intersections(context, ob, other_obs=None):
     bm, tree = _get_bm_and_tree(context, ob, epsilon_len=epsilon_len)
     # Get self-intersections
     bad_faces.extend(_get_intersected_faces(bm, tree, tree))
-    # Get intersections
-    for other_ob in other_obs or tuple():
+    # Get intersections, only with other_obs whose bounding box overlaps
+    other_obs = list(other_obs or tuple())
+    bboxes = _get_world_bboxes([ob] + other_obs)
+    for i, j in broadphase.get_pairs(bboxes, epsilon=epsilon_len):
+        if i != 0:
+            continue  # a pair of other_obs
+        other_ob = other_obs[j-1]
         matrix = ob.matrix_world.inverted() * other_ob.matrix_world
         other_bm, other_tree = _get_bm_and_tree(
             context, other_ob, epsilon_len=epsilon_len, matrix=matrix,
             )
+        other_bm.free()
         bad_faces.extend(_get_intersected_faces(bm, tree, other_tree))
     # Raise
     if bad_faces:
         msg = "Intersection detected, bad faces selected."
-        _raise_bad_geometry(context, ob, bm, msg, bad_faces=bad_faces)          
+        _raise_bad_geometry(context, ob, bm, msg, bad_faces=bad_faces)
+    bm.free()
+
+def _get_world_bboxes(obs) -> "bboxes":
+    """Get obs bounding boxes in global coordinates and in xbs format, from their bound_box."""
+    bboxes = np.empty((len(obs), 6))
+    for i, ob in enumerate(obs):
+        corners = np.array([tuple(ob.matrix_world * mathutils.Vector(c)) for c in ob.bound_box])
+        bboxes[i, 0::2], bboxes[i, 1::2] = corners.min(axis=0), corners.max(axis=0)
+    return bboxes
+
+def get_scene_intersections(context, obs, self_intersections=True) -> "[(ob, other_ob, faces, other_faces), ...]":
+    """Get all intersecting pairs of obs, with the indices of their intersected faces."""
+    DEBUG and print("BFDS: get_scene_intersections:", len(obs))
+    epsilon_len = context.scene.bf_config_min_edge_length
+    trees = dict()  # ob.name: BVHTree in global coordinates, built once
+    def get_tree(ob):
+        if ob.name not in trees:
+            bm, trees[ob.name] = _get_bm_and_tree(context, ob, epsilon_len=epsilon_len, matrix=ob.matrix_world)
+            bm.free()
+        return trees[ob.name]
+    # Self-intersections
+    pairs = list()
+    if self_intersections:
+        pairs.extend((ob, ob) for ob in obs)
+    # Candidate pairs, with overlapping bounding boxes
+    pairs.extend(
+        (obs[i], obs[j]) for i, j in broadphase.get_pairs(_get_world_bboxes(obs), epsilon=epsilon_len)
+    )
+    # Narrowphase
+    results = list()
+    for ob, other_ob in pairs:
+        overlap = get_tree(ob).overlap(get_tree(other_ob))
+        if overlap:
+            faces = sorted({i_pair[0] for i_pair in overlap})
+            other_faces = sorted({i_pair[1] for i_pair in overlap})
+            results.append((ob, other_ob, faces, other_faces))
+    DEBUG and print("BFDS: get_scene_intersections: {} candidates, {} trees".format(len(pairs), len(trees)))
+    return results
+
+def check_scene_intersections(context, obs):
+    """Check intersections between all obs, select bad faces and objects."""
+    bpy.ops.object.mode_set(mode='OBJECT')
+    results = get_scene_intersections(context, obs)
+    if not results:
+        return
+    # Select intersected faces of each object
+    bad_faces = dict()  # ob.name: set of face indices
+    msgs = list()
+    for ob, other_ob, faces, other_faces in results:
+        bad_faces.setdefault(ob.name, set()).update(faces)
+        bad_faces.setdefault(other_ob.name, set()).update(other_faces)
+        if ob == other_ob:
+            msgs.append("{} self ({} faces)".format(ob.name, len(faces)))
+        else:
+            msgs.append("{} with {} ({} and {} faces)".format(ob.name, other_ob.name, len(faces), len(other_faces)))
+    bpy.ops.object.select_all(action='DESELECT')
+    for name, faces in bad_faces.items():
+        ob = context.scene.objects[name]
+        me = ob.data
+        verts_sel = np.zeros(len(me.vertices), dtype=bool)
+        edges_sel = np.zeros(len(me.edges), dtype=bool)
+        faces_sel = np.zeros(len(me.polygons), dtype=bool)
+        for i in faces:
+            if i >= len(me.polygons):
+                continue  # added by modifiers
+            faces_sel[i] = True
+            polygon = me.polygons[i]
+            verts_sel[list(polygon.vertices)] = True
+            edges_sel[[me.loops[l].edge_index for l in polygon.loop_indices]] = True
+        me.vertices.foreach_set("select", verts_sel)
+        me.edges.foreach_set("select", edges_sel)
+        me.polygons.foreach_set("select", faces_sel)
+        ob.select = True
+        context.scene.objects.active = ob
+    raise BFException(None, "Intersections detected, bad objects and faces selected: {}.".format("; ".join(msgs)))
 
 
 # Raise bad geometry
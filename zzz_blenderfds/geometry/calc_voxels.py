@@ -1,11 +1,16 @@
 """BlenderFDS, voxelization algorithms."""
 
-import bpy, bmesh
+import bpy
+import numpy as np
 from time import time
-from math import floor, ceil
 
 from ..exceptions import BFException
 from . import utils
+from .kernels.tiles import voxelize_tiled
+from .kernels.voxelize import get_surface_runs
+from .kernels.sparse import SparseGrid
+from .kernels.pixelize import pixelize, rects_to_boxes
+from .kernels.estimate import estimate_voxels
 
 DEBUG = False
 
@@ -13,8 +18,8 @@ DEBUG = False
 # that are directly transformed to FDS coordinates (that refers its coordinates to the
 # one and only origin of axes)
 
-def get_voxels(context, ob):
-    """Get voxels from object in xbs format."""
+def get_voxels(context, ob) -> "boxes, origin, voxel_size, timing":
+    """Get voxels from object as integer boxes on the voxel grid."""
     # Check and init
     DEBUG and print("BFDS: calc_voxels.get_voxels")
     t0 = time()
@@ -22,89 +27,110 @@ def get_voxels(context, ob):
     if not ob.data.vertices:
         raise BFException(ob, "Empty object!")
     voxel_size = _get_voxel_size(context, ob)
-    # Create new object, and link it
-    ob_tmp = utils.object_get_global_copy(context, ob, suffix='_vox_tmp')
-    # Align voxels to global origin
-    if not ob.bf_xb_center_voxels:
-        _align_remesh_to_global_origin(context, ob_tmp, voxel_size)
-    # Create remesh modifier
-    octree_depth, scale = _init_remesh_mod(context, ob_tmp, voxel_size)
-    mo = ob_tmp.modifiers.new('remesh_tmp','REMESH')
-    mo.mode, mo.use_remove_disconnected = 'BLOCKS', False
-    mo.octree_depth, mo.scale = octree_depth, scale
-    # Apply remesh modifier and remove it
-    ob_tmp.data = ob_tmp.to_mesh(
-        scene=context.scene,
-        apply_modifiers=True,
-        settings="RENDER",
-        calc_tessface=True,
-        calc_undeformed=False,
-    )
-    ob_tmp.modifiers.remove(mo)
-    # Get faces and sort them according to normals
+    # Get triangles in global coordinates, apply modifiers
+    tris, _ = utils.get_global_tris(context, ob)
+    if not len(tris):
+        raise BFException(ob, "Empty object!")
+    # Align voxels to global origin, or center them to the object
+    origin = _get_voxel_origin(tris, voxel_size, centered=ob.bf_xb_center_voxels)
+    # Get solid voxels by raytracing along z, as z runs in integer coordinates,
+    # big objects are split in tiles voxelized in parallel;
+    # add the voxels crossed by the surface, for thin walls and open meshes
     t1 = time()
-    faces = ob_tmp.data.tessfaces
-    x_faces, y_faces, z_faces = list(), list(), list()
-    for face in faces:
-        normal = face.normal
-        if   abs(normal[0]) > .9:
-            x_faces.append(face)  # face is normal to x axis
-        elif abs(normal[1]) > .9:
-            y_faces.append(face)  # ... to y axis
-        elif abs(normal[2]) > .9:
-            z_faces.append(face)  # ... to z axis
-        else:
-            raise ValueError("BFDS: abnormal face")
-    # Choose shorter list of faces, relative functions, and parameters
+    runs = np.concatenate((
+        voxelize_tiled(tris, voxel_size, origin),
+        get_surface_runs(tris, voxel_size, origin),
+    ))
+    if not len(runs):
+        raise BFException(ob, "No voxel created, object too small or voxel size too big.")
+    # Store voxels in a sparse grid, then merge them in boxes
     t2 = time()
-    choices = [
-        (len(x_faces), _get_boxes_along_x, x_faces, _grow_boxes_along_x, 0),
-        (len(y_faces), _get_boxes_along_y, y_faces, _grow_boxes_along_y, 2),
-        (len(z_faces), _get_boxes_along_z, z_faces, _grow_boxes_along_z, 4),
-    ]
-    choices.sort(key=lambda choice: choice[0])
-    get_boxes = choices[0][1]  # get boxes according to fastest orientation
-    faces = choices[0][2]
-    grow_boxes_along_first_axis = choices[1][3]   # 1st axis growing direction
-    first_sort_by = choices[2][4]
-    grow_boxes_along_second_axis = choices[2][3]  # 2nd axis growing direction
-    second_sort_by = choices[1][4]
-    # For each face find other sides and build boxes data structure
+    grid = SparseGrid.from_runs(runs)
     t3 = time()
-    boxes, origin = get_boxes(faces, voxel_size)
-    # Join boxes along other axis and return their global coordinates
+    boxes = grid.boxes(greedy=context.scene.bf_config_voxel_strategy == "GREEDY")
     t4 = time()
-    boxes = grow_boxes_along_first_axis(boxes, first_sort_by)
-    t5 = time()
-    boxes = grow_boxes_along_second_axis(boxes, second_sort_by)
-    # Clean up
-    t6 = time()
-    bpy.data.objects.remove(ob_tmp, do_unlink=True)
-    xbs = list(_get_box_xbs(boxes, origin, voxel_size))
-    # Return with timing: sort, 1b, 2g, 3g
-    return xbs, voxel_size, (t2-t1, t4-t3, t5-t4, t6-t5)
+    # Return with timing: tris, voxelize, grid, boxes
+    return boxes, origin, voxel_size, (t1-t0, t2-t1, t3-t2, t4-t3)
+
+def get_voxels_by_mesh(context, ob) -> "parts, timing":
+    """Get voxels from object clipped by each intersecting MESH, at its cell sizes.
+
+    parts = ((boxes, origin, voxel_size), ...), one for each MESH grid.
+    """
+    # Check and init
+    DEBUG and print("BFDS: calc_voxels.get_voxels_by_mesh")
+    t0 = time()
+    assert(ob.type == 'MESH')
+    if not ob.data.vertices:
+        raise BFException(ob, "Empty object!")
+    # Get triangles in global coordinates, apply modifiers
+    tris, _ = utils.get_global_tris(context, ob)
+    if not len(tris):
+        raise BFException(ob, "Empty object!")
+    co = tris.reshape(-1, 3)
+    meshes = get_intersecting_meshes(context, co.min(axis=0), co.max(axis=0))
+    if not meshes:
+        raise BFException(ob, "Object does not intersect any MESH, voxel size unknown.")
+    # Voxelize the part inside each MESH on its own grid, aligned to its cells:
+    # ray columns are clipped by MESH I and J, runs by MESH K;
+    # add the voxels crossed by the surface, for thin walls and open meshes
+    t1 = time()
+    parts = list()
+    greedy = context.scene.bf_config_voxel_strategy == "GREEDY"
+    for bbox, ijk in meshes:
+        origin = bbox[0::2]
+        voxel_size = (bbox[1::2] - bbox[0::2]) / ijk
+        bounds = (0, ijk[0], 0, ijk[1])
+        runs = np.concatenate((
+            voxelize_tiled(tris, voxel_size, origin, bounds=bounds),
+            get_surface_runs(tris, voxel_size, origin, bounds=bounds),
+        ))
+        runs[:, 2:4] = np.clip(runs[:, 2:4], 0, ijk[2])
+        boxes = SparseGrid.from_runs(runs).boxes(greedy=greedy)
+        if len(boxes):
+            parts.append((boxes, origin, voxel_size))
+    if not parts:
+        raise BFException(ob, "No voxel created, object outside MESH cells.")
+    t2 = time()
+    # Return with timing: tris, voxelize and boxes
+    return parts, (t1-t0, t2-t1, 0., 0.)
+
+def get_meshes(context) -> "((bbox, ijk), ...)":
+    """Get bbox and IJK of exported MESH objects."""
+    return [
+        (np.array(utils.get_global_bbox(context, ob_mesh)), np.array(ob_mesh.bf_mesh_ijk))
+        for ob_mesh in context.scene.objects
+        if ob_mesh.type == "MESH" and ob_mesh.bf_namelist_cls == "ON_MESH" and ob_mesh.bf_export
+    ]
+
+def get_intersecting_meshes(context, co_min, co_max, meshes=None) -> "((bbox, ijk), ...)":
+    """Get bbox and IJK of exported MESH objects intersecting the co_min, co_max box.
 
-# When appling a remesh modifier to a Blender Object in BLOCK mode,
-# the object max dimension is scaled up and divided in
-# 2 ** octree_depth voxels - 1 cubic voxels
-# Example: dimension = 4.2, voxel_size = 0.2,
-# octree_depth = 5, number of voxels = 2^5-1 = 31,
-# scale = 3/4 = 0.75
-# The next function reverses the procedures and calculate octree_depth
-# and scale that generate the desired voxel_size.
+    meshes are all the exported MESH objects from get_meshes, if already available.
+    """
+    if meshes is None:
+        meshes = get_meshes(context)
+    return [
+        (bbox, ijk) for bbox, ijk in meshes
+        if np.all(bbox[0::2] < co_max) and np.all(bbox[1::2] > co_min)
+    ]
 
-def _init_remesh_mod(context, ob, voxel_size) -> "octree_depth, scale":
-    """Calc remesh modifier."""
-    dimension = max(ob.dimensions)
-    octree_depth = 0.
-    while True:
-        octree_depth += 1.
-        scale = dimension / voxel_size / 2 ** octree_depth
-        if 0.010 < scale < 0.990:
-            break
-        if octree_depth > 9:
-            raise BFException(ob, "Object too large for its voxel size, split in parts.")
-    return octree_depth, scale
+def get_voxels_estimate(context, ob, surface, meshes=None) -> "voxels, boxes, memory, runtime":
+    """Estimate voxelization of object from its surface (area, bbox, tris_count), without voxelizing.
+
+    meshes are all the exported MESH objects from get_meshes, if already available.
+    """
+    area, bbox, tris_count = surface
+    voxel_size = _get_voxel_size(context, ob)
+    if ob.bf_xb == "VOXELS" and ob.bf_xb_mesh_voxel:
+        # The finest intersecting MESH cells bound the estimate
+        meshes = get_intersecting_meshes(context, np.array(bbox[0::2]), np.array(bbox[1::2]), meshes)
+        if meshes:
+            voxel_size = min([(b[1::2] - b[0::2]) / ijk for b, ijk in meshes], key=np.prod)
+    return estimate_voxels(
+        area, bbox, voxel_size, tris_count, flat=ob.bf_xb == "PIXELS",
+        greedy=context.scene.bf_config_voxel_strategy == "GREEDY",
+    )
 
 def _get_voxel_size(context, ob) -> "voxel_size":
     """Get voxel_size for object."""
@@ -113,316 +139,44 @@ def _get_voxel_size(context, ob) -> "voxel_size":
     else:
         return context.scene.bf_default_voxel_size
 
-# When appling a remesh modifier to a Blender Object, the octree is aligned with
-# the max dimension of the object. By inserting some loose vertices to the
-# temporary object, we can align the voxelization to FDS global origin
-
-def _align_remesh_to_global_origin(context, ob, voxel_size):
-    """Modify object mesh for remesh voxel alignment to global origin."""
-    bb = utils.get_bbox(ob)  # the object is already global
-    # Calc new bbox (in Blender units)
-    #      +---+ pv1
-    #      |   |
-    #  pv0 +---+
-    pv0 = (
-        floor(bb[0]/voxel_size)-1, # at least one voxel away from obj
-        floor(bb[2]/voxel_size)-1,
-        floor(bb[4]/voxel_size)-1,
-    )
-    pv1 = (
-        ceil(bb[1]/voxel_size)+1,
-        ceil(bb[3]/voxel_size)+1,
-        ceil(bb[5]/voxel_size)+1,
-    )
-    pv1 = (
-        pv0[0] + (pv1[0]-pv0[0])//2*2+1,  # at least one voxel away from obj
-        pv0[1] + (pv1[1]-pv0[1])//2*2+1,  # and odd number of voxels
-        pv0[2] + (pv1[2]-pv0[2])//2*2+1,
-    )
-    bb = (
-        pv0[0] * voxel_size, pv1[0] * voxel_size,
-        pv0[1] * voxel_size, pv1[1] * voxel_size,
-        pv0[2] * voxel_size, pv1[2] * voxel_size,
-    )
-    verts = (
-        (bb[0], bb[2], bb[4]), (bb[0], bb[2], bb[5]),
-        (bb[0], bb[3], bb[4]), (bb[0], bb[3], bb[5]),
-        (bb[1], bb[2], bb[4]), (bb[1], bb[2], bb[5]),
-        (bb[1], bb[3], bb[4]), (bb[1], bb[3], bb[5]),
-    )
-    # Insert new vertices into ob mesh
-    bm = bmesh.new()
-    bm.from_mesh(ob.data)
-    for v in verts:
-        bm.verts.new(v)
-    bm.to_mesh(ob.data)
-    bm.free()
-    # Push an update (circumvent bug in ob.dimensions)
-    context.scene.update()
-
-# The following functions transform remesh modifier faces into boxes,
-# by raytracing along the requested axis. Each face is transformed into
-# integer coordinates according to a local origin (the first face center).
-# The faces are piled up, sorted, and transformed into solids:
-# Eg.: z axis --> pile 0|==solid==1| void 2|==solid==3| void ...
-# If solid is manifold, len(izs) is an even number:
-# go into solid at izs[0], get at last out of it at izs[-1].
-# In fact this piles can be easily transformed in boxes:
-# (ix0, ix1, iy0, iy1, iz0, iz1)
-# boxes are very alike XBs, but in integer coordinates.
-
-# For example, with y faces:
-#  y ^
-#    |     B
-#  3 +---+=x=+---+ F = (.5, 0): face origin (integer coordinates)
-#    |   H   H   | face A = (1, 0, 0)
-#  2 +---+---+---+ face B = (1, 3, 0)
-#    |   H   H   | O = (0, 0): box origin (integer coordinate)
-#  1 +---+---+---+ box AB = (1, 2, 0, 3, 0, 0)
-#    |   H   H   |
-#  0 +-F-+=x=+---+->
-#    0   1 A 2   3 x
-
-def _get_boxes_along_x(faces, voxel_size) -> "boxes, origin":
-    """Get minimal boxes from faces by raytracing along x axis."""
-    DEBUG and print("BFDS: _get_boxes_along_x")
-    # First face center becomes origin of the integer grid for faces
-    f_origin = tuple(faces[0].center)
-    hvs = voxel_size / 2.
-    origin = (f_origin[0], f_origin[1]-hvs, f_origin[2]-hvs)
-    # Get integer coordinates of faces and
-    # classify faces in integer piles along z
-    # piles = {(3,4):(3,4,15,25,), (3,5):(3,4,15,25), ...}
-    piles = dict()
-    for face in faces:
-        center = face.center
-        ix, iy, iz = (
-            round((center[0]-f_origin[0]) / voxel_size),
-            round((center[1]-f_origin[1]) / voxel_size),
-            round((center[2]-f_origin[2]) / voxel_size),
-        )
-        try:
-            piles[(iy, iz)].append(ix)
-        except KeyError:
-            piles[(iy, iz)] = [ix,]
-    # Create boxes by raytracing piles along axis
-    # boxes = [[ix0, ix1, iy0, iy1, iz0, iz1], ...]
-    boxes = list()
-    for (iy, iz), ixs in piles.items():
-        ixs.sort()  # sort in +x direction
-        while ixs:
-            ix1, ix0 = ixs.pop(), ixs.pop()  # pop solid volumes from top to bottom
-            boxes.append([ix0, ix1, iy, iy+1, iz, iz+1,])
-    return boxes, origin
-
-def _get_boxes_along_y(faces, voxel_size) -> "boxes, origin":
-    """Get minimal boxes from faces by raytracing along y axis."""
-    DEBUG and print("BFDS: _get_boxes_along_y")
-    # First face center becomes origin of the integer grid for faces
-    f_origin = tuple(faces[0].center)
-    hvs = voxel_size / 2.
-    origin = (f_origin[0]-hvs, f_origin[1], f_origin[2]-hvs)
-    # Get integer coordinates of faces and
-    # classify faces in integer piles along z
-    # piles = {(3,4):(3,4,15,25,), (3,5):(3,4,15,25), ...}
-    piles = dict()
-    for face in faces:
-        center = face.center
-        ix, iy, iz = (
-            round((center[0]-f_origin[0]) / voxel_size),
-            round((center[1]-f_origin[1]) / voxel_size),
-            round((center[2]-f_origin[2]) / voxel_size),
-        )
-        try:
-            piles[(iz, ix)].append(iy)
-        except KeyError:
-            piles[(iz, ix)] = [iy,]
-    # Create boxes by raytracing piles along axis
-    # boxes = [[ix0, ix1, iy0, iy1, iz0, iz1], ...]
-    boxes = list()
-    for (iz, ix), iys in piles.items():
-        iys.sort()  # sort in +y direction
-        while iys:
-            iy1, iy0 = iys.pop(), iys.pop()  # pop solid volumes from top to bottom
-            boxes.append([ix, ix+1, iy0, iy1, iz, iz+1,])
-    return boxes, origin
-
-def _get_boxes_along_z(faces, voxel_size) -> "boxes, origin":
-    """Get minimal boxes from faces by raytracing along z axis."""
-    DEBUG and print("BFDS: _get_boxes_along_z")
-    # First face center becomes origin of the integer grid for faces
-    f_origin = tuple(faces[0].center)
-    hvs = voxel_size / 2.
-    origin = (f_origin[0]-hvs, f_origin[1]-hvs, f_origin[2])
-    # Get integer coordinates of faces and
-    # classify faces in integer piles along z
-    # piles = {(3,4):(3,4,15,25,), (3,5):(3,4,15,25), ...}
-    piles = dict()
-    for face in faces:
-        center = face.center
-        ix, iy, iz = (
-            round((center[0]-f_origin[0]) / voxel_size),
-            round((center[1]-f_origin[1]) / voxel_size),
-            round((center[2]-f_origin[2]) / voxel_size),
-        )
-        try:
-            piles[(ix, iy)].append(iz)
-        except KeyError:
-            piles[(ix, iy)] = [iz,]
-    # Create boxes by raytracing piles along axis
-    # boxes = [[ix0, ix1, iy0, iy1, iz0, iz1], ...]
-    boxes = list()
-    for (ix, iy), izs in piles.items():
-        izs.sort()  # sort in +z direction
-        while izs:
-            iz1, iz0 = izs.pop(), izs.pop()  # pop solid volumes from top to bottom
-            boxes.append([ix, ix+1, iy, iy+1, iz0, iz1,])
-    return boxes, origin
-
-# The following functions reduce the number of boxes in xbs format,
-# used to describe the geometry, by merging them
-
-def _grow_boxes_along_x(boxes, sort_by):
-    """Grow boxes by merging neighbours along x axis."""
-    DEBUG and print("BFDS: _grow_boxes_along_x")
-    # Sort boxes
-    boxes.sort(key=lambda box: (box[sort_by], box[0]))
-    # Grow boxes in -x direction, starting from last one
-    boxes_grown = list()
-    box = boxes.pop()
-    while boxes:
-        abox = boxes.pop()
-        # Check same iz0, iz1, iy0, iy1, and touching abox ix1 with box ix0
-        if abox[4] == box[4] and abox[5] == box[5] and \
-           abox[2] == box[2] and abox[3] == box[3] and \
-           abox[1] == box[0]:
-            box[0] = abox[0]  # grow box along -x
-        else:
-            boxes_grown.append(box)  # stash the resulting box
-            box = abox  # init next cycle
-    # Stash the last one
-    boxes_grown.append(box)
-    return boxes_grown
-
-def _grow_boxes_along_y(boxes, sort_by):
-    """Grow boxes by merging neighbours along y axis."""
-    DEBUG and print("BFDS: _grow_boxes_along_y")
-    # Sort boxes
-    boxes.sort(key=lambda box: (box[sort_by], box[2]))
-    # Grow boxes in -y direction, starting from last one
-    boxes_grown = list()
-    box = boxes.pop()
-    while boxes:
-        abox = boxes.pop()
-        # Check same iz0, iz1, ix0, ix1, and touching abox iy1 with box iy0
-        if abox[4] == box[4] and abox[5] == box[5] and \
-           abox[0] == box[0] and abox[1] == box[1] and \
-           abox[3] == box[2]:
-            box[2] = abox[2]  # grow box along -y
-        else:
-            boxes_grown.append(box)  # stash the resulting box
-            box = abox  # init next cycle
-    # Stash the last one
-    boxes_grown.append(box)
-    return boxes_grown
-
-def _grow_boxes_along_z(boxes, sort_by):
-    """Grow boxes by merging neighbours along z axis."""
-    DEBUG and print("BFDS: _grow_boxes_along_z")
-    # Sort boxes
-    boxes.sort(key=lambda box: (box[sort_by], box[4]))
-    # Grow boxes in -z direction, starting from last one
-    boxes_grown = list()
-    box = boxes.pop()
-    while boxes:
-        abox = boxes.pop()
-        # Check same iy0, iy1, ix0, ix1, and touching abox iz1 with box iz0
-        if abox[2] == box[2] and abox[3] == box[3] and \
-           abox[0] == box[0] and abox[1] == box[1] and \
-           abox[5] == box[4]:
-            box[4] = abox[4]  # grow box along -z
-        else:
-            boxes_grown.append(box)  # stash the resulting box
-            box = abox  # init next cycle
-    # Stash the last one
-    boxes_grown.append(box)
-    return boxes_grown
-
-# Transform boxes in integer coordinates, back to global coordinates
-
-def _get_box_xbs(boxes, origin, voxel_size) -> "xbs":
-    """Transform boxes to xbs in global coordinates."""
-    epsilon = 1E-5
-    return ((
-            origin[0] + box[0] * voxel_size - epsilon,
-            origin[0] + box[1] * voxel_size + epsilon,
-            origin[1] + box[2] * voxel_size - epsilon,
-            origin[1] + box[3] * voxel_size + epsilon,
-            origin[2] + box[4] * voxel_size - epsilon,
-            origin[2] + box[5] * voxel_size + epsilon,
-            ) for box in boxes)
+def _get_voxel_origin(tris, voxel_size, centered=False) -> "origin":
+    """Get voxel grid origin, aligned to global origin or centered to tris."""
+    if not centered:
+        return np.zeros(3)
+    co = tris.reshape(-1, 3)
+    co_min, co_max = co.min(axis=0), co.max(axis=0)
+    sizes = np.ceil((co_max - co_min) / voxel_size) * voxel_size
+    return (co_min + co_max - sizes) / 2.
 
 # Pixelization
 
-def get_pixels(context, ob):
-    """Get pixels from flat object in xbs format."""
+def get_pixels(context, ob) -> "boxes, origin, voxel_size, flat_axis, flat_coord, timing":
+    """Get pixels from flat object as integer boxes on the voxel grid, to be flattened."""
     # Check and init
-    DEBUG and print("BFDS: calc_voxels.get_voxels")
+    DEBUG and print("BFDS: calc_voxels.get_pixels")
+    t0 = time()
+    assert(ob.type == 'MESH')
+    if not ob.data.vertices:
+        raise BFException(ob, "Empty object!")
     voxel_size = _get_voxel_size(context, ob)
-    flat_axis = _get_flat_axis(ob, voxel_size)
-    # Create new object, and link it. Then prepare it for voxelization
-    ob_tmp = utils.object_get_global_copy(context, ob, suffix='_pix_tmp')
-    ob_tmp.bf_xb_voxel_size = voxel_size
-    ob_tmp.bf_xb_custom_voxel = True
-    ob_tmp.bf_xb_center_voxels = ob.bf_xb_center_voxels
-    # Check how flat it is
-    if ob_tmp.dimensions[flat_axis] > voxel_size:
-        bpy.data.objects.remove(ob_tmp, do_unlink=True)
+    # Get triangles in global coordinates, apply modifiers
+    tris, _ = utils.get_global_tris(context, ob)
+    if not len(tris):
+        raise BFException(ob, "Empty object!")
+    # Check how flat it is, and get coordinate for flat xbs
+    co = tris.reshape(-1, 3)
+    co_min, co_max = co.min(axis=0), co.max(axis=0)
+    flat_axis = int((co_max - co_min).argmin())
+    if co_max[flat_axis] - co_min[flat_axis] > voxel_size:
         raise BFException(ob, "Object is not flat.")
-    # Get origin for flat xbs
-    bbox = utils.get_bbox(ob_tmp)
-    flat_origin = (bbox[1] + bbox[0]) / 2., (bbox[3] + bbox[2]) / 2., (bbox[5] + bbox[4]) / 2.
-    # Create solidify modifier
-    mo = ob_tmp.modifiers.new('solidify_tmp','SOLIDIFY')
-    mo.thickness = voxel_size
-    mo.offset = 0.  # centered
-    # Apply solidify modifier and remove it
-    ob_tmp.data = ob_tmp.to_mesh(
-        scene=context.scene,
-        apply_modifiers=True,
-        settings="RENDER",
-        calc_tessface=True,
-        calc_undeformed=False,
-    )
-    ob_tmp.modifiers.remove(mo)
-    # Voxelize
-    xbs, voxel_size, ts = get_voxels(context, ob_tmp)
-    # Flatten the solidified object
-    choice = (_x_flatten_xbs, _y_flatten_xbs, _z_flatten_xbs)[flat_axis]
-    xbs = choice(xbs, flat_origin)
-    # Clean and return
-    bpy.data.objects.remove(ob_tmp, do_unlink=True)
-    return xbs, voxel_size, ts
-
-def _get_flat_axis(ob, voxel_size):
-    """Get object flat axis."""
-    dimensions = ob.dimensions
-    choices = [
-        (dimensions[0], 0), # object faces are normal to x axis
-        (dimensions[1], 1), # ... to y axis
-        (dimensions[2], 2), # ... to z axis
-    ]
-    choices.sort(key=lambda k:k[0]) # sort by dimension
-    return choices[0][1]
-
-def _x_flatten_xbs(xbs, flat_origin) -> "[(l0, l0, y0, y1, z0, z1), ...]":
-    """Flatten voxels to obtain pixels (normal to x axis) at flat_origin height."""
-    return [[flat_origin[0], flat_origin[0], xb[2], xb[3], xb[4], xb[5]] for xb in xbs]
-
-def _y_flatten_xbs(xbs, flat_origin) -> "[(x0, x1, l0, l0, z0, z1), ...]":
-    """Flatten voxels to obtain pixels (normal to y axis) at flat_origin height."""
-    return [[xb[0], xb[1], flat_origin[1], flat_origin[1], xb[4], xb[5]] for xb in xbs]
-
-def _z_flatten_xbs(xbs, flat_origin) -> "[(x0, x1, y0, y1, l0, l0), ...]":
-    """Flatten voxels to obtain pixels (normal to z axis) at flat_origin height."""
-    return [[xb[0], xb[1], xb[2], xb[3], flat_origin[2], flat_origin[2]] for xb in xbs]
+    flat_coord = (co_max[flat_axis] + co_min[flat_axis]) / 2.
+    # Align pixels to global origin, or center them to the object
+    origin = _get_voxel_origin(tris, voxel_size, centered=ob.bf_xb_center_voxels)
+    # Rasterize projected triangles and merge pixels in rects
+    t1 = time()
+    rects = pixelize(tris, voxel_size, origin, flat_axis)
+    t2 = time()
+    boxes = rects_to_boxes(rects, flat_axis)
+    t3 = time()
+    # Return with timing: tris, pixelize, boxes
+    return boxes, origin, voxel_size, flat_axis, flat_coord, (t1-t0, t2-t1, t3-t2, 0.)
@@ -0,0 +1,78 @@
+"""BlenderFDS, consolidate voxelized OBST objects sharing their parameters."""
+
+import numpy as np
+from time import time
+
+from . import to_fds
+from .kernels import blob
+from .kernels.sparse import SparseGrid
+from ..exceptions import BFException
+
+DEBUG = False
+
+# Objects split for modelling convenience are voxelized one by one,
+# and their boxes never merge across object boundaries.
+# When exporting, the voxel grids of OBST objects sharing all namelist parameters
+# but ID and XB are united in their lead object, and merged in boxes once.
+# The lead object exports the consolidated xbs from ob["ob_to_xbs_export"],
+# the others a comment from ob["bf_export_note"].
+# Only voxels aligned to the global origin on the same voxel size are united.
+
+def get_groups(context) -> "[[lead_ob, ob, ...], ...]":
+    """Get groups of exported voxelized OBST objects that can be consolidated."""
+    groups = dict()
+    for ob in context.scene.objects:
+        if ob.type != "MESH" or not ob.bf_export or ob.bf_namelist_cls != "ON_OBST" or ob.bf_xb != "VOXELS":
+            continue
+        if ob.bf_xb_center_voxels or ob.bf_xb_mesh_voxel:
+            continue  # on their own grid
+        key = _get_key(context, ob)
+        if key is not None:
+            groups.setdefault(key, list()).append(ob)
+    return [sorted(obs, key=lambda k: k.name) for obs in groups.values() if len(obs) > 1]
+
+def _get_key(context, ob) -> "key or None":
+    """Get the consolidation key of ob: its voxel size and params, None on error."""
+    params = list()
+    for bf_prop in ob.bf_namelist.bf_props:
+        if bf_prop.fds_label in ("ID", "FYI", "XB") or bf_prop.bpy_idname == "bf_id_suffix":
+            continue
+        try:
+            params.append(bf_prop.to_fds(context))
+        except BFException:
+            return None  # reported by the ordinary export
+    voxel_size = ob.bf_xb_custom_voxel and ob.bf_xb_voxel_size or context.scene.bf_default_voxel_size
+    return (round(voxel_size, 9),) + tuple(params)
+
+def set_consolidated(context) -> "None":
+    """Consolidate the voxels of each group in its lead object, before exporting."""
+    DEBUG and print("BFDS: consolidate.set_consolidated")
+    greedy = context.scene.bf_config_voxel_strategy == "GREEDY"
+    for obs in get_groups(context):
+        t0 = time()
+        # Unite the cached voxel boxes of all objects, on the same grid
+        grid, voxel_size = SparseGrid(), None
+        for ob in obs:
+            to_fds.ob_to_xbs(context, ob)  # fill the cache
+            kind, parts, msg = blob.decode_parts(ob["ob_to_xbs_cache"])
+            if kind != blob.KIND_BOXES:
+                continue  # no voxel
+            grid = grid.union(SparseGrid.from_boxes(parts["boxes"]))
+            voxel_size = parts["voxel_size"]
+        if voxel_size is None:
+            continue
+        boxes = grid.boxes(greedy=greedy)
+        # Set lead object and merged objects
+        lead_ob = obs[0]
+        msg = "{0} voxels from {1} consolidated objects, in {2:.3f} s".format(len(boxes), len(obs), time()-t0)
+        lead_ob["ob_to_xbs_export"] = blob.encode_boxes(boxes, np.zeros(3), voxel_size, msg)
+        for ob in obs[1:]:
+            ob["bf_export_note"] = "merged into {}".format(lead_ob.name)
+
+def del_consolidated(context) -> "None":
+    """Delete consolidation and other export time results, after exporting."""
+    DEBUG and print("BFDS: consolidate.del_consolidated")
+    for ob in context.scene.objects:
+        for key in ("ob_to_xbs_export", "bf_export_note"):
+            if key in ob:
+                del ob[key]
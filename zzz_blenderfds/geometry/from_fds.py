@@ -1,9 +1,13 @@
 """BlenderFDS, translate geometry from FDS notation to a Blender mesh."""
 
 import bpy
+import numpy as np
 from time import time
 
 from . import utils
+from .kernels import blob, terrain
+from .kernels.sparse import SparseGrid
+from .kernels.surface import get_surface
 
 #++ from None
 
@@ -61,6 +65,38 @@ def xbs_bbox_to_mesh(xbs, me=None) -> "Mesh":
     me.from_pydata(verts, edges, faces)
     return me
 
+def voxels_to_mesh(data, me=None) -> "Mesh":
+    """Translate voxel boxes blob data to Blender mesh of their boundary surface."""
+    # Get the surface of each part, on its grid
+    kind, parts, _ = blob.decode_parts(data)
+    if kind == blob.KIND_GROUP:
+        parts = [blob.decode_parts(b)[1] for b in parts["blobs"]]
+    else:
+        parts = [parts,]
+    verts, quads, count = list(), list(), 0
+    for part in parts:
+        if "boxes" not in part:
+            continue
+        v, q = get_surface(SparseGrid.from_boxes(part["boxes"]), part["origin"], part["voxel_size"])
+        verts.append(v)
+        quads.append(q + count)
+        count += len(v)
+    # Fill the mesh
+    if not me:
+        me = bpy.data.meshes.new("voxels")
+    if not verts:
+        return me
+    verts, quads = np.concatenate(verts), np.concatenate(quads)
+    me.vertices.add(len(verts))
+    me.vertices.foreach_set("co", verts.astype(np.float32).ravel())
+    me.loops.add(quads.size)
+    me.loops.foreach_set("vertex_index", quads.astype(np.int32).ravel())
+    me.polygons.add(len(quads))
+    me.polygons.foreach_set("loop_start", np.arange(0, quads.size, 4, dtype=np.int32))
+    me.polygons.foreach_set("loop_total", np.full(len(quads), 4, dtype=np.int32))
+    me.update(calc_edges=True)
+    return me
+
 # Caller function
 # If no ob, a new one (named name) is created and returned
 # If no bf_xb, bf_xyz, bf_pb, a guess is made from data
@@ -95,6 +131,18 @@ def xbs_to_ob(xbs, context, ob=None, bf_xb="NONE", name="xbs_to_ob", update_cent
     ob.bf_xb = bf_xb
     return ob
 
+def voxels_to_ob(data, context, ob=None, name="voxels_to_ob", update_center=True) -> "Object":
+    """Transform voxel boxes blob data to Blender object, showing their surface only."""
+    me = voxels_to_mesh(data)
+    if ob:
+        utils.set_global_mesh(context, ob, me) # ob exists, set its mesh
+    else:
+        ob = utils.get_new_object(context, context.scene, name, me) # no ob, get a new one with proper mesh
+    if update_center:
+        utils.set_balanced_center_position(context, ob)
+    ob.bf_xb = "VOXELS"
+    return ob
+
 #++ from XYZ
 
 def xyzs_vertices_to_mesh(xyzs, me=None) -> "Mesh":
@@ -188,25 +236,67 @@ def geom_to_mesh(fds_surfids, fds_verts, fds_faces, me=None) -> "Mesh":
         if not found:
             raise Exception("Unknown SURF_ID '{}'".format(surfid))
     # Treat fds_verts and fds_faces
-    nverts, nfaces = len(fds_verts) // 3, len(fds_faces) // 4
-    if nverts * 3 != len(fds_verts):
+    fds_verts, fds_faces = np.asarray(fds_verts, dtype=np.float32), np.asarray(fds_faces, dtype=np.int32)
+    if fds_verts.size % 3:
         raise Exception("Wrong VERTS length")
-    if nfaces * 4 != len(fds_faces):
+    if fds_faces.size % 4:
         raise Exception("Wrong FACES length")
-    verts = [(fds_verts[i*3], fds_verts[i*3+1], fds_verts[i*3+2],) for i in range(nverts)]
-    edges = list()
-    faces = [(fds_faces[i*4]-1, fds_faces[i*4+1]-1, fds_faces[i*4+2]-1,) for i in range(nfaces)]
-    imats = [fds_faces[i*4+3]-1 for i in range(nfaces)]
+    faces = fds_faces.reshape(-1, 4) - 1  # FDS index start from 1, not 0
     # Check imats
-    if max(imats) > len(me.materials)-1:
+    if len(faces) and faces[:, 3].max() > len(me.materials)-1:
         raise Exception("Wrong SURF_ID length")
     # Create mesh
-    me.from_pydata(verts, edges, faces)
+    me.vertices.add(fds_verts.size // 3)
+    me.vertices.foreach_set("co", fds_verts)
+    me.loops.add(len(faces) * 3)
+    me.loops.foreach_set("vertex_index", faces[:, :3].ravel())
+    me.polygons.add(len(faces))
+    me.polygons.foreach_set("loop_start", np.arange(0, len(faces) * 3, 3, dtype=np.int32))
+    me.polygons.foreach_set("loop_total", np.full(len(faces), 3, dtype=np.int32))
     # Assign materials to faces
-    for iface, face in enumerate(me.polygons):
-        face.material_index = imats[iface]
+    me.polygons.foreach_set("material_index", faces[:, 3].copy())
+    me.update(calc_edges=True)
     return me
 
+def terrain_to_mesh(fds_surfid, ijk, xb, zvals, me=None) -> "Mesh":
+    """Translate GEOM terrain IJK, XB and ZVALS to Blender mesh."""
+    if not me:
+        me = bpy.data.meshes.new("terrain_to_mesh")
+    # Append material slot
+    for ma in bpy.data.materials:
+        if fds_surfid == ma.name:
+            me.materials.append(ma)
+            break
+    else:
+        raise Exception("Unknown SURF_ID '{}'".format(fds_surfid))
+    # Treat grid
+    zvals = np.asarray(zvals, dtype=np.float64)
+    if len(ijk) < 2 or ijk[0] < 2 or ijk[1] < 2 or len(zvals) != ijk[0] * ijk[1]:
+        raise Exception("Wrong IJK or ZVALS length")
+    verts = np.column_stack((terrain.get_points(ijk, xb, epsilon=0.), zvals))
+    quads = terrain.get_quads(ijk)
+    # Create mesh
+    me.vertices.add(len(verts))
+    me.vertices.foreach_set("co", verts.astype(np.float32).ravel())
+    me.loops.add(quads.size)
+    me.loops.foreach_set("vertex_index", quads.astype(np.int32).ravel())
+    me.polygons.add(len(quads))
+    me.polygons.foreach_set("loop_start", np.arange(0, quads.size, 4, dtype=np.int32))
+    me.polygons.foreach_set("loop_total", np.full(len(quads), 4, dtype=np.int32))
+    me.update(calc_edges=True)
+    return me
+
+def terrain_to_ob(fds_surfid, ijk, xb, zvals, context, ob=None, name="terrain_to_ob", update_center=True) -> "Object":
+    """Transform terrain in FDS notation to Blender object."""
+    me = terrain_to_mesh(fds_surfid, ijk, xb, zvals, me=None)
+    if ob:
+        utils.set_global_mesh(context, ob, me) # ob exists, set its mesh
+    else:
+        ob = utils.get_new_object(context, context.scene, name, me) # no ob, get a new one with proper mesh
+    if update_center:
+        utils.set_balanced_center_position(context, ob)
+    return ob
+
 def geom_to_ob(fds_surfids, fds_verts, fds_faces, context, ob=None, name="geom_to_ob", update_center=True) -> "Mesh":
     """Transform geometry in FDS notation to Blender object."""
     # Get mesh, set it, set properties and center position
@@ -0,0 +1,130 @@
+"""BlenderFDS, subtract HOLE objects from voxelized OBST objects."""
+
+import re
+import numpy as np
+from time import time
+
+from . import to_fds, utils
+from .kernels import blob
+from .kernels.sparse import SparseGrid
+
+DEBUG = False
+
+# FDS carves each HOLE out of every overlapping OBST at startup.
+# When exporting, the HOLE xbs are subtracted from the voxel grids of the
+# overlapping voxelized OBST objects before merging them in boxes,
+# and the result is exported from ob["ob_to_xbs_export"].
+# A HOLE namelist is omitted, with a comment from ob["bf_export_note"],
+# only if it carved some OBST object, all the OBST objects it overlaps were carved,
+# and it has no other parameter (eg. a DEVC_ID or CTRL_ID to open or close it at run time).
+# Merged objects are carved in their lead object, that has their consolidated extent.
+# A voxel is carved when its center is inside a HOLE xb.
+
+def _is_carvable(ob) -> "bool":
+    """Return True if ob voxels are on a grid aligned to the global origin, and it permits holes."""
+    return (
+        ob.bf_xb == "VOXELS" and not ob.bf_xb_center_voxels and not ob.bf_xb_mesh_voxel
+        and not ob.get("bf_export_note") # merged
+        and not _is_hole_forbidden(ob.bf_free)
+    )
+
+def _is_hole_forbidden(bf_free) -> "bool":
+    """Return True if bf_free sets PERMIT_HOLE to false, in any FDS logical notation.
+
+    >>> _is_hole_forbidden("PERMIT_HOLE=F"), _is_hole_forbidden("permit_hole = .false."), _is_hole_forbidden("PERMIT_HOLE=.TRUE.")
+    (True, True, False)
+    """
+    return re.search(r"\bPERMIT_HOLE\s*=\s*\.?F", bf_free, re.IGNORECASE) is not None
+
+def _is_omissible(context, ob) -> "bool":
+    """Return True if HOLE ob exports nothing but its geometry."""
+    for bf_prop in ob.bf_namelist.bf_props:
+        if bf_prop.fds_label in ("ID", "FYI", "XB") or bf_prop.bpy_idname == "bf_id_suffix":
+            continue
+        if bf_prop.to_fds(context):
+            return False
+    return True
+
+def _xbs_to_boxes(xbs, voxel_size) -> "boxes":
+    """Get the integer boxes of voxels with their center inside xbs, on the global grid."""
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    xbs = np.asarray(xbs, dtype=np.float64).reshape(-1, 6) / np.repeat(voxel_size, 2) - .5
+    boxes = np.empty((len(xbs), 6), dtype=np.int64)
+    boxes[:, 0::2] = np.ceil(xbs[:, 0::2])
+    boxes[:, 1::2] = np.floor(xbs[:, 1::2]) + 1
+    return boxes
+
+def _overlaps(bbox0, bbox1) -> "bool":
+    """Return True if bounding boxes overlap."""
+    return all(bbox0[2*i] < bbox1[2*i+1] and bbox1[2*i] < bbox0[2*i+1] for i in range(3))
+
+def _get_bbox(context, ob) -> "bbox":
+    """Get the global bounding box of ob, or of its consolidated voxels."""
+    if ob.get("ob_to_xbs_export"):
+        kind, parts, _ = blob.decode_parts(ob["ob_to_xbs_export"])
+        if kind == blob.KIND_BOXES and len(parts["boxes"]):
+            boxes, voxel_size = parts["boxes"], np.broadcast_to(parts["voxel_size"], (3,))
+            lo = boxes[:, 0::2].min(axis=0) * voxel_size + parts["origin"]
+            hi = boxes[:, 1::2].max(axis=0) * voxel_size + parts["origin"]
+            return lo[0], hi[0], lo[1], hi[1], lo[2], hi[2]
+    return utils.get_global_bbox(context, ob)
+
+def set_subtracted(context) -> "None":
+    """Subtract exported HOLE objects from voxelized OBST objects, before exporting."""
+    DEBUG and print("BFDS: holes.set_subtracted")
+    t0 = time()
+    # Get exported OBST and HOLE objects
+    obsts, holes = list(), list()
+    for ob in context.scene.objects:
+        if ob.type != "MESH" or not ob.bf_export or ob.get("bf_export_note"):
+            continue
+        if ob.bf_namelist_cls == "ON_OBST" and ob.bf_xb != "NONE":
+            obsts.append((ob, _get_bbox(context, ob)))
+        elif ob.bf_namelist_cls == "ON_HOLE" and ob.bf_xb != "NONE":
+            holes.append(ob)
+    # Subtract each HOLE from the voxel grids of the overlapping OBST objects
+    grids = dict()  # ob.name: [grid, voxel_size, carved]
+    for hole in holes:
+        xbs, _ = to_fds.ob_to_xbs(context, hole)
+        if not xbs:
+            continue
+        xbs = np.array(xbs)
+        lo, hi = xbs[:, 0::2].min(axis=0), xbs[:, 1::2].max(axis=0)
+        bbox = lo[0], hi[0], lo[1], hi[1], lo[2], hi[2]
+        is_omitted, is_carving = _is_omissible(context, hole), False
+        for ob, ob_bbox in obsts:
+            if not _overlaps(bbox, ob_bbox):
+                continue
+            if not _is_carvable(ob):
+                is_omitted = False
+                continue
+            if ob.name not in grids:
+                grids[ob.name] = _get_grid(context, ob)
+            grid, voxel_size, _ = grids[ob.name]
+            if grid is None:
+                continue  # no voxel
+            boxes = _xbs_to_boxes(xbs, voxel_size)
+            if np.any(boxes[:, 1::2] <= boxes[:, 0::2]):
+                is_omitted = False  # too thin to carve voxels, let FDS do it
+            grids[ob.name][0] = grid.subtract(SparseGrid.from_boxes(boxes))
+            grids[ob.name][2] += 1
+            is_carving = True
+        if is_omitted and is_carving:
+            hole["bf_export_note"] = "subtracted from voxelized OBSTs"
+    # Merge carved voxels in boxes
+    greedy = context.scene.bf_config_voxel_strategy == "GREEDY"
+    for name, (grid, voxel_size, carved) in grids.items():
+        if grid is None or not carved:
+            continue
+        boxes = grid.boxes(greedy=greedy)
+        msg = "{0} voxels, {1} HOLEs subtracted, in {2:.3f} s".format(len(boxes), carved, time()-t0)
+        context.scene.objects[name]["ob_to_xbs_export"] = blob.encode_boxes(boxes, np.zeros(3), voxel_size, msg)
+
+def _get_grid(context, ob) -> "[grid, voxel_size, 0]":
+    """Get the voxel grid of ob, from its consolidated or cached voxels."""
+    if not ob.get("ob_to_xbs_export"):
+        to_fds.ob_to_xbs(context, ob)  # fill the cache
+    kind, parts, msg = blob.decode_parts(ob.get("ob_to_xbs_export") or ob["ob_to_xbs_cache"])
+    if kind != blob.KIND_BOXES:
+        return [None, None, 0]
+    return [SparseGrid.from_boxes(parts["boxes"]), parts["voxel_size"], 0]
@@ -0,0 +1,3 @@
+"""BlenderFDS, geometry kernels working on numpy arrays, without bpy."""
+
+from . import bingeom, blob, boxes, broadphase, elements, estimate, mesh_quality, pixelize, rects, sparse, surface, terrain, tiles, voxelize, weld
@@ -0,0 +1,66 @@
+"""BlenderFDS, read and write FDS GEOM binary files."""
+
+import numpy as np
+
+# FDS reads GEOM BINARY_FILE as a Fortran unformatted sequential file:
+# each record is enclosed by its int32 length in bytes.
+# Records, in native little endian:
+# geom_type int32 (1 for a surface), n_surf_id int32,
+# n_verts, n_faces, n_volus int32,
+# verts 3 * n_verts float64, faces 3 * n_faces int32, surfs n_faces int32,
+# volus 4 * n_volus int32.
+# Faces, surfs and volus indices start from 1.
+
+def write_bingeom(filepath, n_surf_id, verts, faces, surfs, volus=(), geom_type=1) -> "None":
+    """Write verts, faces and their surfs in an FDS GEOM binary file, straight from numpy buffers."""
+    verts = np.asarray(verts, dtype="<f8").reshape(-1, 3)
+    faces = np.asarray(faces, dtype="<i4").reshape(-1, 3)
+    surfs = np.asarray(surfs, dtype="<i4").ravel()
+    volus = np.asarray(volus, dtype="<i4").reshape(-1, 4)
+    with open(filepath, "wb") as f:
+        for data in (
+            np.array((geom_type,), dtype="<i4"),
+            np.array((n_surf_id,), dtype="<i4"),
+            np.array((len(verts), len(faces), len(volus)), dtype="<i4"),
+            verts, faces, surfs, volus,
+        ):
+            _write_record(f, data)
+
+def _write_record(f, data) -> "None":
+    """Write a Fortran unformatted record."""
+    tag = np.array((data.nbytes,), dtype="<i4").tobytes()
+    f.write(tag)
+    f.write(data.tobytes())
+    f.write(tag)
+
+def read_bingeom(filepath) -> "geom_type, n_surf_id, verts, faces, surfs, volus":
+    """Read an FDS GEOM binary file.
+
+    >>> import os, tempfile
+    >>> filepath = os.path.join(tempfile.mkdtemp(), "test.bingeom")
+    >>> write_bingeom(filepath, 2, ((0, 0, 0), (1, 0, 0), (0, 1, 0)), (1, 2, 3), (2,))
+    >>> geom_type, n_surf_id, verts, faces, surfs, volus = read_bingeom(filepath)
+    >>> geom_type, n_surf_id, verts.shape, faces.tolist(), surfs.tolist(), volus.shape
+    (1, 2, (3, 3), [[1, 2, 3]], [2], (0, 4))
+    """
+    with open(filepath, "rb") as f:
+        data = f.read()
+    records, offset = list(), 0
+    while offset < len(data):
+        size = int(np.frombuffer(data, dtype="<i4", count=1, offset=offset)[0])
+        records.append(data[offset+4:offset+4+size])
+        if data[offset+4+size:offset+8+size] != data[offset:offset+4]:
+            raise ValueError("Bad record in GEOM binary file")
+        offset += size + 8
+    if len(records) < 7:
+        raise ValueError("Truncated GEOM binary file")
+    geom_type = int(np.frombuffer(records[0], dtype="<i4")[0])
+    n_surf_id = int(np.frombuffer(records[1], dtype="<i4")[0])
+    n_verts, n_faces, n_volus = np.frombuffer(records[2], dtype="<i4")
+    verts = np.frombuffer(records[3], dtype="<f8").reshape(-1, 3)
+    faces = np.frombuffer(records[4], dtype="<i4").reshape(-1, 3)
+    surfs = np.frombuffer(records[5], dtype="<i4")
+    volus = np.frombuffer(records[6], dtype="<i4").reshape(-1, 4)
+    if len(verts) != n_verts or len(faces) != n_faces or len(surfs) != n_faces or len(volus) != n_volus:
+        raise ValueError("Inconsistent GEOM binary file")
+    return geom_type, n_surf_id, verts, faces, surfs, volus
@@ -0,0 +1,149 @@
+"""BlenderFDS, encode and decode xbs in compact binary blobs."""
+
+import struct
+import numpy as np
+
+# Cached xbs are stored in Blender ID properties as a single bytes blob,
+# much faster to write and read than nested lists of floats.
+# Blob format, little endian:
+# header: magic, kind, count of xbs or boxes
+# kind XBS:   count * 6 float64 xbs
+# kind BOXES: origin 3 float64, voxel_size 3 float64, flat_axis int8, flat_coord float64,
+#             count * 6 int32 boxes in integer grid coordinates
+# kind GROUP: count * (uint32 length, blob), eg. boxes on different grids
+# trailer: utf8 message
+
+_magic = b"BFX1"
+_header = struct.Struct("<4sBI")
+_boxes_header = struct.Struct("<3d3dbd")
+_length = struct.Struct("<I")
+
+KIND_XBS, KIND_BOXES, KIND_GROUP = 0, 1, 2
+
+epsilon = 1E-5  # voxel xbs are slightly inflated to avoid gaps
+
+def encode_xbs(xbs, msg="") -> "blob":
+    """Encode xbs and msg in a blob."""
+    xbs = np.asarray(xbs, dtype="<f8").reshape(-1, 6)
+    return b"".join((
+        _header.pack(_magic, KIND_XBS, len(xbs)),
+        xbs.tobytes(),
+        msg.encode("utf8"),
+    ))
+
+def encode_boxes(boxes, origin, voxel_size, msg="", flat_axis=-1, flat_coord=0.) -> "blob":
+    """Encode integer boxes, grid origin and voxel_size, and msg in a blob.
+
+    Boxes are flattened on flat_axis at flat_coord, if flat_axis is not -1.
+    """
+    boxes = np.asarray(boxes, dtype="<i4").reshape(-1, 6)
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    return b"".join((
+        _header.pack(_magic, KIND_BOXES, len(boxes)),
+        _boxes_header.pack(*(tuple(origin) + tuple(voxel_size) + (flat_axis, flat_coord))),
+        boxes.tobytes(),
+        msg.encode("utf8"),
+    ))
+
+def encode_group(blobs, msg="") -> "blob":
+    """Encode a group of blobs and msg in a blob."""
+    return b"".join(
+        (_header.pack(_magic, KIND_GROUP, len(blobs)),)
+        + tuple(_length.pack(len(b)) + b for b in blobs)
+        + (msg.encode("utf8"),)
+    )
+
+def decode_parts(blob) -> "kind, parts, msg":
+    """Decode the blob in its parts, without computing xbs."""
+    blob = bytes(blob)
+    magic, kind, count = _header.unpack_from(blob)
+    if magic != _magic:
+        raise ValueError("BFDS: Unknown cache blob")
+    offset = _header.size
+    if kind == KIND_XBS:
+        end = offset + count * 6 * 8
+        parts = {"xbs": np.frombuffer(blob, dtype="<f8", count=count * 6, offset=offset).reshape(-1, 6)}
+    elif kind == KIND_GROUP:
+        blobs = list()
+        for _ in range(count):
+            length, = _length.unpack_from(blob, offset)
+            offset += _length.size
+            blobs.append(blob[offset:offset + length])
+            offset += length
+        end, parts = offset, {"blobs": blobs}
+    else:
+        values = _boxes_header.unpack_from(blob, offset)
+        offset += _boxes_header.size
+        end = offset + count * 6 * 4
+        parts = {
+            "origin": np.array(values[0:3]),
+            "voxel_size": np.array(values[3:6]),
+            "flat_axis": values[6],
+            "flat_coord": values[7],
+            "boxes": np.frombuffer(blob, dtype="<i4", count=count * 6, offset=offset).reshape(-1, 6),
+        }
+    return kind, parts, blob[end:].decode("utf8")
+
+def decode_xbs(blob) -> "xbs, msg":
+    """Decode the blob in float xbs and msg.
+
+    >>> blob = encode_boxes([[0, 2, 0, 1, 0, 1]], (0., 0., 0.), .5, "1 voxels")
+    >>> xbs, msg = decode_xbs(blob)
+    >>> [round(x, 6) for x in xbs[0]], msg
+    ([-1e-05, 1.00001, -1e-05, 0.50001, -1e-05, 0.50001], '1 voxels')
+    >>> decode_xbs(encode_boxes([[0, 2, 0, 1, 0, 1]], (0., 0., 0.), .5, flat_axis=2, flat_coord=.3))[0]
+    [[-1e-05, 1.00001, -1e-05, 0.50001, 0.3, 0.3]]
+    >>> decode_xbs(encode_xbs([(0., 1., 0., 1., 0., 0.)], "1 faces"))
+    ([[0.0, 1.0, 0.0, 1.0, 0.0, 0.0]], '1 faces')
+    >>> group = encode_group((blob, encode_xbs([(0., 1., 0., 1., 0., 0.)])), "2 parts")
+    >>> xbs, msg = decode_xbs(group)
+    >>> len(xbs), msg
+    (2, '2 parts')
+    """
+    kind, parts, msg = decode_parts(blob)
+    if kind == KIND_XBS:
+        return parts["xbs"].tolist(), msg
+    if kind == KIND_GROUP:
+        return [xb for b in parts["blobs"] for xb in decode_xbs(b)[0]], msg
+    return boxes_to_xbs(**parts), msg
+
+def boxes_to_xbs(boxes, origin, voxel_size, flat_axis=-1, flat_coord=0.) -> "xbs":
+    """Transform integer boxes to xbs in global coordinates, flattened on flat_axis."""
+    xbs = (
+        np.repeat(origin, 2) + boxes * np.repeat(voxel_size, 2)
+        + (-epsilon, epsilon, -epsilon, epsilon, -epsilon, epsilon)
+    )
+    if flat_axis >= 0:
+        xbs[:, 2 * flat_axis:2 * flat_axis + 2] = flat_coord
+    return xbs.tolist()
+
+def translate_blob(blob, delta, centered=False) -> "blob or None":
+    """Translate the boxes in blob by delta, None if it is not possible.
+
+    Boxes aligned to the global origin are shifted by whole voxels only,
+    boxes centered to their object follow it with their grid origin.
+
+    >>> data = encode_boxes([[0, 2, 0, 1, 0, 1]], (0., 0., 0.), .5, "1 voxels")
+    >>> decode_parts(translate_blob(data, (1., -.5, 0.)))[1]["boxes"].tolist()
+    [[2, 4, -1, 0, 0, 1]]
+    >>> translate_blob(data, (.2, 0., 0.)) is None
+    True
+    >>> decode_parts(translate_blob(data, (.2, 0., 0.), centered=True))[1]["origin"].tolist()
+    [0.2, 0.0, 0.0]
+    """
+    kind, parts, msg = decode_parts(blob)
+    if kind != KIND_BOXES:
+        return None
+    delta = np.asarray(delta, dtype=np.float64)
+    boxes, origin = parts["boxes"], parts["origin"]
+    if centered:
+        origin = origin + delta
+    else:
+        shifts = delta / parts["voxel_size"]
+        if not np.allclose(shifts, np.round(shifts), rtol=0., atol=1E-6):
+            return None
+        boxes = boxes + np.repeat(np.round(shifts).astype(np.int64), 2)
+    flat_axis, flat_coord = parts["flat_axis"], parts["flat_coord"]
+    if flat_axis >= 0:
+        flat_coord += delta[flat_axis]
+    return encode_boxes(boxes, origin, parts["voxel_size"], msg, flat_axis=flat_axis, flat_coord=flat_coord)
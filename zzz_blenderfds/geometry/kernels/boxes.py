@@ -0,0 +1,65 @@
+"""BlenderFDS, build and merge boxes of voxels."""
+
+import numpy as np
+
+# boxes = [[i0, i1, j0, j1, k0, k1], ...] in integer grid coordinates, ends excluded,
+# they are very alike XBs.
+
+def runs_to_boxes(runs) -> "boxes":
+    """Transform z runs [[i, j, k0, k1], ...] to boxes."""
+    runs = np.asarray(runs, dtype=np.int64).reshape(-1, 4)
+    return np.column_stack((runs[:, 0], runs[:, 0] + 1, runs[:, 1], runs[:, 1] + 1, runs[:, 2], runs[:, 3]))
+
+def grow_boxes(boxes, axis) -> "boxes":
+    """Grow boxes by merging neighbours along axis (0 is x, 1 is y, 2 is z).
+
+    >>> boxes = runs_to_boxes([[0, 0, 0, 2], [0, 1, 0, 2], [1, 0, 0, 2], [1, 1, 0, 1]])
+    >>> grow_boxes(grow_boxes(boxes, 1), 0).tolist()
+    [[1, 2, 0, 1, 0, 2], [0, 1, 0, 2, 0, 2], [1, 2, 1, 2, 0, 1]]
+    """
+    if len(boxes) < 2: return boxes
+    a = 2 * axis
+    others = [c for c in range(6) if c not in (a, a+1)]
+    # Sort by other extents, then by start along axis
+    order = np.lexsort([boxes[:, a],] + [boxes[:, c] for c in reversed(others)])
+    boxes = boxes[order]
+    # Join to previous when with the same other extents, and touching
+    joins = (boxes[1:, others] == boxes[:-1, others]).all(axis=1) & (boxes[1:, a] == boxes[:-1, a+1])
+    starts = np.flatnonzero(np.concatenate(([True], ~joins)))
+    ends = np.append(starts[1:], len(boxes)) - 1
+    grown = boxes[starts]  # a copy
+    grown[:, a+1] = boxes[ends, a+1]
+    return grown
+
+# Greedy meshing: the occupancy grid is scanned in order, and from each
+# remaining voxel the largest box is grown along z, then y, then x.
+# The voxels of the box are then removed from the occupancy grid.
+
+def greedy_boxes(occupancy, offset=(0, 0, 0)) -> "boxes":
+    """Merge occupancy grid voxels in maximal boxes by greedy meshing.
+
+    >>> occupancy = np.ones((2, 2, 2), dtype=bool)
+    >>> occupancy[1, 1, 1] = False
+    >>> greedy_boxes(occupancy, (10, 0, 0)).tolist()
+    [[10, 11, 0, 2, 0, 2], [11, 12, 0, 1, 0, 2], [11, 12, 1, 2, 0, 1]]
+    """
+    remaining = occupancy.copy()
+    flat = remaining.reshape(-1)  # a view
+    ni, nj, nk = remaining.shape
+    boxes = list()
+    # Visit each filled voxel once, in order, skip the ones already boxed
+    for p in np.flatnonzero(flat).tolist():
+        if not flat[p]: continue
+        i, jk = divmod(p, nj * nk)
+        j, k = divmod(jk, nk)
+        # Grow along z, y, and x while all voxels remain
+        row = remaining[i, j, k:]
+        k1 = row.all() and nk or k + int(row.argmin())
+        j1 = j + 1
+        while j1 < nj and remaining[i, j1, k:k1].all(): j1 += 1
+        i1 = i + 1
+        while i1 < ni and remaining[i1, j:j1, k:k1].all(): i1 += 1
+        remaining[i:i1, j:j1, k:k1] = False
+        boxes.append((i, i1, j, j1, k, k1))
+    boxes = np.array(boxes, dtype=np.int64).reshape(-1, 6)
+    return boxes + np.repeat(offset, 2)
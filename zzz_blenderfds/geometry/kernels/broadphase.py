@@ -0,0 +1,37 @@
+"""BlenderFDS, sweep and prune broadphase on bounding boxes."""
+
+import numpy as np
+
+# Bounding boxes are sorted by their min along the sweep axis,
+# the one with the largest spread of box centers.
+# Each box is paired with the following boxes starting before its max,
+# then pairs are pruned by overlap along the other two axes.
+# Touching boxes are paired, as their faces may intersect.
+
+def get_pairs(bboxes, epsilon=0.) -> "pairs":
+    """Get the index pairs (i < j) of overlapping bboxes, in xbs format, grown by epsilon.
+
+    >>> bboxes = ((0, 1, 0, 1, 0, 1), (1, 2, 0, 1, 0, 1), (3, 4, 0, 1, 0, 1), (.5, 3.5, .5, .6, 2, 3))
+    >>> get_pairs(bboxes).tolist()
+    [[0, 1]]
+    >>> get_pairs(bboxes, epsilon=1.).tolist()
+    [[0, 1], [0, 2], [0, 3], [1, 2], [1, 3], [2, 3]]
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 6)
+    lo, hi = bboxes[:, 0::2] - epsilon, bboxes[:, 1::2] + epsilon
+    if len(bboxes) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    # Sweep along the axis with the largest spread
+    axis = int(np.argmax((lo + hi).var(axis=0)))
+    order = np.argsort(lo[:, axis], kind="mergesort")
+    starts = lo[order, axis]
+    ends = np.searchsorted(starts, hi[order, axis], side="right")
+    # Pair each box with the following ones, starting before its end
+    counts = np.maximum(ends - np.arange(len(order)) - 1, 0)
+    i = np.repeat(np.arange(len(order)), counts)
+    j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + i + 1
+    i, j = order[i], order[j]
+    # Prune by the other axes
+    is_overlap = np.all((lo[i] <= hi[j]) & (lo[j] <= hi[i]), axis=1)
+    pairs = np.sort(np.column_stack((i[is_overlap], j[is_overlap])), axis=1)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
@@ -0,0 +1,99 @@
+"""BlenderFDS, xbs and xyzs of mesh faces, edges and vertices."""
+
+import numpy as np
+from .rects import merge_rects
+
+# Faces are flattened on the axis of their smallest extent, at its middle,
+# preferring z, then y, then x on ties.
+# Results are sorted lexicographically, as Python sorts tuples.
+# Coplanar faces are merged on the ranks of their coordinates,
+# so merged xbs keep the original coordinates and the same coverage.
+
+def sort_rows(a) -> "a":
+    """Sort the rows of a lexicographically.
+
+    >>> sort_rows(((1., 0.), (0., 2.), (0., 1.))).tolist()
+    [[0.0, 1.0], [0.0, 2.0], [1.0, 0.0]]
+    """
+    a = np.asarray(a, dtype=np.float64)
+    if not len(a):
+        return a
+    return a[np.lexsort(a.T[::-1])]
+
+def faces_to_xbs(co, vs) -> "xbs":
+    """Get the flattened and sorted bounding boxes of tessfaces vs (4 raw vertex indices each).
+
+    A tessface with the fourth vertex index set to 0 is a triangle.
+
+    >>> co = ((0., 0., 0.), (1., 0., 0.), (1., 1., 0.), (0., 1., .1), (0., 0., 1.))
+    >>> faces_to_xbs(co, ((0, 1, 2, 3), (1, 2, 4, 0))).tolist()
+    [[0.0, 1.0, 0.0, 1.0, 0.05, 0.05], [0.0, 1.0, 0.0, 1.0, 0.5, 0.5]]
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    vs = np.array(vs, dtype=np.int64).reshape(-1, 4)
+    if not len(vs):
+        return np.empty((0, 6))
+    is_tri = vs[:, 3] == 0
+    vs[is_tri, 3] = vs[is_tri, 0]
+    points = co[vs]
+    lo, hi = points.min(axis=1), points.max(axis=1)
+    # Flat axis, z first on ties
+    axis = 2 - np.argmin((hi - lo)[:, ::-1], axis=1)
+    rows = np.arange(len(vs))
+    lo[rows, axis] = hi[rows, axis] = (lo[rows, axis] + hi[rows, axis]) / 2.
+    xbs = np.empty((len(vs), 6))
+    xbs[:, 0::2], xbs[:, 1::2] = lo, hi
+    return sort_rows(xbs)
+
+def edges_to_xbs(co, edge_verts) -> "xbs":
+    """Get the sorted xbs of edges, from their first to their second vertex.
+
+    >>> co = ((0., 0., 0.), (1., 0., 0.), (1., 1., 0.))
+    >>> edges_to_xbs(co, ((1, 2), (0, 1))).tolist()
+    [[0.0, 1.0, 0.0, 0.0, 0.0, 0.0], [1.0, 1.0, 0.0, 1.0, 0.0, 0.0]]
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    edge_verts = np.asarray(edge_verts, dtype=np.int64).reshape(-1, 2)
+    xbs = np.empty((len(edge_verts), 6))
+    xbs[:, 0::2], xbs[:, 1::2] = co[edge_verts[:, 0]], co[edge_verts[:, 1]]
+    return sort_rows(xbs)
+
+_UV_COLS = np.array(((2, 3, 4, 5), (0, 1, 4, 5), (0, 1, 2, 3)))  # xb columns of the other axes
+
+def merge_faces(xbs, epsilon=1E-6) -> "xbs":
+    """Drop duplicated flat xbs and merge the abutting coplanar ones, when their union is a rect.
+
+    Coordinates closer than epsilon are snapped to the same value. Non flat xbs are kept.
+
+    >>> xbs = ((0., 1., 0., 1., 0., 0.), (1., 2., 0., 1., 0., 0.), (0., 1., 0., 1., 0., 0.), (0., 0., 0., 1., 0., 1.))
+    >>> merge_faces(xbs).tolist()
+    [[0.0, 0.0, 0.0, 1.0, 0.0, 1.0], [0.0, 2.0, 0.0, 1.0, 0.0, 0.0]]
+    >>> merge_faces(((0., 1., 0., 1., 0., 0.), (1., 2., 0., .5, 0., 0.))).tolist()
+    [[0.0, 1.0, 0.0, 1.0, 0.0, 0.0], [1.0, 2.0, 0.0, 0.5, 0.0, 0.0]]
+    """
+    xbs = np.asarray(xbs, dtype=np.float64).reshape(-1, 6)
+    if len(xbs) < 2:
+        return sort_rows(xbs)
+    # Rank the coordinates, snapped to epsilon
+    keys = np.round(xbs.ravel() / epsilon).astype(np.int64)
+    _, firsts, ranks = np.unique(keys, return_index=True, return_inverse=True)
+    values, ranks = xbs.ravel()[firsts], ranks.reshape(-1, 6)
+    extents = ranks[:, 1::2] - ranks[:, 0::2]
+    is_flat = np.any(extents == 0, axis=1)
+    if not is_flat.any():
+        return sort_rows(xbs)
+    ranks, extents = ranks[is_flat], extents[is_flat]
+    # Group by flat axis (z first on ties) and plane, then dedupe and merge
+    axis = 2 - np.argmin(extents[:, ::-1], axis=1)
+    rows = np.arange(len(ranks))
+    groups = axis * len(values) + ranks[rows, 2 * axis]
+    rects = ranks[rows[:, np.newaxis], _UV_COLS[axis]]
+    uniques = np.unique(np.column_stack((groups, rects)), axis=0)
+    rects, groups = merge_rects(uniques[:, 1:], uniques[:, 0])
+    # Rebuild merged xbs
+    axis, planes = groups // len(values), groups % len(values)
+    rows = np.arange(len(rects))
+    merged = np.empty((len(rects), 6), dtype=np.int64)
+    merged[rows[:, np.newaxis], _UV_COLS[axis]] = rects
+    merged[rows, 2 * axis] = merged[rows, 2 * axis + 1] = planes
+    return sort_rows(np.concatenate((values[merged], xbs[~is_flat])))
@@ -0,0 +1,46 @@
+"""BlenderFDS, cheap estimate of voxelization size and cost."""
+
+import numpy as np
+
+from .sparse import brick_size
+
+# The estimate only uses the surface area, the bounding box and the triangle count.
+# The solid volume is approximated by area * smallest dimension / 6,
+# exact for spheres and cubes, capped by the bounding box volume.
+# Boxes grow with the voxelized surface, memory and time with the occupied bricks.
+# Constants are measured on the sweep strategy, single process.
+
+boxes_per_surface_voxel = 1. / 8.
+bytes_per_brick = 12000
+bytes_per_tri = 500
+seconds_per_brick = 60E-6
+seconds_per_brick_greedy = 120E-6
+seconds_per_tri = 2E-6
+
+def estimate_voxels(area, bbox, voxel_size, tris_count=0, flat=False, greedy=False) \
+    -> "voxels, boxes, memory, runtime":
+    """Estimate voxel and box counts, peak memory in bytes and runtime in s.
+
+    >>> voxels, boxes, memory, runtime = estimate_voxels(4 * np.pi, (-1., 1., -1., 1., -1., 1.), .05)
+    >>> round(voxels), round(boxes)
+    (33510, 628)
+    >>> round(estimate_voxels(1., (0., 1., 0., 1., 0., 0.), .1, flat=True)[0])
+    100
+    """
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    bbox = np.asarray(bbox, dtype=np.float64)
+    dimensions = bbox[1::2] - bbox[0::2]
+    voxel_area = np.prod(voxel_size) ** (2. / 3.)
+    if flat:
+        voxels = area / voxel_area
+        surface_voxels = voxels
+    else:
+        bbox_voxels = np.prod(np.ceil(dimensions / voxel_size))
+        surface_voxels = area / voxel_area
+        voxels = area * dimensions.min() / 6. / np.prod(voxel_size)
+        voxels = min(bbox_voxels, max(voxels, surface_voxels / 2.))
+    boxes = min(voxels, max(1., surface_voxels * boxes_per_surface_voxel))
+    bricks = voxels / brick_size ** 3 + surface_voxels / brick_size ** 2
+    memory = bricks * bytes_per_brick + tris_count * bytes_per_tri
+    runtime = bricks * (greedy and seconds_per_brick_greedy or seconds_per_brick) + tris_count * seconds_per_tri
+    return float(voxels), float(boxes), float(memory), float(runtime)
@@ -0,0 +1,265 @@
+"""BlenderFDS, single pass mesh quality analysis on flat mesh arrays."""
+
+import numpy as np
+
+from .weld import get_close_pairs, get_remap
+
+# The mesh is described by the arrays read with foreach_get:
+# co (n, 3) vertex coordinates, edge_verts (m, 2) edge vertices,
+# loop_verts and loop_edges loop vertex and edge indices,
+# loop_starts and loop_totals polygon loop ranges.
+# Every check is computed at once, and reported with the indices of bad elements.
+
+checks = (
+    # name, element, message
+    ("non_manifold_edges", "EDGE", "Non manifold or open geometry"),
+    ("non_manifold_verts", "VERT", "Non manifold vertices"),
+    ("non_contiguous_edges", "EDGE", "Inconsistent face normals"),
+    ("short_edges", "EDGE", "Too short edges"),
+    ("small_faces", "FACE", "Too small area faces"),
+    ("loose_verts", "VERT", "Loose vertices"),
+    ("duplicate_verts", "VERT", "Duplicate vertices"),
+)
+
+def get_report(co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals,
+        min_edge_length=1E-5, min_face_area=1E-8, areas=None, pairs=None) -> "report":
+    """Get the quality report of a mesh, a dict of bad element indices for each check.
+
+    Polygon areas and the pairs of vertices closer than min_edge_length are computed, if not given.
+
+    >>> co = np.array(((0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.), (5., 5., 5.)))
+    >>> tris = np.array(((0, 2, 1), (0, 1, 3), (1, 2, 3), (0, 3, 2)))
+    >>> report = get_report(co, *get_arrays(tris))
+    >>> {name: indices.tolist() for name, indices in report.items() if len(indices)}
+    {'loose_verts': [4]}
+    >>> report = get_report(co, *get_arrays(tris[:3]))  # open
+    >>> report["non_manifold_edges"].tolist()
+    [1, 2, 5]
+    >>> tris[3] = 0, 2, 3  # flipped
+    >>> report = get_report(co, *get_arrays(tris))
+    >>> report["non_contiguous_edges"].tolist()
+    [1, 2, 5]
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    edge_verts = np.asarray(edge_verts, dtype=np.int64).reshape(-1, 2)
+    loop_verts, loop_edges = np.asarray(loop_verts, dtype=np.int64), np.asarray(loop_edges, dtype=np.int64)
+    loop_starts, loop_totals = np.asarray(loop_starts, dtype=np.int64), np.asarray(loop_totals, dtype=np.int64)
+    polys, next_loops = _get_next_loops(loop_starts, loop_totals)
+    # Edges shall join two faces, traversed in opposite directions
+    edge_faces = np.bincount(loop_edges, minlength=len(edge_verts))
+    first, second = _get_loop_pairs(loop_edges, len(edge_verts))
+    is_flipped = loop_verts[first] == loop_verts[second]
+    # Edge lengths and polygon areas, by the vector area of its loops
+    lengths = np.linalg.norm(co[edge_verts[:, 1]] - co[edge_verts[:, 0]], axis=1)
+    if areas is not None:
+        areas = np.asarray(areas)
+    elif len(loop_verts):
+        crosses = np.cross(co[loop_verts], co[loop_verts[next_loops]])
+        areas = np.linalg.norm(np.add.reduceat(crosses, loop_starts, axis=0), axis=1) / 2.
+    else:
+        areas = np.zeros(len(loop_starts))
+    # Vertices in edges
+    vert_edges = np.bincount(edge_verts.ravel(), minlength=len(co))
+    return {
+        "non_manifold_edges": np.flatnonzero(edge_faces != 2),
+        "non_manifold_verts": _get_non_manifold_verts(len(co), loop_verts, next_loops, first, second),
+        "non_contiguous_edges": np.unique(loop_edges[first[is_flipped]]),
+        "short_edges": np.flatnonzero(lengths <= min_edge_length),
+        "small_faces": np.flatnonzero(areas <= min_face_area),
+        "loose_verts": np.flatnonzero(vert_edges == 0),
+        "duplicate_verts": np.unique(get_close_pairs(co, min_edge_length) if pairs is None else pairs),
+    }
+
+def get_welded_report(co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals,
+        min_edge_length=1E-5, min_face_area=1E-8, areas=None, remap=None) -> "report":
+    """Get the quality report of a mesh, after welding vertices closer than min_edge_length,
+    as it is exported. Bad element indices refer to the original mesh.
+
+    The welded index of each vertex from get_remap is computed, if not given.
+
+    >>> co = np.array(((0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.), (0., 1., 1E-6)))
+    >>> tris = np.array(((0, 2, 1), (0, 1, 3), (1, 4, 3), (0, 3, 2)))  # 2 and 4 are welded
+    >>> {name: indices.tolist() for name, indices in get_report(co, *get_arrays(tris)).items() if len(indices)}
+    {'non_manifold_edges': [3, 5, 6, 7], 'duplicate_verts': [2, 4]}
+    >>> {name: indices.tolist() for name, indices in get_welded_report(co, *get_arrays(tris)).items() if len(indices)}
+    {}
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    edge_verts = np.asarray(edge_verts, dtype=np.int64).reshape(-1, 2)
+    loop_verts = np.asarray(loop_verts, dtype=np.int64)
+    loop_starts, loop_totals = np.asarray(loop_starts, dtype=np.int64), np.asarray(loop_totals, dtype=np.int64)
+    if remap is None:
+        remap, _ = get_remap(co, min_edge_length)
+    # Welded vertices are never closer than min_edge_length to each other
+    _, firsts = np.unique(remap, return_index=True)
+    pairs = np.empty((0, 2), dtype=np.int64)
+    if len(firsts) == len(co):
+        return get_report(co, edge_verts, loop_verts, loop_edges, loop_starts, loop_totals,
+            min_edge_length, min_face_area, areas, pairs)
+    # Remap loops, drop collapsed loops and polygons
+    polys, next_loops = _get_next_loops(loop_starts, loop_totals)
+    loop_verts = remap[loop_verts]
+    is_kept = loop_verts != loop_verts[next_loops]
+    totals = np.bincount(polys[is_kept], minlength=len(loop_starts))
+    kept_polys = np.flatnonzero(totals >= 3)
+    is_kept &= (totals >= 3)[polys]
+    loop_verts, loop_totals = loop_verts[is_kept], totals[kept_polys]
+    loop_starts = np.cumsum(loop_totals) - loop_totals
+    welded_edge_verts, loop_edges = get_edges(loop_verts, loop_starts, loop_totals)
+    if areas is not None:
+        areas = np.asarray(areas)[kept_polys]
+    report = get_report(co[firsts], welded_edge_verts, loop_verts, loop_edges, loop_starts, loop_totals,
+        min_edge_length, min_face_area, areas, pairs)
+    # Refer bad elements to the original mesh
+    size = len(firsts)
+    edge_keys = np.sort(remap[edge_verts], axis=1)
+    edge_keys = edge_keys[:, 0] * size + edge_keys[:, 1]
+    for name, element, _ in checks:
+        bad = report[name]
+        if element == "VERT":
+            report[name] = np.flatnonzero(np.isin(remap, bad))
+        elif element == "EDGE":
+            bad_keys = welded_edge_verts[bad, 0] * size + welded_edge_verts[bad, 1]
+            report[name] = np.flatnonzero(np.isin(edge_keys, bad_keys))
+        else:
+            report[name] = kept_polys[bad]
+    return report
+
+def _get_next_loops(loop_starts, loop_totals) -> "polys, next_loops":
+    """Get the polygon of each loop and the next loop in its polygon."""
+    polys = np.repeat(np.arange(len(loop_starts)), loop_totals)
+    offsets = np.arange(len(polys)) - loop_starts[polys]
+    return polys, loop_starts[polys] + (offsets + 1) % loop_totals[polys]
+
+def _get_loop_pairs(loop_edges, count) -> "first, second":
+    """Get the two loops of each edge joining exactly two faces."""
+    edge_faces = np.bincount(loop_edges, minlength=count)
+    order = np.argsort(loop_edges, kind="mergesort")
+    is_pair = edge_faces[loop_edges[order]] == 2
+    return order[is_pair][0::2], order[is_pair][1::2]
+
+def get_inverted_faces(co, edge_verts, loop_verts, loop_starts, loop_totals, remap=None) -> "faces":
+    """Get the faces of each connected shell with negative signed volume, whose normals point inward.
+
+    The mesh shall pass get_report checks: consistent face normals and manifold vertices,
+    so that shells connected by edges are connected by faces.
+    Shells are connected after welding by remap, from get_remap, if given.
+
+    >>> co = np.array(((0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.)))
+    >>> tris = np.array(((0, 2, 1), (0, 1, 3), (1, 2, 3), (0, 3, 2)))
+    >>> edge_verts, loop_verts, _, loop_starts, loop_totals = get_arrays(tris)
+    >>> get_inverted_faces(co, edge_verts, loop_verts, loop_starts, loop_totals).tolist()
+    []
+    >>> edge_verts, loop_verts, _, loop_starts, loop_totals = get_arrays(tris[:, ::-1])
+    >>> get_inverted_faces(co, edge_verts, loop_verts, loop_starts, loop_totals).tolist()
+    [0, 1, 2, 3]
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    edge_verts, loop_verts = np.asarray(edge_verts, dtype=np.int64).reshape(-1, 2), np.asarray(loop_verts, dtype=np.int64)
+    loop_starts, loop_totals = np.asarray(loop_starts, dtype=np.int64), np.asarray(loop_totals, dtype=np.int64)
+    if not len(loop_starts):
+        return np.empty(0, dtype=np.int64)
+    if remap is None:
+        remap = np.arange(len(co))
+    # Label shells by their welded vertices, connected by edges
+    edge_verts = remap[edge_verts]
+    labels = _get_components(len(co), edge_verts[:, 0], edge_verts[:, 1])
+    labels = labels[remap[loop_verts[loop_starts]]]
+    # Signed volume of each shell, by the tetrahedra of the polygon fan triangles
+    polys = np.repeat(np.arange(len(loop_starts)), loop_totals)
+    offsets = np.arange(len(polys)) - loop_starts[polys]
+    fans = np.flatnonzero((offsets > 0) & (offsets < loop_totals[polys] - 1))
+    co = co - co.mean(axis=0)
+    crosses = np.cross(co[loop_verts[fans]], co[loop_verts[fans + 1]])
+    volumes = np.einsum("ij,ij->i", co[loop_verts[loop_starts[polys[fans]]]], crosses)
+    volumes = np.bincount(labels[polys[fans]], weights=volumes, minlength=len(co))
+    return np.flatnonzero(volumes[labels] < 0.)
+
+def _get_components(count, a, b) -> "labels":
+    """Label the connected components of count nodes joined by a-b links, with their min node."""
+    a, b = np.concatenate((a, b)), np.concatenate((b, a))
+    order = np.argsort(a, kind="mergesort")
+    a, b = a[order], b[order]
+    labels = np.arange(count)
+    if not len(a):
+        return labels
+    starts = np.flatnonzero(np.concatenate(([True], a[1:] != a[:-1])))
+    nodes = a[starts]
+    # Hook each node to its min neighbour label, then jump pointers to the roots
+    while True:
+        new_labels = labels.copy()
+        new_labels[nodes] = np.minimum(labels[nodes], np.minimum.reduceat(labels[b], starts))
+        new_labels = _jump_pointers(new_labels)
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+def _jump_pointers(labels) -> "labels":
+    """Point each label to its root, a label pointing to itself."""
+    while True:
+        jumped = labels[labels]
+        if np.array_equal(jumped, labels):
+            return labels
+        labels = jumped
+
+def get_material_boundary_verts(loop_verts, loop_edges, loop_starts, loop_totals, materials) -> "verts":
+    """Get the vertices of manifold edges between faces of different materials.
+
+    >>> tris = np.array(((0, 2, 1), (0, 1, 3), (1, 2, 3), (0, 3, 2)))
+    >>> get_material_boundary_verts(*get_arrays(tris)[1:], materials=(0, 0, 1, 1)).tolist()
+    [0, 1, 2, 3]
+    >>> get_material_boundary_verts(*get_arrays(tris)[1:], materials=(0, 1, 1, 1)).tolist()
+    [0, 1, 2]
+    """
+    loop_verts, loop_edges = np.asarray(loop_verts, dtype=np.int64), np.asarray(loop_edges, dtype=np.int64)
+    loop_starts, loop_totals = np.asarray(loop_starts, dtype=np.int64), np.asarray(loop_totals, dtype=np.int64)
+    materials = np.asarray(materials)
+    if not len(loop_verts):
+        return np.empty(0, dtype=np.int64)
+    polys, next_loops = _get_next_loops(loop_starts, loop_totals)
+    first, second = _get_loop_pairs(loop_edges, loop_edges.max() + 1)
+    first = first[materials[polys[first]] != materials[polys[second]]]
+    return np.unique(np.concatenate((loop_verts[first], loop_verts[next_loops[first]])))
+
+def _get_non_manifold_verts(count, loop_verts, next_loops, first, second) -> "verts":
+    """Get vertices whose faces do not form a single fan, joined by manifold edges."""
+    # Each loop is a face corner at its vertex, touching its edge and the previous loop edge.
+    # first and second are the two loops of each manifold edge: the corners sharing
+    # the edge at the same vertex are neighbours in the fan.
+    corners = np.arange(len(loop_verts))
+    nb_next, nb_prev = corners.copy(), corners.copy()  # across the loop edge, the previous one
+    is_flipped = loop_verts[first] == loop_verts[second]
+    for l1, l2 in ((first, second), (second, first)):
+        c1, c2 = l1[~is_flipped], l2[~is_flipped]
+        nb_next[c1], nb_prev[next_loops[c2]] = next_loops[c2], c1
+        c1, c2 = l1[is_flipped], l2[is_flipped]
+        nb_next[c1], nb_prev[next_loops[c1]] = c2, next_loops[c2]
+    # Label fans by hooking to the min neighbour label, and pointer jumping
+    labels = corners.copy()
+    while True:
+        new_labels = np.minimum(labels, np.minimum(labels[nb_next], labels[nb_prev]))
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    # Count the fans of each vertex
+    fans = np.sort(loop_verts * len(labels) + labels)
+    fans = fans[np.concatenate(([True], fans[1:] != fans[:-1]))] // max(len(labels), 1)
+    return np.flatnonzero(np.bincount(fans, minlength=count) > 1)
+
+def get_edges(loop_verts, loop_starts, loop_totals) -> "edge_verts, loop_edges":
+    """Get the edges of polygon loops, as Blender does, and the edge of each loop."""
+    loop_verts = np.asarray(loop_verts, dtype=np.int64)
+    _, next_loops = _get_next_loops(np.asarray(loop_starts, dtype=np.int64), np.asarray(loop_totals, dtype=np.int64))
+    pairs = np.sort(np.column_stack((loop_verts, loop_verts[next_loops])), axis=1)
+    keys = pairs[:, 0] * (loop_verts.max() + 1 if len(loop_verts) else 1) + pairs[:, 1]
+    keys, firsts, loop_edges = np.unique(keys, return_index=True, return_inverse=True)
+    return pairs[firsts], loop_edges.ravel()
+
+def get_arrays(polys) -> "edge_verts, loop_verts, loop_edges, loop_starts, loop_totals":
+    """Get mesh arrays from a list of polygons vertex indices, as Blender does."""
+    loop_verts = np.array([v for poly in polys for v in poly], dtype=np.int64)
+    loop_totals = np.array([len(poly) for poly in polys], dtype=np.int64)
+    loop_starts = np.cumsum(loop_totals) - loop_totals
+    edge_verts, loop_edges = get_edges(loop_verts, loop_starts, loop_totals)
+    return edge_verts, loop_verts, loop_edges, loop_starts, loop_totals
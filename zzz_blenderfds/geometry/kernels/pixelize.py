@@ -0,0 +1,55 @@
+"""BlenderFDS, pixelize flat triangle meshes by 2D rasterization."""
+
+import numpy as np
+
+from .voxelize import _get_chunks, _get_crossings
+from .rects import merge_rects
+
+# The flat triangles are projected along their flat axis, and rasterized on
+# the voxel grid of the other two axes: a pixel is solid when its center
+# is covered by a triangle. Solid pixels are then merged in rects
+# [[u0, u1, v0, v1], ...] by sort and sweep, ends excluded, where u and v
+# are the other axes in increasing order (eg. x and z for flat axis y).
+
+def _get_other_axes(flat_axis) -> "u, v":
+    """Get the other axes of flat_axis, in increasing order."""
+    return tuple(axis for axis in range(3) if axis != flat_axis)
+
+def pixelize(tris, voxel_size, origin=(0., 0., 0.), flat_axis=2) -> "rects":
+    """Pixelize triangles tris projected along flat_axis.
+
+    >>> tris = np.array((((0., 0., 0.), (1., 0., 0.), (1., 1., 0.)), ((0., 0., 0.), (1., 1., 0.), (0., 1., 0.))))
+    >>> pixelize(tris, .25).tolist()
+    [[0, 4, 0, 4]]
+    >>> pixelize(tris[:1], .25).tolist()  # a triangle
+    [[1, 2, 0, 1], [2, 3, 0, 2], [3, 4, 0, 3]]
+    >>> pixelize(tris[:, :, (0, 2, 1)], .25, flat_axis=1).tolist()
+    [[0, 4, 0, 4]]
+    >>> pixelize(tris[:1] * .01, .25).shape  # a tiny triangle
+    (0, 4)
+    """
+    tris = np.asarray(tris, dtype=np.float64).reshape(-1, 3, 3)
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    origin = np.asarray(origin, dtype=np.float64)
+    # Scale to grid coordinates, flat axis last
+    axes = _get_other_axes(flat_axis) + (flat_axis,)
+    tris = ((tris - origin) / voxel_size - .5)[:, :, axes]
+    # Get covered pixels
+    uvs = [_get_crossings(tris[chunk])[0] for chunk in _get_chunks(tris)]
+    uvs = np.concatenate(uvs) if uvs else np.empty((0, 2), dtype=np.int64)
+    if not len(uvs): return np.empty((0, 4), dtype=np.int64)  # no pixel center covered
+    uvs = np.unique(uvs, axis=0)  # sorted by u, then v
+    # Join pixels in runs along v, then merge them in rects
+    is_join = (uvs[1:, 0] == uvs[:-1, 0]) & (uvs[1:, 1] == uvs[:-1, 1] + 1)
+    starts = np.flatnonzero(np.concatenate(([True], ~is_join)))
+    ends = np.append(starts[1:], len(uvs)) - 1
+    rects = np.column_stack((uvs[starts, 0], uvs[starts, 0] + 1, uvs[starts, 1], uvs[ends, 1] + 1))
+    return merge_rects(rects, np.zeros(len(rects), dtype=np.int64))[0]
+
+def rects_to_boxes(rects, flat_axis=2) -> "boxes":
+    """Transform rects to boxes [[i0, i1, j0, j1, k0, k1], ...], one voxel thick along flat_axis."""
+    u, v = _get_other_axes(flat_axis)
+    boxes = np.zeros((len(rects), 6), dtype=np.int64)
+    boxes[:, 2*u:2*u+2], boxes[:, 2*v:2*v+2] = rects[:, 0:2], rects[:, 2:4]
+    boxes[:, 2*flat_axis+1] = 1
+    return boxes
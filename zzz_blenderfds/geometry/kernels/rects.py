@@ -0,0 +1,43 @@
+"""BlenderFDS, merge axis aligned rectangles."""
+
+import numpy as np
+
+# rects = [[u0, u1, v0, v1], ...], grouped by an integer key (eg. plane and appearance)
+# Values are compared exactly, quantize them before merging.
+
+def merge_rects(rects, groups) -> "rects, groups":
+    """Merge abutting rects of the same group, when their union is a rect.
+
+    >>> rects = np.array([[0, 1, 0, 1], [1, 2, 0, 1], [0, 2, 1, 2], [3, 4, 0, 1]])
+    >>> rects, groups = merge_rects(rects, np.zeros(4, dtype=int))
+    >>> rects.tolist()
+    [[0, 2, 0, 2], [3, 4, 0, 1]]
+    >>> merge_rects(np.array([[0, 1, 0, 1], [1, 2, 0, 1]]), np.array([0, 1]))[0].tolist()
+    [[0, 1, 0, 1], [1, 2, 0, 1]]
+    """
+    rects, groups = np.asarray(rects), np.asarray(groups)
+    while True:
+        len_rects = len(rects)
+        rects, groups = _merge_rects_along(rects, groups, 0)  # along u
+        rects, groups = _merge_rects_along(rects, groups, 2)  # along v
+        if len(rects) == len_rects: return rects, groups
+
+def _merge_rects_along(rects, groups, a) -> "rects, groups":
+    """Merge rects along axis a (0 is u, 2 is v) by sort and sweep."""
+    if len(rects) < 2: return rects, groups
+    b = 2 - a  # the other axis
+    # Sort by group, by other axis extent, and by axis start
+    order = np.lexsort((rects[:, a], rects[:, b+1], rects[:, b], groups))
+    rects, groups = rects[order], groups[order]
+    # Join to previous when in the same group, with the same other extent, abutting
+    joins = (
+        (groups[1:] == groups[:-1])
+        & (rects[1:, b] == rects[:-1, b])
+        & (rects[1:, b+1] == rects[:-1, b+1])
+        & (rects[1:, a] == rects[:-1, a+1])
+    )
+    starts = np.flatnonzero(np.concatenate(([True], ~joins)))
+    ends = np.append(starts[1:], len(rects)) - 1
+    merged = rects[starts]  # a copy
+    merged[:, a+1] = rects[ends, a+1]
+    return merged, groups[starts]
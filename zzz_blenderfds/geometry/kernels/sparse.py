@@ -0,0 +1,216 @@
+"""BlenderFDS, sparse voxel grid of bit bricks."""
+
+import numpy as np
+
+from .boxes import runs_to_boxes, grow_boxes, greedy_boxes
+from .voxelize import _join_runs
+
+# The grid is split in bricks of 8x8x8 voxels, only occupied bricks are stored.
+# Each brick is 64 bytes: byte bits[n, i, j] packs voxels k = 0..7 of its column (i, j).
+# Bricks are kept sorted by their integer brick coordinates, encoded in one int64 code.
+# So memory and time scale with occupied bricks, not with bounding box volume.
+
+brick_size = 8  # one byte per brick column
+
+_bias = 1 << 20  # brick coordinates range is +-2**20
+_shift = 21
+
+# Greedy meshing runs on dense occupancy grids of the occupied bricks extent,
+# split in blocks of greedy_block bricks per side only when larger:
+# block seams cut the maximal boxes, even if they are grown across them later.
+
+greedy_block = 32  # bricks, a dense block of 256**3 voxels is 16 MB
+
+def _encode(bis, bjs, bks) -> "codes":
+    """Encode brick coordinates to sortable brick codes."""
+    return ((bis + _bias) << (2 * _shift)) | ((bjs + _bias) << _shift) | (bks + _bias)
+
+def _decode(codes) -> "bis, bjs, bks":
+    """Decode brick codes to brick coordinates."""
+    mask = (1 << _shift) - 1
+    return (codes >> (2 * _shift)) - _bias, ((codes >> _shift) & mask) - _bias, (codes & mask) - _bias
+
+class SparseGrid():
+    """Sparse voxel grid of 8x8x8 bit bricks.
+
+    >>> a = SparseGrid.from_boxes([[0, 10, 0, 10, 0, 10]])
+    >>> b = SparseGrid.from_boxes([[5, 15, 0, 10, 0, 10]])
+    >>> a.count(), len(a.codes), a.union(b).count(), a.subtract(b).count()
+    (1000, 8, 1500, 500)
+    >>> a.subtract(b).boxes().tolist()
+    [[0, 5, 0, 10, 0, 10]]
+    >>> len(a.faces()) == 6 * 100
+    True
+    """
+
+    def __init__(self, codes=None, bits=None):
+        if codes is None:
+            codes = np.empty(0, dtype=np.int64)
+            bits = np.empty((0, brick_size, brick_size), dtype=np.uint8)
+        self.codes, self.bits = codes, bits
+
+    def __repr__(self):
+        return "<SparseGrid: {} bricks>".format(len(self.codes))
+
+    # Build
+
+    @classmethod
+    def _from_pieces(cls, codes, lis, ljs, columns) -> "SparseGrid":
+        """Build from brick codes, local column coordinates and column bytes."""
+        codes, inverse = np.unique(codes, return_inverse=True)
+        bits = np.zeros((len(codes), brick_size, brick_size), dtype=np.uint8)
+        np.bitwise_or.at(bits, (inverse.ravel(), lis, ljs), columns)
+        return cls(codes, bits)
+
+    @classmethod
+    def from_runs(cls, runs) -> "SparseGrid":
+        """Build from z runs [[i, j, k0, k1], ...], k1 excluded."""
+        runs = np.asarray(runs, dtype=np.int64).reshape(-1, 4)
+        runs = runs[runs[:, 3] > runs[:, 2]]
+        # Split runs in pieces, one for each crossed brick
+        bk0, bk1 = runs[:, 2] >> 3, (runs[:, 3] - 1) >> 3
+        counts = bk1 - bk0 + 1
+        r = np.repeat(np.arange(len(runs)), counts)
+        bks = bk0[r] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        lo = np.clip(runs[r, 2] - bks * brick_size, 0, brick_size)
+        hi = np.clip(runs[r, 3] - bks * brick_size, 0, brick_size)
+        columns = ((1 << hi) - (1 << lo)).astype(np.uint8)
+        i, j = runs[r, 0], runs[r, 1]
+        return cls._from_pieces(_encode(i >> 3, j >> 3, bks), i & 7, j & 7, columns)
+
+    @classmethod
+    def from_boxes(cls, boxes) -> "SparseGrid":
+        """Build from boxes [[i0, i1, j0, j1, k0, k1], ...], ends excluded."""
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 6)
+        # Split boxes in z runs
+        nis, njs = boxes[:, 1] - boxes[:, 0], boxes[:, 3] - boxes[:, 2]
+        counts = np.clip(nis, 0, None) * np.clip(njs, 0, None)
+        b = np.repeat(np.arange(len(boxes)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return cls.from_runs(np.column_stack((
+            boxes[b, 0] + offsets // njs[b], boxes[b, 2] + offsets % njs[b], boxes[b, 4], boxes[b, 5],
+        )))
+
+    # Query
+
+    def count(self) -> "int":
+        """Count occupied voxels."""
+        return int(np.unpackbits(self.bits).sum())
+
+    def _get_voxels(self, bits=None) -> "voxels":
+        """Unpack bricks to boolean voxels, shaped (n, 8, 8, 8)."""
+        if bits is None: bits = self.bits
+        return np.unpackbits(bits[..., None], axis=-1)[..., ::-1].astype(bool)  # bit 0 first
+
+    def _get_brick_origins(self, codes=None) -> "origins":
+        """Get the integer coordinates of the first voxel of bricks, shaped (n, 3)."""
+        if codes is None: codes = self.codes
+        return np.column_stack(_decode(codes)) * brick_size
+
+    def to_runs(self) -> "runs":
+        """Get sorted z runs [[i, j, k0, k1], ...], k1 excluded."""
+        voxels = np.pad(self._get_voxels().astype(np.int8), ((0, 0), (0, 0), (0, 0), (1, 1)), "constant")
+        edges = np.diff(voxels, axis=3)
+        starts, ends = np.nonzero(edges == 1), np.nonzero(edges == -1)
+        origins = self._get_brick_origins()[starts[0]]
+        runs = np.column_stack((
+            origins[:, 0] + starts[1], origins[:, 1] + starts[2],
+            origins[:, 2] + starts[3], origins[:, 2] + ends[3],
+        ))
+        # Join runs crossing brick borders
+        runs = runs[np.lexsort((runs[:, 2], runs[:, 1], runs[:, 0]))]
+        return _join_runs(runs)
+
+    def faces(self) -> "faces":
+        """Get voxel faces on the boundary [[i, j, k, direction], ...].
+
+        direction is 0: -x, 1: +x, 2: -y, 3: +y, 4: -z, 5: +z
+        """
+        voxels = self._get_voxels()
+        bis, bjs, bks = _decode(self.codes)
+        faces = list()
+        for axis in range(3):
+            for side in (0, 1):
+                # Get neighbour bricks voxels, empty if missing
+                shifts = [0, 0, 0]
+                shifts[axis] = side and 1 or -1
+                ncodes = _encode(bis + shifts[0], bjs + shifts[1], bks + shifts[2])
+                n = np.clip(np.searchsorted(self.codes, ncodes), 0, max(len(self.codes) - 1, 0))
+                found = self.codes[n] == ncodes if len(self.codes) else np.zeros(0, dtype=bool)
+                nvoxels = np.zeros_like(voxels)
+                nvoxels[found] = voxels[n[found]]
+                # Get the neighbour of each voxel along axis and side
+                first, last = [slice(None)] * 4, [slice(None)] * 4
+                if side:
+                    first[axis+1], last[axis+1] = slice(1, None), slice(None, 1)
+                    neighbours = np.concatenate((voxels[tuple(first)], nvoxels[tuple(last)]), axis=axis+1)
+                else:
+                    first[axis+1], last[axis+1] = slice(None, -1), slice(-1, None)
+                    neighbours = np.concatenate((nvoxels[tuple(last)], voxels[tuple(first)]), axis=axis+1)
+                ns, lis, ljs, lks = np.nonzero(voxels & ~neighbours)
+                origins = self._get_brick_origins()[ns]
+                faces.append(np.column_stack((
+                    origins[:, 0] + lis, origins[:, 1] + ljs, origins[:, 2] + lks,
+                    np.full(len(ns), 2 * axis + side),
+                )))
+        return np.concatenate(faces).astype(np.int64)
+
+    def boxes(self, greedy=False) -> "boxes":
+        """Merge voxels in boxes [[i0, i1, j0, j1, k0, k1], ...], by sweep or greedy meshing.
+
+        Greedy meshing produces less boxes on large solids, but can produce more on thin shells;
+        the sweep is not run to compare.
+        """
+        if not greedy:
+            # Grow z runs along the other axes, in the order producing less boxes
+            boxes = runs_to_boxes(self.to_runs())
+            return min(
+                grow_boxes(grow_boxes(boxes, 0), 1),
+                grow_boxes(grow_boxes(boxes, 1), 0),
+                key=len,
+            )
+        # Greedy meshing in dense blocks, then grow boxes across block seams
+        voxels, bricks = self._get_voxels(), np.column_stack(_decode(self.codes))
+        blocks = np.zeros_like(bricks)
+        if len(bricks) and np.prod(bricks.max(axis=0) - bricks.min(axis=0) + 1) > greedy_block ** 3:
+            blocks = (bricks - bricks.min(axis=0)) // greedy_block
+        keys, inverse = np.unique(blocks, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        boxes = [np.empty((0, 6), dtype=np.int64)]
+        for n in range(len(keys)):
+            is_block = inverse == n
+            boxes.append(_get_greedy_boxes(voxels[is_block], bricks[is_block]))
+        boxes = np.concatenate(boxes)
+        for axis in (2, 1, 0):
+            boxes = grow_boxes(boxes, axis)
+        return boxes
+
+    # Boolean operations
+
+    def union(self, other) -> "SparseGrid":
+        """Get the union of self and other."""
+        codes, inverse = np.unique(np.concatenate((self.codes, other.codes)), return_inverse=True)
+        bits = np.zeros((len(codes), brick_size, brick_size), dtype=np.uint8)
+        np.bitwise_or.at(bits, inverse.ravel(), np.concatenate((self.bits, other.bits)))
+        return SparseGrid(codes, bits)
+
+    def subtract(self, other) -> "SparseGrid":
+        """Get self voxels that are not in other."""
+        bits = self.bits.copy()
+        if len(other.codes):
+            n = np.clip(np.searchsorted(other.codes, self.codes), 0, len(other.codes) - 1)
+            found = other.codes[n] == self.codes
+            bits[found] &= ~other.bits[n[found]]
+        # Drop empty bricks
+        is_occupied = bits.any(axis=(1, 2))
+        return SparseGrid(self.codes[is_occupied], bits[is_occupied])
+
+def _get_greedy_boxes(voxels, bricks) -> "boxes":
+    """Merge voxels of bricks in maximal boxes, on their dense occupancy grid."""
+    lo = bricks.min(axis=0)
+    ni, nj, nk = bricks.max(axis=0) - lo + 1
+    occupancy = np.zeros((ni, brick_size, nj, brick_size, nk, brick_size), dtype=bool)
+    lbs = bricks - lo
+    occupancy[lbs[:, 0], :, lbs[:, 1], :, lbs[:, 2], :] = voxels
+    occupancy = occupancy.reshape(ni * brick_size, nj * brick_size, nk * brick_size)
+    return greedy_boxes(occupancy, lo * brick_size)
@@ -0,0 +1,49 @@
+"""BlenderFDS, surface quads of voxel grids, for preview meshes."""
+
+import numpy as np
+
+from .sparse import SparseGrid
+from .rects import merge_rects
+from .pixelize import _get_other_axes
+
+# Only voxel faces on the grid boundary are kept, internal faces are culled.
+# Coplanar faces with the same direction are merged in rects by sort and sweep,
+# then rect corners are shared between quads (T junctions are left, harmless for preview).
+# Quads are oriented with outward normals.
+
+def get_surface(grid, origin=(0., 0., 0.), voxel_size=1.) -> "verts, quads":
+    """Get the boundary surface of SparseGrid grid as vertices and quads.
+
+    >>> grid = SparseGrid.from_boxes([[0, 2, 0, 1, 0, 1], [0, 1, 1, 2, 0, 1]])
+    >>> verts, quads = get_surface(grid)
+    >>> len(verts), len(quads)
+    (14, 10)
+    """
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    faces = grid.faces()
+    if not len(faces):
+        return np.empty((0, 3)), np.empty((0, 4), dtype=np.int64)
+    directions = faces[:, 3]
+    verts = list()
+    for axis in range(3):
+        u, v = _get_other_axes(axis)
+        for side in (0, 1):
+            selected = faces[directions == 2 * axis + side]
+            if not len(selected):
+                continue
+            # Merge unit rects on each plane
+            rects = np.column_stack((
+                selected[:, u], selected[:, u] + 1, selected[:, v], selected[:, v] + 1,
+            ))
+            rects, planes = merge_rects(rects, selected[:, axis] + side)
+            # Corners counterclockwise in u, v, their normal is +axis for x and z, -axis for y
+            corners = np.empty((len(rects), 4, 3), dtype=np.int64)
+            corners[:, :, axis] = planes[:, None]
+            corners[:, :, u] = rects[:, (0, 1, 1, 0)]
+            corners[:, :, v] = rects[:, (2, 2, 3, 3)]
+            if (axis != 1) != bool(side):
+                corners = corners[:, ::-1]
+            verts.append(corners.reshape(-1, 3))
+    # Share corners
+    verts, quads = np.unique(np.concatenate(verts), axis=0, return_inverse=True)
+    return origin + verts * voxel_size, quads.reshape(-1, 4)
@@ -0,0 +1,65 @@
+"""BlenderFDS, terrain heightfields on regular XY grids."""
+
+import numpy as np
+
+# FDS GEOM terrain form: IJK=I,J points along x and y, XB its bounding box,
+# and ZVALS, I*J point heights, x varying fastest, from y min.
+# The heightfield is sampled by casting rays downward at each grid point.
+
+def is_heightfield(normals, areas, epsilon=1E-6) -> "bool":
+    """Return True if faces, with normals and areas, project on XY without overlapping.
+
+    All non vertical faces shall face the same way along z.
+
+    >>> is_heightfield(((0, 0, 1), (0, .6, .8), (1, 0, 0)), (1, 1, 1))
+    True
+    >>> is_heightfield(((0, 0, 1), (0, 0, -1)), (1, 1))
+    False
+    """
+    normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+    projected = normals[:, 2] * np.asarray(areas, dtype=np.float64)
+    return not (np.any(projected > epsilon) and np.any(projected < -epsilon))
+
+def get_grid(bbox, cell_size) -> "ijk, xb":
+    """Get the count of grid points along x and y, and the grid xb covering bbox with cells about cell_size.
+
+    >>> get_grid((0., 10., 0., 4.9, -1., 2.), 1.)
+    ((11, 6), (0.0, 10.0, 0.0, 4.9, -1.0, 2.0))
+    """
+    ijk = tuple(max(int(np.ceil((bbox[2*i+1] - bbox[2*i]) / cell_size - 1E-6)), 1) + 1 for i in range(2))
+    return ijk, tuple(float(v) for v in bbox)
+
+def get_points(ijk, xb, epsilon=1E-6) -> "points":
+    """Get the XY grid points, x varying fastest, nudged inside the border by epsilon.
+
+    >>> get_points((3, 2), (0., 2., 0., 1., 0., 0.), epsilon=0.).tolist()
+    [[0.0, 0.0], [1.0, 0.0], [2.0, 0.0], [0.0, 1.0], [1.0, 1.0], [2.0, 1.0]]
+    """
+    xs = np.clip(np.linspace(xb[0], xb[1], ijk[0]), xb[0] + epsilon, xb[1] - epsilon)
+    ys = np.clip(np.linspace(xb[2], xb[3], ijk[1]), xb[2] + epsilon, xb[3] - epsilon)
+    x, y = np.meshgrid(xs, ys)
+    return np.column_stack((x.ravel(), y.ravel()))
+
+def fill_missing(zvals) -> "zvals, missing":
+    """Fill the missing (nan) heights with the lowest sampled one.
+
+    >>> zvals, missing = fill_missing((1., np.nan, 3.))
+    >>> zvals.tolist(), missing
+    ([1.0, 1.0, 3.0], 1)
+    """
+    zvals = np.array(zvals, dtype=np.float64)
+    is_missing = np.isnan(zvals)
+    if is_missing.all():
+        raise ValueError("No terrain point sampled")
+    zvals[is_missing] = zvals[~is_missing].min()
+    return zvals, int(is_missing.sum())
+
+def get_quads(ijk) -> "quads":
+    """Get the grid quads with upward normals, indexing the grid points.
+
+    >>> get_quads((3, 2)).tolist()
+    [[0, 1, 4, 3], [1, 2, 5, 4]]
+    """
+    i, j = np.meshgrid(np.arange(ijk[0] - 1), np.arange(ijk[1] - 1))
+    first = (j * ijk[0] + i).ravel()
+    return np.column_stack((first, first + 1, first + ijk[0] + 1, first + ijk[0]))
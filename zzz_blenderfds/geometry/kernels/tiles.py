@@ -0,0 +1,83 @@
+"""BlenderFDS, tiled parallel voxelization."""
+
+import os
+import numpy as np
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+from .voxelize import voxelize, get_box_tris
+from .sparse import brick_size
+
+# Ray columns are split in square tiles aligned to voxel bricks.
+# Each tile is voxelized with the triangles overlapping it, in a pool.
+# As each ray only depends on the triangles it crosses, the runs of all tiles
+# are the same runs of a single tile voxelization: the seams disappear when
+# the runs are joined in boxes.
+# Tiles run in a thread pool, as the numpy kernels release the GIL:
+# forking Blender is unsafe, where it has started GUI threads.
+
+min_tiled_columns = 256 ** 2  # smaller objects are voxelized in one tile
+tiles_per_process = 4  # for load balancing
+
+def get_tiles(bounds, processes) -> "tiles":
+    """Split columns bounds (i0, i1, j0, j1) in tiles aligned to bricks, for processes."""
+    i0, i1, j0, j1 = bounds
+    columns = (i1 - i0) * (j1 - j0)
+    if processes < 2 or columns < min_tiled_columns:
+        return [bounds,]
+    # Choose the square tile side, as a multiple of brick size
+    side = (columns / (processes * tiles_per_process)) ** .5
+    side = max(1, int(np.ceil(side / brick_size))) * brick_size
+    starts_i = range(i0 // side * side, i1, side)
+    starts_j = range(j0 // side * side, j1, side)
+    return [
+        (max(i, i0), min(i + side, i1), max(j, j0), min(j + side, j1))
+        for i in starts_i for j in starts_j
+    ]
+
+def voxelize_tiled(tris, voxel_size, origin=(0., 0., 0.), fill="PARITY", processes=None, bounds=None) -> "runs":
+    """Voxelize triangles tris in tiles, in parallel, same output of voxelize.
+
+    Only ray columns inside bounds (i0, i1, j0, j1) are voxelized, if set.
+
+    >>> tris = get_box_tris((0., 0., 0.), (30., 30., 1.))
+    >>> runs = voxelize_tiled(tris, .1, processes=3)
+    >>> np.array_equal(runs, voxelize(tris, .1))
+    True
+    """
+    tris = np.asarray(tris, dtype=np.float64).reshape(-1, 3, 3)
+    if not len(tris): return np.empty((0, 4), dtype=np.int64)
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    origin = np.asarray(origin, dtype=np.float64)
+    # Get ray columns bounds of each triangle, and of all
+    cos = (tris[:, :, :2] - origin[:2]) / voxel_size[:2] - .5
+    tri_bounds = np.column_stack((
+        np.ceil(cos[:, :, 0].min(axis=1)), np.floor(cos[:, :, 0].max(axis=1)) + 1,
+        np.ceil(cos[:, :, 1].min(axis=1)), np.floor(cos[:, :, 1].max(axis=1)) + 1,
+    )).astype(np.int64)
+    all_bounds = tri_bounds[:, 0].min(), tri_bounds[:, 1].max(), tri_bounds[:, 2].min(), tri_bounds[:, 3].max()
+    if bounds is not None:
+        all_bounds = (
+            max(all_bounds[0], bounds[0]), min(all_bounds[1], bounds[1]),
+            max(all_bounds[2], bounds[2]), min(all_bounds[3], bounds[3]),
+        )
+        if all_bounds[0] >= all_bounds[1] or all_bounds[2] >= all_bounds[3]:
+            return np.empty((0, 4), dtype=np.int64)
+    processes = processes or os.cpu_count() or 1
+    tiles = get_tiles(all_bounds, processes)
+    if len(tiles) == 1:
+        return voxelize(tris, voxel_size, origin, fill, bounds=bounds)
+    # Voxelize tiles in a thread pool
+    job = partial(_voxelize_tile, tris, tri_bounds, voxel_size, origin, fill)
+    with ThreadPool(processes) as pool:
+        runs = pool.map(job, tiles, chunksize=1)
+    runs = np.concatenate(runs)
+    return runs[np.lexsort((runs[:, 2], runs[:, 1], runs[:, 0]))]
+
+def _voxelize_tile(tris, tri_bounds, voxel_size, origin, fill, bounds) -> "runs":
+    """Voxelize the tile with bounds (i0, i1, j0, j1), with the overlapping tris, in a worker."""
+    overlaps = (
+        (tri_bounds[:, 0] < bounds[1]) & (tri_bounds[:, 1] > bounds[0])
+        & (tri_bounds[:, 2] < bounds[3]) & (tri_bounds[:, 3] > bounds[2])
+    )
+    return voxelize(tris[overlaps], voxel_size, origin, fill, bounds=bounds)
@@ -0,0 +1,226 @@
+"""BlenderFDS, voxelize triangle meshes by scanline ray casting."""
+
+import numpy as np
+
+# The voxel grid is aligned to origin, its voxel (i, j, k) spans
+# origin + (i, j, k) * voxel_size ... origin + (i+1, j+1, k+1) * voxel_size
+# A voxel is solid when its center is inside the closed triangle mesh.
+
+# One ray along +z is cast through the center of each grid column (i, j),
+# and intersected with the triangles projected on the xy plane.
+# A ray hitting a shared edge or vertex is counted once only, by a
+# consistent tie rule on exactly antisymmetric edge functions.
+# Crossings along each ray are then filled by parity or by winding number:
+# Eg.: z axis --> ray 0|==solid==1| void 2|==solid==3| void ...
+
+# Solid voxels are returned as runs along z, in integer grid coordinates:
+# runs = [[i, j, k0, k1], ...], k1 excluded
+
+max_samples = 2 ** 22  # ray-triangle or surface samples processed at once
+
+def voxelize(tris, voxel_size, origin=(0., 0., 0.), fill="PARITY", bounds=None) -> "runs":
+    """Voxelize triangles tris, fill by PARITY or by nonzero WINDING number.
+
+    Only the ray columns inside bounds (i0, i1, j0, j1), ends excluded, are cast if requested.
+
+    >>> tris = get_box_tris((0., 0., 0.), (1., 1., 1.))
+    >>> runs = voxelize(tris, .25)
+    >>> len(runs), int((runs[:, 3] - runs[:, 2]).sum())
+    (16, 64)
+    >>> voxelize(tris, (.5, .5, .25), origin=(.25, 0., 0.)).tolist()  # rays on faces
+    [[0, 0, 0, 4], [0, 1, 0, 4], [1, 0, 0, 4], [1, 1, 0, 4]]
+    >>> tris = np.concatenate((tris, tris + .5))  # overlapping boxes
+    >>> runs = voxelize(tris, .25, fill="WINDING")
+    >>> len(runs), int((runs[:, 3] - runs[:, 2]).sum())
+    (28, 120)
+    >>> runs = voxelize(tris, .25, fill="PARITY")
+    >>> len(runs), int((runs[:, 3] - runs[:, 2]).sum())
+    (32, 112)
+    >>> voxelize(get_box_tris((.01, .01, 0.), (.02, .02, 1.)), .25).shape  # between rays
+    (0, 4)
+    """
+    tris = np.asarray(tris, dtype=np.float64).reshape(-1, 3, 3)
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    origin = np.asarray(origin, dtype=np.float64)
+    # Scale to grid coordinates, so that voxel centers are at integer coordinates
+    tris = (tris - origin) / voxel_size - .5
+    # Get crossings of all rays with all triangles, chunk by chunk
+    crossings = [_get_crossings(tris[chunk], bounds) for chunk in _get_chunks(tris)]
+    if not crossings: return np.empty((0, 4), dtype=np.int64)
+    ijs, ws, signs = (np.concatenate(c) for c in zip(*crossings))
+    return _fill_crossings(ijs, ws, signs, fill)
+
+def _get_chunks(tris) -> "slices":
+    """Split tris in chunks of about max_samples ray-triangle samples."""
+    mins, maxs = tris[:, :, :2].min(axis=1), tris[:, :, :2].max(axis=1)
+    counts = np.clip(np.floor(maxs) - np.ceil(mins) + 1, 0, None).prod(axis=1)
+    return _get_count_chunks(counts)
+
+def _get_count_chunks(counts) -> "slices":
+    """Split items with counts samples in chunks of about max_samples samples."""
+    limits = np.cumsum(counts) // max_samples
+    starts = np.flatnonzero(np.diff(np.concatenate(([-1], limits))))
+    return [slice(start, stop) for start, stop in zip(starts, np.append(starts[1:], len(counts)))]
+
+def _get_crossings(tris, bounds=None) -> "ijs, ws, signs":
+    """Get crossings of rays through integer (i, j) columns with tris, in grid coordinates."""
+    # Projected area sign: +1 if the triangle faces +z (ray exits), -1 if it faces -z
+    a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+    areas = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    tris = tris[areas != 0.]  # parallel to the rays
+    signs = np.sign(areas[areas != 0.])
+    # Candidate ray columns inside each triangle bounding box
+    i0 = np.ceil(tris[:, :, 0].min(axis=1)).astype(np.int64)
+    j0 = np.ceil(tris[:, :, 1].min(axis=1)).astype(np.int64)
+    i1 = np.floor(tris[:, :, 0].max(axis=1)).astype(np.int64) + 1
+    j1 = np.floor(tris[:, :, 1].max(axis=1)).astype(np.int64) + 1
+    if bounds is not None:
+        i0, i1 = np.clip(i0, bounds[0], bounds[1]), np.clip(i1, bounds[0], bounds[1])
+        j0, j1 = np.clip(j0, bounds[2], bounds[3]), np.clip(j1, bounds[2], bounds[3])
+    nis, njs = np.clip(i1 - i0, 0, None), np.clip(j1 - j0, 0, None)
+    counts = nis * njs
+    t = np.repeat(np.arange(len(tris)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ijs = np.column_stack((i0[t] + offsets // njs[t], j0[t] + offsets % njs[t]))
+    # Edge functions of each sample, orient them counterclockwise
+    p = ijs.astype(np.float64)
+    tri = tris[t]
+    ccw = signs[t] > 0.
+    ws, inside = list(), np.ones(len(t), dtype=bool)
+    for e0, e1 in ((1, 2), (2, 0), (0, 1)):
+        w, owned = _get_edge_function(tri[:, e0], tri[:, e1], p, ccw)
+        inside &= (w > 0.) | ((w == 0.) & owned)
+        ws.append(w)
+    # Barycentric interpolation of the crossing height
+    w0, w1, w2 = (w[inside] for w in ws)
+    tri = tri[inside]
+    zs = (w0 * tri[:, 0, 2] + w1 * tri[:, 1, 2] + w2 * tri[:, 2, 2]) / (w0 + w1 + w2)
+    return ijs[inside], zs, signs[t][inside]
+
+def _get_edge_function(v0, v1, p, ccw) -> "w, owned":
+    """Get edge v0-v1 function at p, positive inside, and sample ownership when on the edge."""
+    # Compute from the lexicographically lower vertex, so that the same edge
+    # in the neighbour triangle gives the exact opposite value
+    swap = (v0[:, 0] > v1[:, 0]) | ((v0[:, 0] == v1[:, 0]) & (v0[:, 1] > v1[:, 1]))
+    lo = np.where(swap[:, None], v1, v0)
+    hi = np.where(swap[:, None], v0, v1)
+    dx, dy = hi[:, 0] - lo[:, 0], hi[:, 1] - lo[:, 1]
+    w = dx * (p[:, 1] - lo[:, 1]) - dy * (p[:, 0] - lo[:, 0])
+    is_left = swap != ccw  # triangle lies on the left of lo-hi
+    # On the edge, the sample is owned by the triangle containing the sample
+    # moved by an infinitesimal (-1, -eps): on the left of lo-hi if dy > 0
+    # (dx >= 0 by construction)
+    return np.where(is_left, w, -w), is_left == (dy > 0.)
+
+def _fill_crossings(ijs, ws, signs, fill) -> "runs":
+    """Fill crossings along each ray, by PARITY or nonzero WINDING number."""
+    if not len(ws): return np.empty((0, 4), dtype=np.int64)  # no ray hit
+    order = np.lexsort((ws, ijs[:, 1], ijs[:, 0]))
+    ijs, ws, signs = ijs[order], ws[order], signs[order]
+    # Crossings of the same ray
+    is_first = np.ones(len(ws), dtype=bool)
+    is_first[1:] = (ijs[1:] != ijs[:-1]).any(axis=1)
+    starts = np.flatnonzero(is_first)
+    lengths = np.diff(np.append(starts, len(ws)))
+    ranks = np.arange(len(ws)) - np.repeat(starts, lengths)
+    # Solid after each crossing?
+    if fill == "PARITY":
+        solid = ranks % 2 == 0
+    elif fill == "WINDING":
+        windings = np.cumsum(-signs)  # entering through a face toward -z
+        windings -= np.repeat(windings[starts] + signs[starts], lengths)
+        solid = windings != 0.
+    else:
+        raise ValueError("BFDS: Unknown fill: {}".format(fill))
+    # Solid intervals, till next crossing of the same ray
+    solid[:-1] &= ~is_first[1:]
+    solid[-1] = False
+    ks = np.ceil(ws).astype(np.int64)  # first voxel center after crossing
+    runs = np.column_stack((ijs[:-1], ks[:-1], ks[1:]))[solid[:-1]]
+    runs = runs[runs[:, 3] > runs[:, 2]]
+    return _join_runs(runs)
+
+def _join_runs(runs) -> "runs":
+    """Join abutting sorted runs of the same ray."""
+    if len(runs) < 2: return runs
+    joins = (runs[1:, 0] == runs[:-1, 0]) & (runs[1:, 1] == runs[:-1, 1]) & (runs[1:, 2] <= runs[:-1, 3])
+    starts = np.flatnonzero(np.concatenate(([True], ~joins)))
+    joined = runs[starts]
+    joined[:, 3] = np.maximum.reduceat(runs[:, 3], starts)
+    return joined
+
+# Ray centers miss walls thinner than a voxel and open meshes, so the surface
+# is rasterized too: triangles are sampled at half voxel spacing, and each sample
+# marks its voxel. Samples are nudged inward along the triangle normal and
+# toward the triangle center, so that faces aligned to voxel boundaries do not
+# mark the outer voxels.
+
+def get_surface_runs(tris, voxel_size, origin=(0., 0., 0.), bounds=None) -> "runs":
+    """Get the one voxel runs of the voxels crossed by triangles tris.
+
+    Only the ray columns inside bounds (i0, i1, j0, j1), ends excluded, are kept if requested.
+
+    >>> tris = get_box_tris((0., 0., 0.), (1., 1., 1.))
+    >>> runs = get_surface_runs(tris, .25)  # aligned faces, inner voxels only
+    >>> int((runs[:, 3] - runs[:, 2]).sum()), runs.min(axis=0).tolist(), runs.max(axis=0).tolist()
+    (56, [0, 0, 0, 1], [3, 3, 3, 4])
+    >>> get_surface_runs(tris[:2] * (1., 1., .0) + (0., 0., .6), .5).tolist()  # an open square
+    [[0, 0, 1, 2], [0, 1, 1, 2], [1, 0, 1, 2], [1, 1, 1, 2]]
+    >>> wall = get_box_tris((0., 0., 0.), (.02, 1., 1.))  # thinner than a voxel
+    >>> len(voxelize(wall, .25)), len(get_surface_runs(wall, .25))
+    (0, 4)
+    """
+    tris = np.asarray(tris, dtype=np.float64).reshape(-1, 3, 3)
+    voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    origin = np.asarray(origin, dtype=np.float64)
+    # Scale to grid coordinates, voxel (i, j, k) spans i..i+1, j..j+1, k..k+1
+    tris = (tris - origin) / voxel_size
+    a, ab, ac = tris[:, 0], tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0]
+    normals = np.cross(ab, ac)
+    lengths = np.linalg.norm(normals, axis=1)
+    nudges = normals / np.where(lengths > 0., lengths, 1.)[:, np.newaxis] * -1.
+    centers = tris.mean(axis=1)
+    # Sample each triangle on a barycentric grid of n subdivisions
+    edges = np.max(np.abs(np.stack((ab, ac, ac - ab), axis=1)).max(axis=2), axis=1)
+    ns = np.maximum(np.ceil(edges * 2.).astype(np.int64), 1)
+    counts = (ns + 1) * (ns + 2) // 2
+    lows = np.floor(tris.reshape(-1, 3).min(axis=0)).astype(np.int64) - 1
+    shape = tuple(np.floor(tris.reshape(-1, 3).max(axis=0)).astype(np.int64) + 2 - lows)
+    voxels = list()
+    for chunk in _get_count_chunks(counts):
+        t = np.repeat(np.arange(chunk.start, chunk.stop), counts[chunk])
+        offsets = np.arange(len(t)) - np.repeat(np.cumsum(counts[chunk]) - counts[chunk], counts[chunk])
+        # offset to (u, v) with u + v <= n, row by row
+        us = (np.sqrt(8. * offsets + 1.) - 1.) // 2.
+        us = us.astype(np.int64)
+        us -= (us * (us + 1) // 2 > offsets)
+        us += ((us + 1) * (us + 2) // 2 <= offsets)
+        vs = offsets - us * (us + 1) // 2
+        n = ns[t].astype(np.float64)
+        points = a[t] + ab[t] * ((us - vs) / n)[:, np.newaxis] + ac[t] * (vs / n)[:, np.newaxis]
+        shrinks = centers[t] - points
+        shrinks /= np.maximum(np.linalg.norm(shrinks, axis=1), 1E-12)[:, np.newaxis]
+        points += (shrinks + nudges[t]) * 1E-4
+        voxels.append(np.unique(_get_keys(np.floor(points).astype(np.int64) - lows, shape)))
+    if not voxels: return np.empty((0, 4), dtype=np.int64)
+    voxels = np.column_stack(np.unravel_index(np.unique(np.concatenate(voxels)), shape)) + lows
+    if bounds is not None:
+        voxels = voxels[
+            (voxels[:, 0] >= bounds[0]) & (voxels[:, 0] < bounds[1])
+            & (voxels[:, 1] >= bounds[2]) & (voxels[:, 1] < bounds[3])
+        ]
+    return _join_runs(np.column_stack((voxels, voxels[:, 2] + 1)))
+
+def _get_keys(ijks, shape) -> "keys":
+    """Get the scalar keys of non negative ijks in a grid of shape."""
+    return (ijks[:, 0] * shape[1] + ijks[:, 1]) * shape[2] + ijks[:, 2]
+
+def get_box_tris(p0, p1) -> "tris":
+    """Get the outward oriented triangles of box p0-p1."""
+    (x0, y0, z0), (x1, y1, z1) = p0, p1
+    v = np.array((
+        (x0, y0, z0), (x1, y0, z0), (x1, y1, z0), (x0, y1, z0),
+        (x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1),
+    ))
+    quads = ((0, 3, 2, 1), (4, 5, 6, 7), (0, 1, 5, 4), (2, 3, 7, 6), (1, 2, 6, 5), (0, 4, 7, 3))
+    return np.array([v[(q[0], q[i], q[i+1]),] for q in quads for i in (1, 2)])
@@ -0,0 +1,87 @@
+"""BlenderFDS, weld close vertices by grid hashing."""
+
+import numpy as np
+
+# With cells of size 2 * epsilon shifted by 0 or epsilon along each axis,
+# two vertices closer than epsilon share a cell in at least one of the 8 grids.
+# Vertices are sorted by cell and compared with the following ones in the same cell.
+# Close vertices are welded in clusters, to the first vertex of each cluster.
+
+def get_close_pairs(co, epsilon) -> "pairs":
+    """Get the index pairs (i < j) of vertices closer than epsilon.
+
+    >>> co = np.array(((0., 0., 0.), (1., 0., 0.), (1., 1E-6, 0.), (0., 0., 1E-4)))
+    >>> get_close_pairs(co, 1E-5).tolist()
+    [[1, 2]]
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    pairs = list()
+    if len(co) < 2 or epsilon <= 0.:
+        return np.empty((0, 2), dtype=np.int64)
+    co_min = co.min(axis=0)
+    for shift in np.ndindex(2, 2, 2):
+        cells = np.floor((co - co_min + np.array(shift) * epsilon) / (2. * epsilon)).astype(np.int64)
+        keys = _get_cell_keys(cells)
+        order = np.argsort(keys)
+        keys = keys[order]
+        # Compare vertices in the same cell, at increasing distance in the sorted order
+        k = 1
+        while k < len(order):
+            same = np.flatnonzero(keys[k:] == keys[:-k])
+            if not len(same):
+                break
+            i, j = order[same], order[same + k]
+            is_close = np.linalg.norm(co[j] - co[i], axis=1) <= epsilon
+            pairs.append(np.column_stack((i[is_close], j[is_close])))
+            k += 1
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return pairs[np.concatenate(([True], np.any(pairs[1:] != pairs[:-1], axis=1)))]
+
+def _get_cell_keys(cells) -> "keys":
+    """Get a sortable int64 key of each integer cell, a single code if it fits."""
+    sizes = cells.max(axis=0) + 1
+    if np.prod(sizes.astype(np.float64)) < 2. ** 62:
+        return cells[:, 0] * (sizes[1] * sizes[2]) + cells[:, 1] * sizes[2] + cells[:, 2]
+    return np.unique(cells, axis=0, return_inverse=True)[1].ravel()
+
+def get_remap(co, epsilon) -> "remap, firsts":
+    """Get the welded index of each vertex, and the first vertex of each welded vertex.
+
+    >>> co = np.array(((0., 0., 0.), (1., 0., 0.), (0., 0., 5E-6), (1., 0., 6E-6), (0., 0., 1E-5)))
+    >>> remap, firsts = get_remap(co, 1E-5)
+    >>> remap.tolist(), firsts.tolist()
+    ([0, 1, 0, 1, 0], [0, 1])
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    pairs = get_close_pairs(co, epsilon)
+    # Label clusters by hooking to the min label, and pointer jumping
+    labels = np.arange(len(co))
+    while len(pairs):
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, pairs[:, 1], labels[pairs[:, 0]])
+        np.minimum.at(new_labels, pairs[:, 0], labels[pairs[:, 1]])
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    firsts, remap = np.unique(labels, return_inverse=True)
+    return remap.ravel(), firsts
+
+def weld(verts, tris, epsilon) -> "verts, tris, kept":
+    """Weld verts closer than epsilon, remap tris, drop the collapsed ones.
+
+    kept is the mask of the original tris that are kept.
+
+    >>> verts = ((0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (1., 0., 1E-6), (1., 1., 0.))
+    >>> verts, tris, kept = weld(verts, ((0, 1, 2), (3, 4, 2), (1, 3, 4)), 1E-5)
+    >>> len(verts), tris.tolist(), kept.tolist()
+    (4, [[0, 1, 2], [1, 3, 2]], [True, True, False])
+    """
+    verts = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+    remap, firsts = get_remap(verts, epsilon)
+    tris = remap[np.asarray(tris, dtype=np.int64).reshape(-1, 3)]
+    kept = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])
+    return verts[firsts], tris[kept], kept
@@ -1,10 +1,12 @@
 """BlenderFDS, translate Blender object geometry to FDS notation."""
 
 import bpy
+import numpy as np
 from time import time
 from . import utils
-from .calc_voxels import get_voxels, get_pixels
-from .calc_trisurfaces import get_trisurface
+from .kernels import blob, elements
+from .calc_voxels import get_voxels, get_voxels_by_mesh, get_pixels, get_voxels_estimate, get_meshes
+from .calc_trisurfaces import get_trisurface, get_terrain
 from ..exceptions import BFException
 
 DEBUG = False
@@ -19,27 +21,51 @@ def ob_to_none(context, ob):
 
 def ob_to_xbs_voxels(context, ob) -> "((x0,x1,y0,y1,z0,z1,), ...), 'Message'":
     """Transform ob solid geometry in XBs notation (voxelization). Never send None."""
+    return blob.decode_xbs(_ob_to_blob_voxels(context, ob))
+
+def _ob_to_blob_voxels(context, ob) -> "blob":
+    """Transform ob solid geometry in compact voxel boxes blob (voxelization)."""
     DEBUG and print("BFDS: geometry.ob_to_xbs_voxels:", ob.name)
+    if ob.bf_xb_mesh_voxel:
+        return _ob_to_blob_voxels_by_mesh(context, ob)
     t0 = time()
-    xbs, voxel_size, timing = get_voxels(context, ob)
-    if not xbs:
-        return (), "No voxel created"
+    boxes, origin, voxel_size, timing = get_voxels(context, ob)
+    if not len(boxes):
+        return blob.encode_xbs((), "No voxel created")
+    scale_length = context.scene.unit_settings.scale_length
+    msg = "{0} voxels, resolution {1:.3f} m, in {2:.3f} s".format(len(boxes), voxel_size * scale_length, time()-t0)
+    if DEBUG: msg += " (t:{0[0]:.3f} v:{0[1]:.3f}, g:{0[2]:.3f}, b:{0[3]:.3f})".format(timing)
+    return blob.encode_boxes(boxes, origin, voxel_size, msg)
+
+def _ob_to_blob_voxels_by_mesh(context, ob) -> "blob":
+    """Transform ob solid geometry in a group of voxel boxes blobs, one for each intersecting MESH."""
+    DEBUG and print("BFDS: geometry.ob_to_xbs_voxels_by_mesh:", ob.name)
+    t0 = time()
+    parts, timing = get_voxels_by_mesh(context, ob)
+    if not parts:
+        return blob.encode_xbs((), "No voxel created")
     scale_length = context.scene.unit_settings.scale_length
-    msg = "{0} voxels, resolution {1:.3f} m, in {2:.3f} s".format(len(xbs), voxel_size * scale_length, time()-t0)
-    if DEBUG: msg += " (s:{0[0]:.3f} 1f:{0[1]:.3f}, 2g:{0[2]:.3f}, 3g:{0[3]:.3f})".format(timing)
-    return xbs, msg
+    count = sum(len(boxes) for boxes, _, _ in parts)
+    resolution = min(voxel_size.min() for _, _, voxel_size in parts) * scale_length
+    msg = "{0} voxels in {1} MESH, resolution {2:.3f} m, in {3:.3f} s".format(count, len(parts), resolution, time()-t0)
+    if DEBUG: msg += " (t:{0[0]:.3f} v:{0[1]:.3f})".format(timing)
+    return blob.encode_group([blob.encode_boxes(*part) for part in parts], msg)
 
 def ob_to_xbs_pixels(context, ob) -> "((x0,x1,y0,y1,z0,z0,), ...), 'Message'":
     """Transform ob flat geometry in XBs notation (flat voxelization). Never send None."""
+    return blob.decode_xbs(_ob_to_blob_pixels(context, ob))
+
+def _ob_to_blob_pixels(context, ob) -> "blob":
+    """Transform ob flat geometry in compact pixel boxes blob (flat voxelization)."""
     DEBUG and print("BFDS: geometry.ob_to_xbs_pixels:", ob.name)
     t0 = time()
-    xbs, voxel_size, timing = get_pixels(context, ob)
-    if not xbs:
-        return (), "No pixel created"
+    boxes, origin, voxel_size, flat_axis, flat_coord, timing = get_pixels(context, ob)
+    if not len(boxes):
+        return blob.encode_xbs((), "No pixel created")
     scale_length = context.scene.unit_settings.scale_length
-    msg = "{0} pixels, resolution {1:.3f} m, in {2:.0f} s".format(len(xbs), voxel_size * scale_length, time()-t0)
-    if DEBUG: msg += " (s:{0[0]:.0f} 1f:{0[1]:.0f}, 2g:{0[2]:.0f}, 3g:{0[3]:.0f})".format(timing)
-    return xbs, msg
+    msg = "{0} pixels, resolution {1:.3f} m, in {2:.0f} s".format(len(boxes), voxel_size * scale_length, time()-t0)
+    if DEBUG: msg += " (t:{0[0]:.3f} v:{0[1]:.3f}, g:{0[2]:.3f}, b:{0[3]:.3f})".format(timing)
+    return blob.encode_boxes(boxes, origin, voxel_size, msg, flat_axis=flat_axis, flat_coord=flat_coord)
 
 def ob_to_xbs_bbox(context, ob) -> "((x0,x1,y0,y1,z0,z1,), ...), 'Message'":
     """Transform ob solid geometry in XBs notation (bounding box). Never send None."""
@@ -51,31 +77,18 @@ def ob_to_xbs_faces(context, ob) -> "((x0,x1,y0,y1,z0,z0,), ...), 'Message'":
     """Transform ob faces in XBs notation (faces). Never send None."""
     DEBUG and print("BFDS: geometry.ob_to_xbs_faces:", ob.name)
     # Init
-    result = list()
     me = utils.get_global_mesh(context, ob)
-    tessfaces = utils.get_tessfaces(context, me)
-    # For each tessface...
-    for tessface in tessfaces:
-        vertices = [me.vertices[vertex] for vertex in tessface.vertices]
-        # Calc the bounding box in global coordinates
-        bbminx, bbminy, bbminz = vertices[0].co
-        bbmaxx, bbmaxy, bbmaxz = vertices[0].co
-        for vertex in vertices[1:]:
-            x, y, z = vertex.co
-            bbminx, bbminy, bbminz = min(bbminx, x), min(bbminy, y), min(bbminz, z)
-            bbmaxx, bbmaxy, bbmaxz = max(bbmaxx, x), max(bbmaxy, y), max(bbmaxz, z)
-        bbd = [(bbmaxx - bbminx, 2), (bbmaxy - bbminy, 1), (bbmaxz - bbminz, 0)]
-        bbd.sort()
-        if bbd[0][1] == 2:
-            bbmaxx = bbminx = (bbminx+bbmaxx)/2
-        if bbd[0][1] == 1:
-            bbmaxy = bbminy = (bbminy+bbmaxy)/2
-        if bbd[0][1] == 0:
-            bbmaxz = bbminz = (bbminz+bbmaxz)/2
-        result.append((bbminx, bbmaxx, bbminy, bbmaxy, bbminz, bbmaxz,),)
-    result.sort()
+    utils.get_tessfaces(context, me)
+    co, vs, _ = utils.get_mesh_tessfaces_arrays(me)
     # Clean up
     bpy.data.meshes.remove(me, do_unlink=True)
+    # Calc flattened bounding boxes in global coordinates, sorted
+    xbs = elements.faces_to_xbs(co, vs)
+    if ob.bf_xb_merge_faces:
+        result = elements.merge_faces(xbs).tolist()
+        msg = "{0} faces merged in {1}".format(len(xbs), len(result))
+        return result, msg
+    result = xbs.tolist()
     # Return
     msg = len(result) > 1 and "{0} faces".format(len(result)) or ""
     return result, msg
@@ -84,38 +97,103 @@ def ob_to_xbs_edges(context, ob) -> "((x0,x1,y0,y1,z0,z1,), ...), 'Message'":
     """Transform ob faces in XBs notation (faces). Never send None."""
     DEBUG and print("BFDS: geometry.ob_to_xbs_edges:", ob.name)
     # Init
-    result = list()
     me = utils.get_global_mesh(context, ob)
-    # For each edge...
-    for edge in me.edges:
-        pt0x, pt0y, pt0z = me.vertices[edge.vertices[0]].co
-        pt1x, pt1y, pt1z = me.vertices[edge.vertices[1]].co
-        result.append((pt0x, pt1x, pt0y, pt1y, pt0z, pt1z,),)
-    result.sort()
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    edge_verts = np.empty(len(me.edges) * 2, dtype=np.int32)
+    me.edges.foreach_get("vertices", edge_verts)
     # Clean up
     bpy.data.meshes.remove(me, do_unlink=True)
+    # Calc edges, sorted
+    result = elements.edges_to_xbs(co, edge_verts).tolist()
     # Return
     msg = len(result) > 1 and "{0} edges".format(len(result)) or ""
     return result, msg
 
 # Caller function (ob.bf_xb)
 
-choice_to_xbs = {
-    "NONE"   : ob_to_none,
-    "BBOX"   : ob_to_xbs_bbox,
-    "VOXELS" : ob_to_xbs_voxels,
-    "FACES"  : ob_to_xbs_faces,
-    "PIXELS" : ob_to_xbs_pixels,
-    "EDGES"  : ob_to_xbs_edges,
+def _encoded(ob_to_xbs_choice):
+    """Get a function encoding ob_to_xbs_choice results in a blob."""
+    return lambda context, ob: blob.encode_xbs(*ob_to_xbs_choice(context, ob))
+
+choice_to_xbs_blob = {
+    "NONE"   : _encoded(ob_to_none),
+    "BBOX"   : _encoded(ob_to_xbs_bbox),
+    "VOXELS" : _ob_to_blob_voxels,
+    "FACES"  : _encoded(ob_to_xbs_faces),
+    "PIXELS" : _ob_to_blob_pixels,
+    "EDGES"  : _encoded(ob_to_xbs_edges),
 }
 
 def ob_to_xbs(context, ob) -> "((x0,x1,y0,y1,z0,z0,), ...), 'Message'":
     """Transform Blender object geometry according to ob.bf_xb to FDS notation. Never send None."""
     # not ob.get("ob_to_xbs_cache") -> precalc not available or modified input conditions
+    # The cache is a compact bytes blob, decoded to xbs when requested
     DEBUG and print("BFDS: geometry.ob_to_xbs:", ob.name)
+    if ob.get("ob_to_xbs_export"): # set while exporting, see consolidate and holes
+        return blob.decode_xbs(ob["ob_to_xbs_export"])
+    if ob.get("ob_to_xbs_cache") and ob.get("ob_to_xbs_cache_moved"): # set in the handler
+        ob["ob_to_xbs_cache"] = _get_translated_xbs_cache(context, ob) or False
     if not ob.get("ob_to_xbs_cache"): # ob.is_updated does not work here, checked in the handler
-        ob["ob_to_xbs_cache"] = choice_to_xbs[ob.bf_xb](context, ob) # Calculate
-    return ob["ob_to_xbs_cache"]
+        ob["ob_to_xbs_cache"] = choice_to_xbs_blob[ob.bf_xb](context, ob) # Calculate
+        ob["ob_to_xbs_cache_matrix"] = _get_matrix(ob)
+        if ob.bf_xb in ("VOXELS", "PIXELS"):
+            ob["ob_to_xbs_cache_fingerprint"] = utils.get_mesh_fingerprint(context, ob)
+    ob["ob_to_xbs_cache_moved"] = False
+    return blob.decode_xbs(ob["ob_to_xbs_cache"])
+
+# When a voxelized object is only translated, its cached voxels are translated too:
+# its mesh (modifiers applied) and its rotation and scale shall be unchanged,
+# and the translation shall be a whole number of voxels, if aligned to global origin.
+
+def _get_matrix(ob) -> "[16 floats]":
+    """Get ob world matrix as a flat list."""
+    return [v for row in ob.matrix_world for v in row]
+
+def _get_translated_xbs_cache(context, ob) -> "blob or None":
+    """Get the translated xbs cache of a moved object, None if it shall be recalculated."""
+    if ob.bf_xb not in ("VOXELS", "PIXELS"):
+        return None
+    matrix = np.array(_get_matrix(ob)).reshape(4, 4)
+    cached_matrix = np.array(ob.get("ob_to_xbs_cache_matrix", ())).reshape(-1, 4)
+    if cached_matrix.shape != (4, 4) or not np.array_equal(matrix[:, :3], cached_matrix[:, :3]):
+        return None  # rotated or scaled
+    if ob.get("ob_to_xbs_cache_fingerprint") != utils.get_mesh_fingerprint(context, ob):
+        return None  # modified mesh
+    result = blob.translate_blob(
+        ob["ob_to_xbs_cache"], matrix[:3, 3] - cached_matrix[:3, 3], centered=ob.bf_xb_center_voxels,
+    )
+    if result is not None:
+        DEBUG and print("BFDS: geometry._get_translated_xbs_cache: translated:", ob.name)
+        ob["ob_to_xbs_cache_matrix"] = _get_matrix(ob)
+    return result
+
+# The estimate is requested while drawing the panel, where ID properties cannot be written,
+# so the object surface is cached here, and deleted by the handler when the object changes,
+# with the bbox and IJK of the exported MESH objects, deleted when any of them changes
+
+_surface_cache = dict()  # ob.name: (area, bbox, tris_count)
+_meshes_cache = list()  # ((bbox, ijk), ...) when cached, in a list
+
+def ob_to_xbs_estimate(context, ob) -> "voxels, boxes, memory, runtime":
+    """Estimate ob voxelization or pixelization, without running it."""
+    DEBUG and print("BFDS: geometry.ob_to_xbs_estimate:", ob.name)
+    if ob.name not in _surface_cache:
+        _surface_cache[ob.name] = utils.get_global_surface(context, ob)
+    meshes = None
+    if ob.bf_xb == "VOXELS" and ob.bf_xb_mesh_voxel:
+        if not _meshes_cache:
+            _meshes_cache.append(get_meshes(context))
+        meshes = _meshes_cache[0]
+    return get_voxels_estimate(context, ob, _surface_cache[ob.name], meshes)
+
+def del_xbs_estimate_cache(ob=None) -> "None":
+    """Delete the cached surface of ob used for estimates, or of all objects and MESH objects."""
+    if ob is None:
+        _surface_cache.clear()
+        del _meshes_cache[:]
+    else:
+        _surface_cache.pop(ob.name, None)
 
 #++ to XYZ
 
@@ -123,15 +201,13 @@ def ob_to_xyzs_vertices(context, ob) -> "((x0,y0,z0,), ...), 'Message'":
     """Transform ob vertices in XYZs notation. Never send None."""
     DEBUG and print("BFDS: geometry.ob_to_xyzs_vertices:", ob.name)
     # Init
-    result = list()
     me = utils.get_global_mesh(context, ob)
-    # For each vertex...
-    for vertex in me.vertices:
-        pt0x, pt0y, pt0z = vertex.co
-        result.append((pt0x, pt0y, pt0z,),)
-    result.sort()
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
     # Clean up
     bpy.data.meshes.remove(me, do_unlink=True)
+    # Sort vertices
+    result = elements.sort_rows(co.reshape(-1, 3)).tolist()
     # Return
     msg = len(result) > 1 and "{0} vertices".format(len(result)) or ""
     return result, msg
@@ -164,20 +240,21 @@ def ob_to_pbs_planes(context, ob) -> "(('X',x3,), ('X',x7,), ('Y',y9,), ...), 'M
     """Transform ob faces in PBs notation. Never send None."""
     DEBUG and print("BFDS: geometry.ob_to_pbs_planes:", ob.name)
     # Init
-    result = list()
     xbs, msg = ob_to_xbs_faces(context, ob)
+    if not xbs:
+        return (), msg
+    xbs = np.array(xbs, dtype=np.float64).reshape(-1, 6)
     epsilon = 1E-5
-    # For each face build a plane...
-    for xb in xbs:
-        if   abs(xb[1] - xb[0]) < epsilon:
-            result.append((0,xb[0],),) # PBX is 0
-        elif abs(xb[3] - xb[2]) < epsilon:
-            result.append((1,xb[2],),) # PBY is 1
-        elif abs(xb[5] - xb[4]) < epsilon:
-            result.append((2,xb[4],),) # PBZ is 2
-        else:
-            raise ValueError("BFDS: Building planes impossible, problem in ob_to_xbs_faces.")
-    result.sort()
+    # For each face build a plane, PBX is 0, PBY is 1, PBZ is 2...
+    is_flat = np.abs(xbs[:, 1::2] - xbs[:, 0::2]) < epsilon
+    if not np.all(np.any(is_flat, axis=1)):
+        raise ValueError("BFDS: Building planes impossible, problem in ob_to_xbs_faces.")
+    axis = np.argmax(is_flat, axis=1)
+    coords = xbs[np.arange(len(xbs)), 2 * axis]
+    # ...dropping the duplicated ones
+    keys = np.column_stack((axis, np.round(coords / epsilon)))
+    _, firsts = np.unique(keys, axis=0, return_index=True)
+    result = sorted((int(axis[i]), float(coords[i]),) for i in firsts)
     # Nothing to clean up, return
     msg = len(result) > 1 and "{0} planes".format(len(result)) or ""
     return result, msg
@@ -199,10 +276,52 @@ def ob_to_pbs(context, ob):
 
 #++ to GEOM
 
+# GEOM results are cached here, as they are too large for ID properties,
+# against a fingerprint of the mesh, its face materials and world matrix, decimation,
+# and the thresholds used for welding and for checking decimation, even if not checked.
+# The quality check verdict is cached with the thresholds it was run with.
+# The handler deletes the cache when the object changes.
+
+_geom_cache = dict()  # ob.name: (fingerprint, checked thresholds or None, result)
+
 def ob_to_geom(context, ob, check=True) -> "mas, fds_verts, fds_faces, msg":
-    """Transform Blender object geometry to GEOM FDS notation. Never send a None."""
-    mas, verts, faces = get_trisurface(context, ob, check)
-    msg = "{} vertices, {} faces".format(len(verts), len(faces))
-    fds_verts = [coo for vert in verts for coo in vert]
-    fds_faces = [i for face in faces for i in face]
-    return mas, fds_verts, fds_faces, msg  # TODO add caching of results
+    """Transform Blender object geometry to GEOM FDS notation, flat numpy arrays. Never send a None."""
+    DEBUG and print("BFDS: geometry.ob_to_geom:", ob.name)
+    thresholds = context.scene.bf_config_min_edge_length, context.scene.bf_config_min_face_area
+    options = "{}{}".format(ob.bf_geom_decimate, thresholds)
+    fingerprint = utils.get_mesh_fingerprint(context, ob, with_materials=True) + options
+    thresholds = check and thresholds or None
+    cached = _geom_cache.get(ob.name)
+    if cached and cached[0] == fingerprint and (not check or cached[1] == thresholds):
+        DEBUG and print("BFDS: geometry.ob_to_geom: cached:", ob.name)
+        return cached[2]
+    t0 = time()
+    mas, verts, faces, msg = get_trisurface(context, ob, check, decimate=ob.bf_geom_decimate)
+    msg = "{} vertices, {} faces{}, in {:.3f} s".format(len(verts), len(faces), msg and ", " + msg, time()-t0)
+    fds_verts, fds_faces = verts.ravel(), faces.ravel()
+    result = mas, fds_verts, fds_faces, msg
+    if check:  # normals may be flipped
+        fingerprint = utils.get_mesh_fingerprint(context, ob, with_materials=True) + options
+    _geom_cache[ob.name] = fingerprint, thresholds, result
+    return result
+
+def ob_to_geom_terrain(context, ob) -> "ma, ijk, xb, zvals, msg":
+    """Transform Blender object geometry to GEOM FDS terrain notation. Never send a None."""
+    DEBUG and print("BFDS: geometry.ob_to_geom_terrain:", ob.name)
+    fingerprint = utils.get_mesh_fingerprint(context, ob, with_materials=True) + "TERRAIN"
+    cached = _geom_cache.get(ob.name)
+    if cached and cached[0] == fingerprint:
+        DEBUG and print("BFDS: geometry.ob_to_geom_terrain: cached:", ob.name)
+        return cached[2]
+    t0 = time()
+    ma, ijk, xb, zvals, msg = get_terrain(context, ob)
+    result = ma, ijk, xb, zvals, "{}, in {:.3f} s".format(msg, time()-t0)
+    _geom_cache[ob.name] = fingerprint, None, result
+    return result
+
+def del_geom_cache(ob=None) -> "None":
+    """Delete the cached GEOM of ob, or of all objects."""
+    if ob is None:
+        _geom_cache.clear()
+    else:
+        _geom_cache.pop(ob.name, None)
@@ -1,8 +1,10 @@
 """BlenderFDS, export geometry to ge1 cad file format."""
 
 import bpy
+import numpy as np
 
-from .utils import *
+from . import utils
+from .kernels.rects import merge_rects
 
 # GE1 file format:
 
@@ -18,19 +20,25 @@ from .utils import *
 # 2 150 150 150 0.0 0.0 0.5
 #
 # [FACES]       < immutable title
-# 2             < number of *quad* faces (from OBST and SURF objects triamgulated bm.faces)
+# 2             < number of *quad* faces (from OBST and SURF objects planar quads, tris are degenerate quads)
 # 6.0 3.9 0.5  6.0 1.9 0.5  6.0 1.9 1.9  6.0 3.9 1.9  0 < x0, y0, z0, x1, y1, z1, ..., ref to appearance index
 # 6.0 3.9 0.5  6.0 1.9 0.5  6.0 1.9 1.9  6.0 3.9 1.9  0
 # EOF
 
-def scene_to_ge1(context, scene):  # TODO use BMesh
-    """Export scene geometry in FDS GE1 notation."""
-    # Cursor
-    w = context.window_manager.windows[0]
-    w.cursor_modal_set("WAIT")
-    # Get GE1 appearances from materials
+# GE1 faces are kept as numpy arrays of rows:
+# x0, y0, z0, x1, y1, z1, x2, y2, z2, x3, y3, z3, appearance index
+# and formatted in bulk, chunk by chunk, while streaming to file.
+# Coplanar axis aligned rectangles with the same appearance are merged.
+
+gefaces_decimals = 6  # as in gefaces_format, merging tolerance
+gefaces_format = "%.6f %.6f %.6f %.6f %.6f %.6f %.6f %.6f %.6f %.6f %.6f %.6f %d\n"
+gefaces_chunk = 10000  # rows formatted at once
+
+def _get_appearances(context) -> "appearances, ma_to_appearance":
+    """Get GE1 appearances from materials."""
     appearances = list()
     ma_to_appearance = dict()
+    index = -1
     for index, ma in enumerate(bpy.data.materials):
         ma_to_appearance[ma.name] = index
         appearances.append(
@@ -49,51 +57,108 @@ def scene_to_ge1(context, scene):  # TODO use BMesh
             alpha=.5,
         )
     )
+    return appearances, ma_to_appearance
+
+def _get_appearance_indices(ob, material_indices, ma_to_appearance) -> "array":
+    """Get the GE1 appearance index of each ob face."""
+    if ob.bf_namelist_cls == "ON_HOLE":
+        return np.full(len(material_indices), ma_to_appearance["BF_HOLE"])
+    if ob.bf_namelist_cls == "ON_GEOM":
+        # Each face has its own material, from ob material_slots
+        slot_indices = np.array([
+            ma_to_appearance.get(getattr(ms.material, "name", None), 0)
+            for ms in ob.material_slots
+        ] or [0,])
+        return slot_indices[np.clip(material_indices, 0, len(slot_indices)-1)]
+    if ob.active_material:
+        material_name = ob.active_material.name
+    else:
+        material_name = "INERT"
+    return np.full(len(material_indices), ma_to_appearance.get(material_name, 0))
+
+def _ob_to_gefaces(context, ob, ma_to_appearance, scale_length) -> "array":
+    """Get GE1 faces from object, in global coordinates."""
+    # Get planar quads from the Object, apply modifiers, set in global coordinates
+    quads, material_indices = utils.get_global_quads(context, ob, settings="PREVIEW")
+    gefaces = np.empty((len(quads), 13))
+    gefaces[:, 0:12] = quads.reshape(-1, 12) * scale_length
+    gefaces[:, 12] = _get_appearance_indices(ob, material_indices, ma_to_appearance)
+    return _merge_gefaces(gefaces)
+
+def _merge_gefaces(gefaces) -> "array":
+    """Merge coplanar axis aligned rectangular gefaces with the same appearance."""
+    quads = np.round(gefaces[:, 0:12], gefaces_decimals).reshape(-1, 4, 3)
+    is_merged = np.zeros(len(gefaces), dtype=bool)
+    rects, keys = list(), list()
+    for a, b, c in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):  # normal axis and cyclic plane axes
+        qb, qc = quads[:, :, b], quads[:, :, c]
+        bmin, bmax = qb.min(axis=1), qb.max(axis=1)
+        cmin, cmax = qc.min(axis=1), qc.max(axis=1)
+        # Flat on a, vertices on the four distinct rect corners
+        corners = (qb == bmax[:, None]) * 1 + (qc == cmax[:, None]) * 2
+        is_rect = (
+            (quads[:, :, a] == quads[:, :1, a]).all(axis=1)
+            & ((qb == bmin[:, None]) | (qb == bmax[:, None])).all(axis=1)
+            & ((qc == cmin[:, None]) | (qc == cmax[:, None])).all(axis=1)
+            & (np.sort(corners, axis=1) == (0, 1, 2, 3)).all(axis=1)
+            & ~is_merged
+        )
+        is_merged |= is_rect
+        # Normal sign from the first corner
+        e1, e2 = quads[is_rect, 1] - quads[is_rect, 0], quads[is_rect, 2] - quads[is_rect, 0]
+        signs = (e1[:, b] * e2[:, c] - e1[:, c] * e2[:, b]) > 0.
+        rects.append(np.column_stack((bmin[is_rect], bmax[is_rect], cmin[is_rect], cmax[is_rect])))
+        keys.append(np.column_stack((
+            np.full(len(signs), a), signs, quads[is_rect, 0, a], gefaces[is_rect, 12],
+        )))
+    if not is_merged.any(): return gefaces
+    # Group by normal axis, normal sign, plane coordinate, and appearance, then merge
+    keys = np.concatenate(keys)
+    group_keys, groups = np.unique(keys, axis=0, return_inverse=True)
+    rects, groups = merge_rects(np.concatenate(rects), groups.ravel())
+    keys = group_keys[groups]
+    # Rebuild GE1 faces, vertices ordered as the normal sign
+    merged = np.empty((len(rects), 13))
+    for a, b, c in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+        is_a = keys[:, 0] == a
+        b0, b1, c0, c1 = rects[is_a].T
+        signs = keys[is_a, 1] > 0.
+        bs = np.where(signs[:, None], np.column_stack((b0, b1, b1, b0)), np.column_stack((b0, b0, b1, b1)))
+        cs = np.where(signs[:, None], np.column_stack((c0, c0, c1, c1)), np.column_stack((c0, c1, c1, c0)))
+        merged[is_a, a:12:3] = keys[is_a, 2:3]
+        merged[is_a, b:12:3] = bs
+        merged[is_a, c:12:3] = cs
+    merged[:, 12] = keys[:, 3]
+    return np.concatenate((merged, gefaces[~is_merged]))
+
+def _write_gefaces(f, gefaces) -> "None":
+    """Format gefaces in bulk and write them to file f."""
+    for i in range(0, len(gefaces), gefaces_chunk):
+        rows = gefaces[i:i+gefaces_chunk]
+        f.write((gefaces_format * len(rows)) % tuple(rows.ravel().tolist()))
+
+def scene_to_ge1(context, scene, filepath):
+    """Export scene geometry in FDS GE1 notation to filepath."""
+    # Cursor
+    w = context.window_manager.windows[0]
+    w.cursor_modal_set("WAIT")
+    # Get GE1 appearances from materials
+    appearances, ma_to_appearance = _get_appearances(context)
     # Select GE1 objects
-    obs = (ob for ob in context.scene.objects if ob.type == "MESH"
+    obs = (ob for ob in scene.objects if ob.type == "MESH"
         and not ob.hide_render  # hide some objects if requested
         and not ob.bf_is_tmp    # do not show temporary objects
         and ob.bf_export        # show only exported objects
         and ob.bf_namelist_cls in ("ON_OBST", "ON_GEOM", "ON_VENT", "ON_HOLE") # show only some namelists
         and getattr(ob.active_material, "name", None) != "OPEN" # do not show open VENTs
     )
-    # Get GE1 faces from selected objects
-    gefaces = list()
-    for ob in obs:
-        # Get the new bmesh from the Object, apply modifiers, set in global coordinates, and triangulate
-        bm = bmesh.new()
-        bm.from_object(ob, context.scene, deform=True, render=False, cage=False, face_normals=True)
-        bm.transform(ob.matrix_world)
-        bmesh.ops.triangulate(bm, faces=bm.faces)
-        # Get ob material_slots
-        material_slots = ob.material_slots
-        # Get default_material_name
-        if   ob.bf_namelist_cls == "ON_HOLE":
-            default_material_name = "BF_HOLE"
-        elif ob.bf_namelist_cls == "ON_GEOM":
-            default_material_name = None
-        elif ob.active_material:
-            default_material_name = ob.active_material.name
-        else:
-            default_material_name = "INERT"
-        scale_length = context.scene.unit_settings.scale_length
-        for f in bm.faces:
-            # Grab ordered vertices coordinates
-            coos = [co for v in f.verts for co in v.co]
-            coos.extend((coos[-3], coos[-2], coos[-1]))  # tri to quad
-            items = ["{:.6f}".format(coo * scale_length) for coo in coos]
-            # Get appearance_index
-            if default_material_name:
-                material_name = default_material_name
-            else:
-                material_name = material_slots[f.material_index].material.name
-            appearance_index = str(ma_to_appearance.get(material_name, 0)) + "\n"
-            items.append(appearance_index)
-            # Append GE1 face
-            gefaces.append(" ".join(items))
-
-    # Prepare GE1 file and return
-    ge1_file_a = "[APPEARANCE]\n{}\n{}".format(len(appearances), "".join(appearances))
-    ge1_file_f = "[FACES]\n{}\n{}".format(len(gefaces), "".join(gefaces))
+    # Get GE1 faces from selected objects, as compact arrays
+    scale_length = scene.unit_settings.scale_length
+    obs_gefaces = [_ob_to_gefaces(context, ob, ma_to_appearance, scale_length) for ob in obs]
+    # Now the number of faces is known, stream the GE1 file
+    with open(filepath, "w", encoding="utf8", errors="ignore") as f:
+        f.write("[APPEARANCE]\n{}\n{}".format(len(appearances), "".join(appearances)))
+        f.write("[FACES]\n{}\n".format(sum(len(gefaces) for gefaces in obs_gefaces)))
+        for gefaces in obs_gefaces:
+            _write_gefaces(f, gefaces)
     w.cursor_modal_restore()
-    return "".join((ge1_file_a, ge1_file_f))
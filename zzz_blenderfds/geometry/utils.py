@@ -1,6 +1,8 @@
 """BlenderFDS, geometric utilities."""
 
 import bpy, bmesh
+import numpy as np
+from hashlib import sha1
 
 ### Working on Blender objects
 
@@ -63,6 +65,90 @@ def get_tessfaces(context, me) -> "Mesh tessfaces":
     me.update(calc_tessface=True)
     return me.tessfaces
 
+def get_mesh_tessfaces_arrays(me) -> "co, vs, material_indices":
+    """Get mesh vertex coordinates and tessfaces as numpy arrays."""
+    # Mesh tessfaces shall be already calculated
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3).astype(np.float64)
+    vs = np.empty(len(me.tessfaces) * 4, dtype=np.int32)
+    me.tessfaces.foreach_get("vertices_raw", vs)
+    vs = vs.reshape(-1, 4)
+    material_indices = np.empty(len(me.tessfaces), dtype=np.int32)
+    me.tessfaces.foreach_get("material_index", material_indices)
+    return co, vs, material_indices
+
+def get_mesh_tris(me) -> "tris, material_indices":
+    """Get mesh triangles from tessfaces as numpy arrays, quads are split."""
+    # tris = [[[x0, y0, z0], [x1, y1, z1], [x2, y2, z2]], ...]
+    co, vs, mis = get_mesh_tessfaces_arrays(me)
+    # A tessface with the fourth vertex index set to 0 is a triangle
+    is_quad = vs[:, 3] != 0
+    tri_vs = np.concatenate((vs[:, :3], vs[is_quad][:, (0, 2, 3)]))
+    tri_mis = np.concatenate((mis, mis[is_quad]))
+    return co[tri_vs], tri_mis
+
+def get_mesh_quads(me, epsilon=1E-5) -> "quads, material_indices":
+    """Get mesh planar quads from tessfaces as numpy arrays, tris are degenerate quads."""
+    # quads = [[[x0, y0, z0], [x1, y1, z1], [x2, y2, z2], [x3, y3, z3]], ...]
+    co, vs, mis = get_mesh_tessfaces_arrays(me)
+    # A tessface with the fourth vertex index set to 0 is a triangle
+    is_quad = vs[:, 3] != 0
+    # Check quad planarity: distance of the fourth vertex from the plane of the others
+    p = co[vs]
+    normals = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    lengths = np.sqrt((normals ** 2).sum(axis=1))
+    dists = np.abs(((p[:, 3] - p[:, 0]) * normals).sum(axis=1))
+    is_planar = is_quad & (lengths > 0.) & (dists <= epsilon * lengths)
+    is_split = is_quad & ~is_planar
+    # Planar quads are kept, tris and split quads get their last vertex duplicated
+    quad_vs = np.concatenate((
+        vs[is_planar],
+        vs[~is_planar][:, (0, 1, 2, 2)],
+        vs[is_split][:, (0, 2, 3, 3)],
+    ))
+    quad_mis = np.concatenate((mis[is_planar], mis[~is_planar], mis[is_split]))
+    return co[quad_vs], quad_mis
+
+def _get_global_mesh_arrays(context, ob, settings, get_arrays) -> "arrays":
+    """Get object mesh arrays in global coordinates by get_arrays."""
+    me = ob.to_mesh(
+        scene=context.scene,
+        apply_modifiers=True,
+        settings=settings,
+        calc_tessface=True,
+    )
+    me.transform(ob.matrix_world)
+    arrays = get_arrays(me)
+    bpy.data.meshes.remove(me, do_unlink=True)
+    return arrays
+
+def get_global_tris(context, ob, settings="RENDER") -> "tris, material_indices":
+    """Get object triangles in global coordinates as numpy arrays."""
+    return _get_global_mesh_arrays(context, ob, settings, get_mesh_tris)
+
+def get_global_quads(context, ob, settings="RENDER") -> "quads, material_indices":
+    """Get object planar quads in global coordinates as numpy arrays."""
+    return _get_global_mesh_arrays(context, ob, settings, get_mesh_quads)
+
+def get_mesh_fingerprint(context, ob, with_materials=False) -> "str":
+    """Get a fingerprint of object mesh, modifiers applied, in local coordinates.
+    If with_materials, also of its face materials and world matrix."""
+    me = ob.to_mesh(scene=context.scene, apply_modifiers=True, settings="RENDER")
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    vs = np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get("vertex_index", vs)
+    data = co.tobytes() + vs.tobytes()
+    if with_materials:
+        mis = np.empty(len(me.polygons), dtype=np.int32)
+        me.polygons.foreach_get("material_index", mis)
+        mas = [ms.material and (ms.material.name, ms.material.bf_export) for ms in ob.material_slots]
+        matrix = np.array([v for row in ob.matrix_world for v in row])
+        data += mis.tobytes() + matrix.tobytes() + repr(mas).encode("utf8")
+    bpy.data.meshes.remove(me, do_unlink=True)
+    return sha1(data).hexdigest()
+
 def insert_vertices_into_mesh(me, verts) -> "None":  # TODO not used
     """Insert vertices into mesh."""
     bm = bmesh.new()
@@ -104,11 +190,24 @@ def get_global_dimensions(context, ob) -> "dx, dy, dz":
 
 def get_global_area(context, ob) -> "Float":
     """Get area of object in global coordinates."""
-    area = 0.
+    return get_global_surface(context, ob)[0]
+
+def get_global_surface(context, ob) -> "area, (x0, x1, y0, y1, z0, z1), tris_count":
+    """Get area, bounding box and triangle count of object in global coordinates, in one pass."""
     me_tmp = get_global_mesh(context, ob) # Apply modifiers and scales
-    for polygon in me_tmp.polygons: area += polygon.area
+    areas = np.empty(len(me_tmp.polygons), dtype=np.float32)
+    me_tmp.polygons.foreach_get("area", areas)
+    loop_totals = np.empty(len(me_tmp.polygons), dtype=np.int32)
+    me_tmp.polygons.foreach_get("loop_total", loop_totals)
+    co = np.empty(len(me_tmp.vertices) * 3, dtype=np.float32)
+    me_tmp.vertices.foreach_get("co", co)
     bpy.data.meshes.remove(me_tmp, do_unlink=True)
-    return area
+    if not len(co):
+        return 0., (0., 0., 0., 0., 0., 0.), 0
+    co = co.reshape(-1, 3)
+    co_min, co_max = co.min(axis=0), co.max(axis=0)
+    bbox = co_min[0], co_max[0], co_min[1], co_max[1], co_min[2], co_max[2]
+    return float(areas.sum()), tuple(float(x) for x in bbox), int((loop_totals - 2).sum())
 
 ### Working on position
 
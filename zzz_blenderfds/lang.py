@@ -3,6 +3,7 @@
 import re, os.path
 
 import bpy
+import numpy as np
 from bpy.types import Scene, Object, Material
 from bpy.types import Operator, PropertyGroup, UIList
 from bpy.props import *  # TODO Specify!
@@ -171,6 +172,30 @@ class OP_XB_center_voxels(BFNoAutoUIMod, BFNoAutoExportMod, BFProp):
         "default": False,
     }
 
+@subscribe
+class OP_XB_mesh_voxel(BFNoAutoUIMod, BFNoAutoExportMod, BFProp):
+    label = "Voxel Size from MESH"
+    description = "Voxelize the part inside each MESH at its cell size, aligned to its cells"
+    bpy_type = Object
+    bpy_idname = "bf_xb_mesh_voxel"
+    bpy_prop = BoolProperty
+    bpy_other =  {
+        "update": update_bf_xb_voxel_size,
+        "default": False,
+    }
+
+@subscribe
+class OP_XB_merge_faces(BFNoAutoUIMod, BFNoAutoExportMod, BFProp):
+    label = "Merge Faces"
+    description = "Merge abutting coplanar faces into larger rectangles, same covered area"
+    bpy_type = Object
+    bpy_idname = "bf_xb_merge_faces"
+    bpy_prop = BoolProperty
+    bpy_other =  {
+        "update": update_bf_xb_voxel_size,
+        "default": False,
+    }
+
 def update_bf_default_voxel_size(self, context):
     """Update function for bf_xb_custom_voxel"""
     # Del all tmp objects and all cached geometry
@@ -214,7 +239,7 @@ def update_bf_xb(self, context):
 
 @subscribe
 class OP_XB(BFXBProp):
-    bf_props = OP_XB_custom_voxel, OP_XB_voxel_size, OP_XB_center_voxels
+    bf_props = OP_XB_custom_voxel, OP_XB_voxel_size, OP_XB_center_voxels, OP_XB_mesh_voxel, OP_XB_merge_faces
     bpy_other = {
         "update": update_bf_xb,
         "items": (
@@ -231,17 +256,49 @@ class OP_XB(BFXBProp):
 
     def _draw_body(self, context, layout):
         super()._draw_body(context, layout)
+        if self.element.bf_xb == "FACES":
+            row = layout.row()
+            row.prop(self.element, "bf_xb_merge_faces")
+            return
         if not self.element.bf_xb in ("VOXELS", "PIXELS"):
             return
+        # voxel size from MESH
+        has_mesh_voxel = self.element.bf_xb == "VOXELS" and self.element.bf_xb_mesh_voxel
+        if self.element.bf_xb == "VOXELS":
+            row = layout.row()
+            row.prop(self.element, "bf_xb_mesh_voxel")
         # center voxels
         row = layout.row()
         row.prop(self.element, "bf_xb_center_voxels")
+        row.active = not has_mesh_voxel
         # voxel_size
         row = layout.row()
         layout_export, layout_custom = row.column(), row.column()
         layout_export.prop(self.element, "bf_xb_custom_voxel", text="")
         layout_custom.prop(self.element, "bf_xb_voxel_size")
         layout_custom.active = self.element.bf_xb_custom_voxel
+        row.active = not has_mesh_voxel
+        # estimate
+        if not self.element.get("ob_to_xbs_cache"):
+            layout.label(text=self._get_estimate_msg(context))
+
+    def _get_estimate_msg(self, context):
+        voxels, boxes, memory, runtime = geometry.to_fds.ob_to_xbs_estimate(context, self.element)
+        return "Estimate: ~{0:.0f} boxes from ~{1:.0f} voxels, {2:.0f} MB, {3:.1f} s".format(
+            boxes, voxels, memory / 1E6, runtime,
+        )
+
+    def check(self, context):
+        if self.element.bf_xb not in ("VOXELS", "PIXELS") or self.element.get("ob_to_xbs_cache"):
+            return
+        boxes = geometry.to_fds.ob_to_xbs_estimate(context, self.element)[1]
+        # The estimate is rough, never refuse the export on it
+        if boxes > context.scene.bf_config_voxel_max:
+            self.infos.append("Too many boxes estimated (~{0:.0f} > {1}), increase voxel size".format(
+                boxes, context.scene.bf_config_voxel_max,
+            ))
+        elif boxes > context.scene.bf_config_voxel_warn:
+            self.infos.append("Many boxes estimated (~{0:.0f}), consider increasing voxel size".format(boxes))
 
     def _format_xb(self, value):
         return "XB={0[0]:.6f},{0[1]:.6f},{0[2]:.6f},{0[3]:.6f},{0[4]:.6f},{0[5]:.6f}".format(value)
@@ -285,10 +342,9 @@ class OP_XB(BFXBProp):
             return None
         # Correct for scale_lenght
         scale_length = context.scene.unit_settings.scale_length
-        xbs = [[coo * scale_length for coo in xb] for xb in xbs]
         # Prepare
         if len(xbs) == 1:
-            return self._format_xb(xbs[0])
+            return self._format_xb([coo * scale_length for coo in xbs[0]])
         else:
             _format_xb = {
                 "IDI" :   self._format_xb_idi,
@@ -301,7 +357,11 @@ class OP_XB(BFXBProp):
                 "IDXYZ" : self._format_xb_idxyz,
             }[self.element.bf_id_suffix]
             name = self.element.name
-            return [_format_xb(xb, name, i) for i, xb in enumerate(xbs)]
+            # Lazily formatted, the namelist can stop at max_lines
+            return (
+                _format_xb([coo * scale_length for coo in xb], name, i)
+                for i, xb in enumerate(xbs)
+            )
 
     def from_fds(self, context, value):
         try:
@@ -398,10 +458,9 @@ class OP_XYZ(BFXYZProp):
         if not xyzs: return None
         # Correct for scale_lenght
         scale_length = context.scene.unit_settings.scale_length
-        xyzs = [[coo * scale_length for coo in xyz] for xyz in xyzs]
         # Prepare
         if len(xyzs) == 1:
-            return self._format_xyz(xyzs[0])
+            return self._format_xyz([coo * scale_length for coo in xyzs[0]])
         else:
             _format_xyz = {
                 "IDI" :   self._format_xyz_idi,
@@ -414,7 +473,11 @@ class OP_XYZ(BFXYZProp):
                 "IDXYZ" : self._format_xyz_idxyz,
             }[self.element.bf_id_suffix]
             name = self.element.name
-            return [_format_xyz(xyz, name, i) for i, xyz in enumerate(xyzs)]
+            # Lazily formatted, the namelist can stop at max_lines
+            return (
+                _format_xyz([coo * scale_length for coo in xyz], name, i)
+                for i, xyz in enumerate(xyzs)
+            )
 
     def from_fds(self, context, value):
         try:
@@ -494,10 +557,9 @@ class OP_PB(BFPBProp):
             return None
         # Correct for scale_lenght
         scale_length = context.scene.unit_settings.scale_length
-        pbs = [[pb[0], pb[1] * scale_length] for pb in pbs]
         # Prepare
         if len(pbs) == 1:
-            return self._format_pb(pbs[0])
+            return self._format_pb([pbs[0][0], pbs[0][1] * scale_length])
         else:
             _format_pb = { # TODO risk of name clash _format_pb self._format_pb. Elsewhere?
                 "IDI" :   self._format_pb_idi,
@@ -510,7 +572,11 @@ class OP_PB(BFPBProp):
                 "IDXYZ" : self._format_pb_idxyz,
             }[self.element.bf_id_suffix]
             name = self.element.name
-            return [_format_pb(pb, name, i) for i, pb in enumerate(pbs)]
+            # Lazily formatted, the namelist can stop at max_lines
+            return (
+                _format_pb([pb[0], pb[1] * scale_length], name, i)
+                for i, pb in enumerate(pbs)
+            )
 
     def from_fds(self, context, value):
         try:
@@ -677,12 +743,74 @@ class SP_config_min_face_area(BFProp):
         "default": 1E-08,
     }
 
+@subscribe
+class SP_config_voxel_strategy(BFProp):
+    label = "Voxel Merging"
+    description = "Strategy for merging voxels into boxes"
+    bpy_type = Scene
+    bpy_idname = "bf_config_voxel_strategy"
+    bpy_prop = EnumProperty
+    bpy_other = {
+        "items": (
+            ("SWEEP", "Sweep", "Fast, grow boxes by sort and sweep along each axis", 100),
+            ("GREEDY", "Greedy", "Slower, grow maximal boxes on the voxel grid, less boxes on large solids", 200),
+        ),
+        "update": update_bf_default_voxel_size,
+        "default": "SWEEP",
+    }
+
+@subscribe
+class SP_config_voxel_warn(BFProp):
+    label = "Warn Voxel Boxes"
+    description = "Warn when voxelization is estimated to produce more boxes"
+    bpy_type = Scene
+    bpy_idname = "bf_config_voxel_warn"
+    bpy_prop = IntProperty
+    bpy_other = {
+        "min": 1,
+        "default": 20000,
+    }
+
+@subscribe
+class SP_config_voxel_max(BFProp):
+    label = "Max Voxel Boxes"
+    description = "Strongly warn when voxelization is estimated to produce more boxes"
+    bpy_type = Scene
+    bpy_idname = "bf_config_voxel_max"
+    bpy_prop = IntProperty
+    bpy_other = {
+        "min": 1,
+        "default": 200000,
+    }
+
+@subscribe
+class SP_config_consolidate_obsts(BFProp):
+    label = "Consolidate OBSTs"
+    description = "When exporting, merge the voxels of OBST objects sharing all parameters but ID"
+    bpy_type = Scene
+    bpy_idname = "bf_config_consolidate_obsts"
+    bpy_prop = BoolProperty
+    bpy_other = {
+        "default": False,
+    }
+
+@subscribe
+class SP_config_subtract_holes(BFProp):
+    label = "Subtract HOLEs"
+    description = "When exporting, subtract HOLEs from voxelized OBSTs, and omit the HOLEs fully subtracted"
+    bpy_type = Scene
+    bpy_idname = "bf_config_subtract_holes"
+    bpy_prop = BoolProperty
+    bpy_other = {
+        "default": False,
+    }
+
 @subscribe
 class SN_config(BFNoAutoExportMod, BFNamelist):
     label = "Case configuration"
     enum_id = 3008
     bpy_type = Scene
-    bf_props = SP_HEAD_directory, SP_HEAD_free_text, SP_default_voxel_size, SP_config_min_edge_length, SP_config_min_face_area
+    bf_props = SP_HEAD_directory, SP_HEAD_free_text, SP_default_voxel_size, SP_config_voxel_strategy, SP_config_voxel_warn, SP_config_voxel_max, SP_config_consolidate_obsts, SP_config_subtract_holes, SP_config_min_edge_length, SP_config_min_face_area
 
 
 # TIME
@@ -1691,6 +1819,44 @@ class OP_GEOM_check_quality(BFProp):
         "default": True,
     }
 
+@subscribe
+class OP_GEOM_decimate(BFProp):
+    label = "Decimate To MESH Cells"
+    description = "Decimate exported geometry toward the smallest intersecting MESH cell size, preserving material boundaries"
+    bpy_type = Object
+    bpy_prop = BoolProperty
+    bpy_idname = "bf_geom_decimate"
+    bf_other = {
+        "default": False,
+    }
+
+@subscribe
+class OP_GEOM_binary_file(BFProp):
+    label = "Binary File"
+    description = "Export vertices and faces to a binary file in the case directory, for large geometries"
+    bpy_type = Object
+    bpy_prop = BoolProperty
+    bpy_idname = "bf_geom_binary_file"
+    bf_other = {
+        "default": False,
+    }
+
+@subscribe
+class OP_GEOM_terrain(BFProp):
+    label = "Terrain"
+    description = "Export as a terrain heightfield (IJK, XB, ZVALS), sampled at the smallest intersecting MESH cell size"
+    bpy_type = Object
+    bpy_prop = BoolProperty
+    bpy_idname = "bf_geom_terrain"
+    bf_other = {
+        "default": False,
+    }
+
+def _get_case_directory(context) -> "directory":
+    """Get the absolute case directory, or the directory of the Blender file."""
+    directory = context.scene.bf_head_directory or "//"
+    return bpy.path.abspath(directory)
+
 @subscribe
 class OP_GEOM(BFProp):
     label = "Triangulated geometry"
@@ -1700,33 +1866,83 @@ class OP_GEOM(BFProp):
     def to_fds(self, context):  # TODO improve
         # Check is performed while exporting
         # Get surf_idv, verts and faces
+        if self.element.bf_geom_terrain:
+            return self._to_fds_terrain(context)
         check = self.element.bf_geom_check_quality
         fds_surfids, fds_verts, fds_faces, msg = geometry.to_fds.ob_to_geom(context, self.element, check)
         if msg:
             self.infos.append(msg)
-        if not fds_faces:
+        if not len(fds_faces):
             return None
         # Correct for scale_lenght
         scale_length = context.scene.unit_settings.scale_length
-        fds_verts = [coo * scale_length for coo in fds_verts]
-        # Group by 3 and 4
-        verts = [t for t in zip(*[iter(fds_verts)]*3)]
-        faces = [t for t in zip(*[iter(fds_faces)]*4)]
+        verts = fds_verts.reshape(-1, 3) * scale_length
+        faces = fds_faces.reshape(-1, 4)
         # Prepare
         surfids_str = ','.join(("'{}'".format(s) for s in fds_surfids))
-        verts_str = ""
-        for v in verts:
-            verts_str += "\n            {0[0]:.6f}, {0[1]:.6f}, {0[2]:.6f},".format(v)
-        faces_str = ""
-        for f in faces:
-            faces_str += "\n            {0[0]},{0[1]},{0[2]}, {0[3]},".format(f)
+        if self.element.bf_geom_binary_file:
+            return "SURF_ID={}\n      BINARY_FILE='{}'".format(surfids_str, self._write_binary_file(context, verts, faces))
+        verts_str = "".join("\n            {0[0]:.6f}, {0[1]:.6f}, {0[2]:.6f},".format(v) for v in verts.tolist())
+        faces_str = "".join("\n            {0[0]},{0[1]},{0[2]}, {0[3]},".format(f) for f in faces.tolist())
         return "SURF_ID={}\n      VERTS={}\n      FACES={}".format(surfids_str, verts_str, faces_str)
 
+    def _to_fds_terrain(self, context):
+        """Get terrain heightfield in IJK, XB, ZVALS notation."""
+        fds_surfid, ijk, xb, zvals, msg = geometry.to_fds.ob_to_geom_terrain(context, self.element)
+        if msg:
+            self.infos.append(msg)
+        scale_length = context.scene.unit_settings.scale_length
+        xb = [v * scale_length for v in xb]
+        zvals = (zvals * scale_length).reshape(ijk[1], ijk[0])
+        zvals_str = "".join("\n            " + ", ".join("{:.3f}".format(z) for z in row) + "," for row in zvals.tolist())
+        return "SURF_ID='{}'\n      IJK={},{} XB={:.6f},{:.6f},{:.6f},{:.6f},{:.6f},{:.6f}\n      ZVALS={}".format(
+            fds_surfid, ijk[0], ijk[1], *xb, zvals_str,
+        )
+
+    def _write_binary_file(self, context, verts, faces) -> "filename":
+        """Write verts and faces to the GEOM binary file next to the exported FDS file, return its name.
+
+        The file is written only while exporting the case."""
+        filename = self._get_binary_filename(context)
+        export_filepath = context.scene.get("bf_export_filepath")
+        if not export_filepath:
+            return filename
+        filepath = os.path.join(os.path.dirname(export_filepath), filename)
+        try:
+            geometry.kernels.bingeom.write_bingeom(
+                filepath, len(self.element.material_slots), verts, faces[:, :3], faces[:, 3],
+            )
+        except IOError:
+            raise BFException(self, "GEOM binary file not writable: '{}'".format(filepath))
+        return filename
+
+    def _get_binary_filename(self, context) -> "filename":
+        """Get the GEOM binary file name from the object name, unique in the scene, ignoring case."""
+        names = sorted(set(
+            ob.name for ob in context.scene.objects
+            if ob.type == "MESH" and ob.bf_namelist_cls == "ON_GEOM" and ob.bf_geom_binary_file
+        ) | {self.element.name})
+        used = set()
+        for name in names:
+            base = bpy.path.clean_name(name)
+            filename, i = base, 1
+            while filename.lower() in used:
+                filename, i = "{}_{}".format(base, i), i + 1
+            used.add(filename.lower())
+            if name == self.element.name:
+                break
+        return "{}.bingeom".format(filename)
+
     def _draw_body(self, context, layout) -> "None":
         """Draw bpy_prop."""
         row = layout.row()
         row.prop(self.element, "bf_geom_check_quality")
         row.operator("object.bf_check_intersections")
+        row.operator("scene.bf_check_scene_intersections")
+        row = layout.row()
+        row.prop(self.element, "bf_geom_decimate")
+        row.prop(self.element, "bf_geom_binary_file")
+        layout.prop(self.element, "bf_geom_terrain")
 
 @subscribe
 class ON_GEOM(BFNamelist):
@@ -1750,7 +1966,34 @@ class ON_GEOM(BFNamelist):
         # Set ID for easier error management later
         self.element.name = tokens.get('ID', 'No ID')[0]
         # Check GEOM variants # TODO SPHERE, BIX, 2D elevation
-        if "SURF_ID" in tokens and "VERTS" in tokens and "FACES" in tokens:
+        if "SURF_ID" in tokens and "BINARY_FILE" in tokens:
+            token = tokens.pop("SURF_ID")  # Remove treated token
+            fds_surfids = isinstance(token[0], tuple) and token[0] or (token[0],)
+            token = tokens.pop("BINARY_FILE")  # Remove treated token
+            filepath = os.path.join(_get_case_directory(context), token[0])
+            try:
+                _, _, verts, faces, surfs, _ = geometry.kernels.bingeom.read_bingeom(filepath)
+                geometry.from_fds.geom_to_ob(
+                    fds_surfids, verts, np.column_stack((faces, surfs)),
+                    context, ob=self.element, name="geom_to_ob",
+                    update_center=True
+                    )
+            except Exception as err:
+                raise BFException(self, "Error while reading GEOM binary file '{}': {}".format(filepath, err))
+        elif "SURF_ID" in tokens and "ZVALS" in tokens and "IJK" in tokens and "XB" in tokens:
+            token = tokens.pop("SURF_ID")  # Remove treated token
+            fds_surfid = isinstance(token[0], tuple) and token[0][0] or token[0]
+            ijk, xb, zvals = tokens.pop("IJK")[0], tokens.pop("XB")[0], tokens.pop("ZVALS")[0]
+            try:
+                geometry.from_fds.terrain_to_ob(
+                    fds_surfid, ijk, xb, zvals,
+                    context, ob=self.element, name="terrain_to_ob",
+                    update_center=True
+                    )
+            except Exception as err:
+                raise BFException(self, str(err))
+            self.element.bf_geom_terrain = True
+        elif "SURF_ID" in tokens and "VERTS" in tokens and "FACES" in tokens:
             token = tokens.pop("SURF_ID")  # Remove treated token
             fds_surfids = isinstance(token[0], tuple) and token[0] or (token[0],)
             token = tokens.pop("VERTS")  # Remove treated token
@@ -1,6 +1,7 @@
 """BlenderFDS, types"""
 
 import bpy, time, sys
+from itertools import islice
 from bpy.props import *
 from bpy.types import Scene, Object, Material
 
@@ -338,8 +339,8 @@ class BFNamelist(_BFCommon):
 
     # Export
 
-    def format(self, context, params):
-        """Format to FDS notation."""
+    def format(self, context, params, max_lines=0):
+        """Format to FDS notation, stop multiparams after max_lines if set."""
         # Expected output:
         # ! name: info message 1
         # ! name: info message 2
@@ -352,9 +353,10 @@ class BFNamelist(_BFCommon):
         infos = [is_iterable(info) and info[0] or info for info in self.infos]
         info = "".join(("! {}\n".format(info) for info in infos))
         # Extract the first and only multiparams from params
+        # multiparams can be a generator, do not test it with is_iterable()
         multiparams = None
         for param in params:
-            if is_iterable(param):
+            if not isinstance(param, str):
                 multiparams = param
                 params.remove(param)
                 # ... then remove ordinary single ID
@@ -369,15 +371,18 @@ class BFNamelist(_BFCommon):
         # Build namelists, set body
         # &fds_label multiparam param /
         if multiparams:
-            body = "".join((
+            bodies = (
                 self.fds_separator.join(("".join((fds_label, multiparam)), param)) for multiparam in multiparams
-            ))
+            )
+            if max_lines:  # multiparams are lazily formatted up to max_lines
+                bodies = islice(bodies, max_lines)
+            body = "".join(bodies)
         else:
             body = "".join((fds_label, param))
         # Return
         return "".join((info, body))
 
-    def to_fds(self, context) -> "str or None":
+    def to_fds(self, context, max_lines=0) -> "str or None":
         """Get my exported FDS string, on error raise BFException."""
         DEBUG and print("BFDS: BFNamelist.to_fds:", str(self))
         # Check self
@@ -401,7 +406,7 @@ class BFNamelist(_BFCommon):
         if errors:
             raise BFException(self, "Following errors reported", errors)
         # Return
-        return self.format(context, params)
+        return self.format(context, params, max_lines)
 
     # Import
 
@@ -699,8 +704,10 @@ class BFScene():
                 bodies.append("\n")
         return bodies
 
-    def to_fds(self, context, with_children=False) -> "str or None":
-        """Export myself and children (full FDS case) in FDS notation."""
+    def to_fds(self, context, with_children=False, filepath=None) -> "str or None":
+        """Export myself and children (full FDS case) in FDS notation.
+
+        Auxiliary files, as GEOM binary files, are written next to filepath, if set."""
         # Init
         t0 = time.time()
         bodies = list()
@@ -711,16 +718,27 @@ class BFScene():
         bodies.extend(self._free_text_to_fds(context))
         # Materials, objects, TAIL
         if with_children:
-            bodies.extend(self._children_to_fds(context))
+            try:
+                if filepath:
+                    self["bf_export_filepath"] = filepath  # see OP_GEOM
+                if self.bf_config_consolidate_obsts:
+                    geometry.consolidate.set_consolidated(context)
+                if self.bf_config_subtract_holes:
+                    geometry.holes.set_subtracted(context)
+                bodies.extend(self._children_to_fds(context))
+            finally:
+                geometry.consolidate.del_consolidated(context)
+                if "bf_export_filepath" in self:
+                    del self["bf_export_filepath"]
             bodies.append("&TAIL /\n! Generated in {0:.0f} s.".format(
                 (time.time()-t0))
             )
         # Return
         return "".join(bodies)
 
-    def to_ge1(self, context) -> "str or None":
-        """Export my geometry in FDS GE1 notation."""
-        return geometry.to_ge1.scene_to_ge1(context, self)
+    def to_ge1(self, context, filepath) -> "None":
+        """Export my geometry in FDS GE1 notation to filepath."""
+        geometry.to_ge1.scene_to_ge1(context, self, filepath)
 
     # Import
 
@@ -866,44 +884,65 @@ class BFObject():
 
     # Export to FDS
 
-    def _myself_to_fds(self, context) -> "list":
+    def _myself_to_fds(self, context, max_lines=0) -> "list":
         """Export myself in FDS notation."""
         bodies = list()
         if self.bf_export:
-            if self.type == "MESH":
+            if self.get("bf_export_note"):  # set while exporting, see geometry.consolidate
+                bodies.append("! -- {}: {}\n".format(self.name, self["bf_export_note"]))
+            elif self.type == "MESH":
                 bf_namelist = self.bf_namelist
                 if bf_namelist:
-                    body = bf_namelist.to_fds(context)
+                    body = bf_namelist.to_fds(context, max_lines=max_lines)
                     if body:
                         bodies.append(body)  # could be None
             elif self.type == "EMPTY":
                 bodies.append("! -- {}: {}\n".format(self.name, self.bf_fyi))
         return bodies
 
-    def _children_to_fds(self, context) -> "list":
+    def _children_to_fds(self, context, max_lines=0) -> "list":
         """Export children in FDS notation."""
         # Init
         children_obs = [ob for ob in context.scene.objects if ob.parent == self]
         children_obs.sort(key=lambda k: k.name)  # Order by element name
         children_obs.sort(key=lambda k: k.bf_namelist_cls != ("ON_MESH"))
-        # Children to_fds
+        # Children to_fds, until the max_lines budget is spent
         bodies = list()
+        lines = 0
         for ob in children_obs:
-            body = ob.to_fds(context, with_children=True)
+            body = ob.to_fds(context, with_children=True,
+                max_lines=max_lines and max_lines - lines)
             if body:
                 bodies.append(body)  # could be None
+                lines += body.count("\n")
+                if max_lines and lines >= max_lines:
+                    break
         if bodies:
             bodies.append("\n")
         # Return
         return bodies
 
     def to_fds(self, context, with_children=False, max_lines=0) -> "str or None":
-        """Export myself and children in FDS notation."""
+        """Export myself and children in FDS notation.
+        If max_lines, stop formatting when max_lines lines are reached."""
         bodies = list()
-        bodies.extend(self._myself_to_fds(context))
+        # One more line to detect truncation
+        budget = max_lines and max_lines + 1
+        bodies.extend(self._myself_to_fds(context, max_lines=budget))
         if with_children:
-            bodies.extend(self._children_to_fds(context))
-        return "".join(bodies)
+            lines = sum(body.count("\n") for body in bodies)
+            if not budget or lines < budget:
+                bodies.extend(self._children_to_fds(
+                    context, max_lines=budget and budget - lines))
+        body = "".join(bodies)
+        # Truncate to max_lines and tell
+        if max_lines:
+            lines = body.splitlines(True)
+            if len(lines) > max_lines:
+                lines = lines[:max_lines]
+                lines.append("! ...truncated after {} lines\n".format(max_lines))
+                body = "".join(lines)
+        return body
 
     # Manage tmp objects
 